@@ -0,0 +1,201 @@
+#Batch conversion of many images over a process pool. Every image is
+#converted in a worker process with its own output paths, per file timings
+#and failures are reported as they finish and a JSON manifest of all
+#outputs is written at the end.
+#
+#Usage: python Batch.py <dir_or_glob> [--res hres|lres] [--dither] ...
+#   or: python Converter.py convert-batch <dir_or_glob> ...
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from imageConverter import Cache, Converter, Kernel, Metric, Profile
+import glob, json, os, sys, time, traceback
+
+#Image files under a directory or matching a glob pattern, sorted
+def findImages(source, pattern='*.png'):
+    if os.path.isdir(source):
+        return sorted(glob.glob(os.path.join(source, '**', pattern), recursive=True))
+    return sorted(glob.glob(source, recursive=True))
+
+#Output path of a converted image, mirrors the source tree under outDir
+def _outputPath(file, root, outDir, ext):
+    base = os.path.splitext(file)[0]
+    if outDir is None:
+        return base + ext
+    return os.path.join(outDir, os.path.relpath(base, root) + ext)
+
+#one cache per worker process and cache directory
+_caches = {}
+
+def _workerCache(path, maxBytes):
+    if path is None:
+        return None
+    cache = _caches.get((path, maxBytes))
+    if cache is None:
+        cache = _caches[(path, maxBytes)] = Cache.Cache(path, maxBytes)
+    return cache
+
+#Converts one image inside a worker, never raises
+#@param profile (number): 0 off, 1 profile stages, 2 also trace allocations
+#@param cache (tuple): (directory, size limit) of a shared cache or None
+#@return dict: manifest entry for the image, with 'profile' and 'trace'
+#events when profiling
+def _convertOne(file, output, preview, res, dither, colors, version, order, profile=0, cache=None, optimizer='adaptive', metric='rgb', compress=False,
+                index=False, kernel='floyd-steinberg'):
+    if profile:
+        with Profile.profiling(memory=profile > 1) as profiler:
+            entry = _convertOne(file, output, preview, res, dither, colors, version, order, 0, cache, optimizer, metric, compress, index,
+                                kernel)
+        entry['profile'] = profiler.summary()
+        entry['trace'] = profiler.trace()['traceEvents']
+        return entry
+
+    entry = {'source': file, 'output': output, 'preview': preview or None}
+    start = time.perf_counter()
+    stats = {}
+    try:
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        cache = _workerCache(*cache) if cache else None
+        hits = cache.stats['hits'] if cache else 0
+        if res == 'hres':
+            data = Converter.highRes(file, dither=dither, colors=colors, output=output, preview=preview,
+                                     version=version, order=order, stats=stats, cache=cache, optimizer=optimizer, metric=metric,
+                                     compress=compress, index=index, kernel=kernel)
+        else:
+            data = Converter.lowRes(file, colors=colors, output=output, preview=preview, dither=dither,
+                                    version=version, order=order, stats=stats, cache=cache, optimizer=optimizer, metric=metric,
+                                    compress=compress, index=index, kernel=kernel)
+        if data is None:
+            raise ValueError('image exceeds the size limit for ' + res)
+        if cache is not None:
+            entry['cache'] = 'hit' if cache.stats['hits'] > hits else 'miss'
+        entry['status'] = 'ok'
+        entry['bytes'] = len(data)
+        if 'switches' in stats:
+            entry['switches'] = stats['switches']
+        if 'compression' in stats:
+            entry['compression'] = stats['compression']
+    except Exception as e:
+        entry['status'] = 'failed'
+        entry['error'] = '%s: %s' % (type(e).__name__, e)
+        entry['traceback'] = traceback.format_exc()
+    entry['seconds'] = round(time.perf_counter() - start, 4)
+    return entry
+
+#Converts every image from source over a pool of worker processes
+#@param source (string): directory or glob pattern
+#@param outDir (string): directory for outputs, next to the images if None
+#@param workers (number): pool size, os.cpu_count() if None
+#@param previews (boolean): write <name>.preview.png next to every output
+#@param manifest (string): path of the JSON manifest, None to skip it
+#@param order (boolean): reorder the groups to save color switches, every
+#entry then reports the setBackground/setForeground calls before and after
+#@param profile (string): path of a Chrome trace of all conversions, every
+#entry then holds the per stage summary of its conversion
+#@param profileMemory (boolean): also record allocations when profiling
+#@param cache (string): directory of a conversion cache shared by the
+#workers, unchanged images are not converted again
+#@param cacheBytes (number): size limit of the cache directory
+#@param optimizer (string): custom palette selection, 'adaptive' or 'kmeans'
+#@param metric (string): color distance, 'rgb', 'redmean' or 'lab'
+#@param compress (boolean): compressed payloads, needs version 2, every
+#entry then reports its compression ratio
+#@param index (boolean): tile index for fast crops, needs version 2 without
+#compress
+#@param kernel (string): dither kernel, see Kernel
+#@return dict: manifest with one entry per image
+def convertBatch(source, res='hres', dither=False, colors=32, outDir=None, workers=None, previews=False, manifest=None, log=None, version=1, order=True,
+                 profile=None, profileMemory=False, cache=None, cacheBytes=256*2**20, optimizer='adaptive', metric='rgb', compress=False,
+                 index=False, kernel='floyd-steinberg'):
+    files = findImages(source)
+    root = source if os.path.isdir(source) else os.path.dirname(source.split('*')[0]) or '.'
+    entries = []
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        for file in files:
+            output = _outputPath(file, root, outDir, '.bytes')
+            preview = _outputPath(file, root, outDir, '.preview.png') if previews else False
+            futures.append(pool.submit(_convertOne, file, output, preview, res, dither, colors, version, order,
+                                       (2 if profileMemory else 1) if profile else 0,
+                                       (cache, cacheBytes) if cache else None, optimizer, metric, compress, index, kernel))
+
+        for future in as_completed(futures):
+            entry = future.result()
+            entries.append(entry)
+            if log is not None:
+                if entry['status'] == 'ok':
+                    log('ok      %8.3fs  %s -> %s' % (entry['seconds'], entry['source'], entry['output']))
+                else:
+                    log('FAILED  %8.3fs  %s: %s' % (entry['seconds'], entry['source'], entry['error']))
+
+    entries.sort(key=lambda e: e['source'])
+    if profile is not None:
+        events = []
+        for entry in entries:
+            events += entry.pop('trace', [])
+        with open(profile, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+    result = {
+        'settings': {'source': source, 'res': res, 'dither': dither, 'colors': colors, 'workers': workers, 'version': version, 'order': order, 'optimizer': optimizer, 'metric': metric, 'compress': compress,
+                     'index': index, 'kernel': kernel},
+        'files': entries,
+        'converted': sum(1 for e in entries if e['status'] == 'ok'),
+        'failed': sum(1 for e in entries if e['status'] != 'ok'),
+        'seconds': round(time.perf_counter() - start, 4),
+    }
+    if cache is not None:
+        result['cache'] = {
+            'hits': sum(1 for e in entries if e.get('cache') == 'hit'),
+            'misses': sum(1 for e in entries if e.get('cache') == 'miss'),
+        }
+
+    if manifest is not None:
+        with open(manifest, 'w') as f:
+            json.dump(result, f, indent=2)
+    return result
+
+def _parser():
+    parser = ArgumentParser(prog='convert-batch', description='Convert a directory or glob of images for image.lua')
+    parser.add_argument('source', help='directory (searched recursively for *.png) or glob pattern')
+    parser.add_argument('--res', choices=['hres', 'lres'], default='hres')
+    parser.add_argument('--dither', action='store_true', help='dither the images')
+    parser.add_argument('--colors', type=int, default=32, help='adaptive palette size before merging')
+    parser.add_argument('--optimizer', choices=['adaptive', 'kmeans'], default='adaptive', help='custom palette selection, kmeans fits it around the color cube')
+    parser.add_argument('--metric', choices=sorted(Metric.metrics), default='rgb', help='color distance used to pick colors')
+    parser.add_argument('--kernel', choices=sorted(Kernel.kernels), default='floyd-steinberg', help='dither kernel of --dither')
+    parser.add_argument('--format-version', type=int, choices=[1, 2], default=1, help='file format, 2 encodes horizontal runs')
+    parser.add_argument('--no-order', dest='order', action='store_false', help='keep the groups sorted by color value')
+    parser.add_argument('--compress', action='store_true', help='compress the payload, needs --format-version 2')
+    parser.add_argument('--index', action='store_true', help='tile index for fast crops, needs --format-version 2')
+    parser.add_argument('--out', default=None, help='output directory, defaults to next to every image')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the cpu count')
+    parser.add_argument('--previews', action='store_true', help='write <name>.preview.png for every image')
+    parser.add_argument('--profile', default=None, metavar='TRACE', help='profile every conversion and write a Chrome trace')
+    parser.add_argument('--profile-memory', action='store_true', help='also record allocations when profiling (slower)')
+    parser.add_argument('--cache', default=None, metavar='DIR', help='reuse conversions stored in this directory')
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MB', help='size limit of the cache directory')
+    parser.add_argument('--manifest', default=None, help='manifest path, defaults to <out>/manifest.json')
+    return parser
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    manifest = args.manifest
+    if manifest is None:
+        manifest = os.path.join(args.out or '.', 'manifest.json')
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+
+    result = convertBatch(args.source, args.res, args.dither, args.colors, args.out, args.workers,
+                          args.previews, manifest, log=print, version=args.format_version, order=args.order,
+                          profile=args.profile, profileMemory=args.profile_memory,
+                          cache=args.cache, cacheBytes=args.cache_size*2**20, optimizer=args.optimizer, metric=args.metric,
+                          compress=args.compress, index=args.index, kernel=args.kernel)
+    print('%d converted, %d failed in %.2fs, manifest: %s' % (result['converted'], result['failed'], result['seconds'], manifest))
+    if 'cache' in result:
+        print('cache: %d hits, %d misses' % (result['cache']['hits'], result['cache']['misses']))
+    return 1 if result['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
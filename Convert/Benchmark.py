@@ -0,0 +1,552 @@
+#Benchmark suite for the conversion pipeline. Converts a fixed corpus of
+#synthetic images (plus any real photos passed with --images) at hres and
+#lres sizes, with and without dithering, and times every stage separately:
+#   quantize    adaptive palette quantization of the image (PIL)
+#   palette     palette counting and pruning (_updatePalette), the
+#               custom palette of a dithered image or Palette.optimize
+#   merge       two color merge of every chunk (_initData and
+#               _updateChunkAndPalette)
+#   repaint     repainting pixels with the pruned palette (_repaintPix)
+#               or the nearest optimized palette color
+#   postInit    symbol and color bytes of every chunk (_postInit)
+#   tabularize  grouping chunks, or finding runs for format version 2
+#   table       sorting and ordering the groups (_createTable)
+#   encode      writing the bytes (_hex2bytes)
+#   dither      error diffusion (Dither.error_diffusion)
+#   other       everything else, e.g. decoding the image
+#Stage times are exclusive, a stage called from another one is not counted
+#twice. Every case also records the peak traced memory and the output size
+#of both format versions and the mean squared error of the preview against
+#the source. --optimizer kmeans picks the custom palette with
+#Palette.optimize instead of the adaptive quantization. --metric picks the
+#color distance of every stage, every case also records the mean delta E
+#(CIELAB) of the preview so the metrics can be compared. The output of both
+#versions is drawn with the Emulator, once reading blocks like image.lua
+#and once reading every field on its own, the f:read calls of both are
+#recorded and the two draws must be identical. Dithered cases are also
+#updated incrementally (Incremental.update) over fixed rectangles with the
+#pixels unchanged, which must not change a single cell. --kernel picks the dither
+#kernel (see Kernel) of the dithered cases, --kernels instead times the
+#dither of every kernel on the dithered cases and reports its error and how
+#many pixels differ from the floyd-steinberg output. --scaling times the
+#dither of the dithered cases on 1, 2, 4 ... cores with thread and process
+#workers (see Wavefront) and checks the result matches the sequential one.
+#--exact dithers the hres dithered cases with Dither.Dither and checks that
+#FastDither with exact=True gives the same pixels, then reports how many
+#pixels the pruned pair search (the default) changes against it and the
+#mean delta E between the two. Dither.Dither takes minutes per case.
+#
+#Results are written as JSON and can be compared against a stored baseline,
+#stages slower than the baseline by more than the threshold are flagged.
+#--legacy times the original pure Python pipeline (Converter._initData and
+#friends, Dither.Dither) instead, which takes minutes for dithered cases.
+#
+#Usage: python Benchmark.py [--out results.json] [--baseline baseline.json] [--threshold 0.25]
+#       python Benchmark.py --kernels [--out kernels.json]
+#       python Benchmark.py --scaling [--workers 1,2,4,8] [--out scaling.json]
+#       python Benchmark.py --exact [--only noise] [--out exact.json]
+
+from argparse import ArgumentParser
+from collections import Counter
+from contextlib import contextmanager
+from imageConverter import Converter, Dither, Emulator, Encoder, Engine, FastDither, Incremental, Kernel, Metric, Palette, Wavefront
+from PIL import Image
+import numpy as np
+import glob, json, os, platform, sys, tempfile, time, tracemalloc
+
+stages = ['quantize', 'palette', 'merge', 'repaint', 'postInit', 'tabularize', 'table', 'encode', 'dither', 'other']
+
+#image sizes per resolution, the largest each one accepts
+sizes = {'hres': (320, 200), 'lres': (160, 100)}
+
+#functions timed per stage as (module or class, attribute, stage)
+engineStages = [
+    (Engine, 'quantize', 'quantize'),
+    (FastDither, 'get_custom_palette', 'palette'),
+    (Palette, 'optimize', 'palette'),
+    (FastDither, 'error_diffusion', 'dither'),
+    (Engine, 'countPalette', 'palette'),
+    (Engine, 'prunePalette', 'palette'),
+    (Engine, 'mergeChunks', 'merge'),
+    (Engine, 'repaint', 'repaint'),
+    (Engine, 'paletteData', 'repaint'),
+    (Engine, 'chunkData', 'postInit'),
+    (Encoder, 'tabularize', 'tabularize'),
+    (Encoder, 'findRuns', 'tabularize'),
+    (Encoder, 'groupRuns', 'tabularize'),
+    (Encoder, 'createTable', 'table'),
+    (Encoder, 'createRunTable', 'table'),
+    (Encoder, 'orderTable', 'table'),
+    (Encoder, 'header', 'encode'),
+    (Encoder, 'writeTable', 'encode'),
+    (Encoder, 'writeRuns', 'encode'),
+]
+
+legacyStages = [
+    (Engine, 'quantize', 'quantize'),
+    (Dither.Dither, 'get_custom_palette', 'palette'),
+    (Dither.Dither, 'error_diffusion', 'dither'),
+    (Converter, '_updatePalette', 'palette'),
+    (Converter, '_initData', 'merge'),
+    (Converter, '_repaintPix', 'repaint'),
+    (Converter, '_postInit', 'postInit'),
+    (Converter, '_tabularizeData', 'tabularize'),
+    (Converter, '_createTable', 'table'),
+    (Converter, '_hex2bytes', 'encode'),
+]
+
+#Accumulates exclusive time per stage over wrapped functions
+class StageTimer():
+    def __init__(self):
+        self.seconds = Counter()
+        self._inner = []
+
+    def wrap(self, stage, func):
+        def timed(*args, **kwargs):
+            self._inner.append(0.0)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.seconds[stage] += elapsed - self._inner.pop()
+                if self._inner:
+                    self._inner[-1] += elapsed
+        return timed
+
+#Replaces the stage functions with timed wrappers while active
+@contextmanager
+def timedStages(timer, targets):
+    saved = [(owner, name, owner.__dict__[name]) for owner, name, stage in targets]
+    try:
+        for owner, name, stage in targets:
+            setattr(owner, name, timer.wrap(stage, getattr(owner, name)))
+        yield timer
+    finally:
+        for owner, name, func in saved:
+            setattr(owner, name, func)
+
+def _smooth(rng, w, h, scale):
+    small = (rng.random((h//scale + 2, w//scale + 2, 3))*255).astype(np.uint8)
+    return np.asarray(Image.fromarray(small).resize((w, h), Image.BICUBIC), dtype=np.float64)
+
+#Synthetic images of the corpus, deterministic for a given size
+def gradient(w, h, rng):
+    x = np.linspace(0, 255, w)[None, :]
+    y = np.linspace(0, 255, h)[:, None]
+    return np.stack([np.broadcast_to(x, (h, w)), np.broadcast_to(y, (h, w)), np.broadcast_to((x + y)/2, (h, w))], axis=-1)
+
+def noise(w, h, rng):
+    return rng.integers(0, 256, (h, w, 3))
+
+def shapes(w, h, rng):
+    img = np.zeros((h, w, 3))
+    yy, xx = np.mgrid[:h, :w]
+    for i in range(12):
+        color = rng.integers(0, 256, 3)
+        cx, cy, r = rng.integers(0, w), rng.integers(0, h), rng.integers(h//10, h//3)
+        if i % 2:
+            img[(xx - cx)**2 + (yy - cy)**2 < r*r] = color
+        else:
+            img[(abs(xx - cx) < r) & (abs(yy - cy) < r//2)] = color
+    return img
+
+#Stand-in for a photograph: smooth shapes at several scales plus fine grain
+def photo(w, h, rng):
+    img = sum(_smooth(rng, w, h, scale)*scale for scale in (4, 8, 16, 32, 64))/124
+    img += rng.normal(0, 6, img.shape)
+    return img
+
+synthetic = {'gradient': gradient, 'noise': noise, 'shapes': shapes, 'photo': photo}
+
+#Every (name, res, dither, image) case of the corpus
+def corpus(images=None, seed=1):
+    cases = []
+    sources = {}
+    for name, make in synthetic.items():
+        for res, (w, h) in sizes.items():
+            arr = make(w, h, np.random.default_rng(seed))
+            sources[(name, res)] = Image.fromarray(np.clip(arr, 0, 255).astype(np.uint8))
+
+    for path in sorted(glob.glob(os.path.join(images, '*.png'))) if images else []:
+        name = os.path.splitext(os.path.basename(path))[0]
+        im = Image.open(path).convert('RGB')
+        for res, size in sizes.items():
+            fitted = im.copy()
+            fitted.thumbnail(size)
+            sources[(name, res)] = fitted
+
+    for (name, res), im in sources.items():
+        cases.append((name, res, False, im))
+        cases.append((name, res, True, im))
+    return cases
+
+def _caseId(name, res, dither):
+    return '%s-%s-%s' % (name, res, 'dither' if dither else 'plain')
+
+#Dithers with the original Dither.Dither, which works on a file
+#@return Dither.Dither with image and custom_palette set
+def _legacyDither(im):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'image.png')
+        im.save(path)
+        #Dither collects the palette in a module global
+        del Dither.custom_palette[:]
+        return Dither.Dither(path).error_diffusion()
+
+#Converts with the original pipeline, the way highRes/lowRes used to
+def _legacyConvert(im, res, dither, colors=32):
+    res = Converter._resolution(res)
+    x_size, y_size = im.size
+    if dither:
+        result = _legacyDither(im)
+        pix = result.image.load()
+        Converter.customPalette = {color: 0 for color in result.custom_palette}
+        data = Converter._postInit(pix, x_size, y_size, res)
+    else:
+        Converter.customPalette = {}
+        pix = Image.fromarray(Engine.quantize(im, colors)).load()
+        data = Converter._initData(pix, x_size, y_size, res)
+
+    table = Converter._createTable(Converter._tabularizeData(data, res, Encoder.xWidth), res)
+    body = Converter._hex2bytes(table)
+    palette = list(Converter.customPalette)
+    Converter.customPalette = {}
+    return bytes(Encoder.header(res, x_size, y_size, palette)) + body
+
+def _convert(im, res, dither, legacy, optimizer='adaptive', metric='rgb', kernel='floyd-steinberg'):
+    if legacy:
+        return _legacyConvert(im, res, dither)
+    return Converter.convert(im, res, dither, optimizer=optimizer, metric=metric, kernel=kernel)[0]
+
+#Mean squared RGB error of a preview against its source
+def previewError(im, pixels):
+    h, w = pixels.shape[:2]
+    diff = np.asarray(im.convert('RGB'), dtype=np.float64)[:h, :w] - pixels
+    return float((diff*diff).sum(axis=-1).mean())
+
+#Mean delta E 1976 of a preview against its source
+def previewDeltaE(im, pixels):
+    h, w = pixels.shape[:2]
+    lab = Metric.get('lab')
+    d = lab(np.asarray(im.convert('RGB'))[:h, :w], pixels)
+    return float(np.sqrt(d).mean())
+
+#f:read calls image.lua makes to draw a file with buffered reads and with a
+#read per field, raises ValueError if the two draw differently
+#@return dict: 'buffered' and 'unbuffered' read counts
+def decodeReads(data):
+    buffered = Emulator.imshow(data)
+    unbuffered = Emulator.imshow(data, blockSize=1)
+    if not Emulator.sameScreen(buffered.gpu, unbuffered.gpu) or buffered.calls != unbuffered.calls:
+        raise ValueError('buffered reads draw differently')
+    return {'buffered': buffered.reads, 'unbuffered': unbuffered.reads}
+
+#Updates a dithered conversion over rectangles without changing a pixel,
+#raises ValueError if any update changes a cell
+#@return number of rectangles checked
+def checkIncremental(im, res, count=8, seed=1, kernel='floyd-steinberg'):
+    state = Incremental.convert(im, res, dither=True, kernel=kernel)
+    rng = np.random.default_rng(seed)
+    w, h = im.size
+    for i in range(count):
+        x, y = int(rng.integers(0, w - 8)), int(rng.integers(0, h - 8))
+        rect = (x, y, int(rng.integers(1, min(64, w - x))), int(rng.integers(1, min(40, h - y))))
+        changed = Incremental.update(state, im, rect)[1]
+        if changed.present().any():
+            raise ValueError('an incremental update of %s without changes changed cells' % (rect,))
+    return count
+
+#Times one case, best of repeat runs per stage
+def runCase(name, res, dither, im, repeat=3, legacy=False, optimizer='adaptive', metric='rgb', kernel='floyd-steinberg'):
+    best = None
+    for i in range(repeat):
+        timer = StageTimer()
+        with timedStages(timer, legacyStages if legacy else engineStages):
+            timer.wrap('other', _convert)(im, res, dither, legacy, optimizer, metric, kernel)
+        if best is None:
+            best = dict(timer.seconds)
+        else:
+            for stage, seconds in timer.seconds.items():
+                best[stage] = min(best.get(stage, seconds), seconds)
+
+    tracemalloc.start()
+    data = _convert(im, res, dither, legacy, optimizer, metric, kernel)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    result = {
+        'stages': {stage: round(best[stage], 6) for stage in stages if stage in best},
+        'total': round(sum(best.values()), 6),
+        'peakBytes': peak,
+        'outputBytes': {'v1': len(data)},
+        'reads': {'v1': decodeReads(data)},
+    }
+    if not legacy:
+        data, pixels = Converter.convert(im, res, dither, preview=True, version=2, optimizer=optimizer, metric=metric,
+                                         kernel=kernel)
+        result['outputBytes']['v2'] = len(data)
+        result['reads']['v2'] = decodeReads(data)
+        result['error'] = round(previewError(im, pixels), 3)
+        result['deltaE'] = round(previewDeltaE(im, pixels), 3)
+        if dither:
+            result['incrementalChecks'] = checkIncremental(im, res, kernel=kernel)
+    return result
+
+#Runs every case of the corpus
+#@param only (string): run only cases whose id contains this
+#@param log: function called with a line per finished case
+#@return dict: results for JSON output
+def run(images=None, repeat=3, legacy=False, only=None, log=None, optimizer='adaptive', metric='rgb', kernel='floyd-steinberg'):
+    results = {}
+    for name, res, dither, im in corpus(images):
+        case = _caseId(name, res, dither)
+        if only and only not in case:
+            continue
+        #the original Dither only knows 2x4 cells
+        if legacy and dither and res == 'lres':
+            continue
+        results[case] = runCase(name, res, dither, im, repeat, legacy, optimizer, metric, kernel)
+        if log is not None:
+            log('%-28s %8.4fs  %9d B peak  %6d B out  %9.1f error  %5.2f dE  %4d/%6d reads' % (case,
+                results[case]['total'], results[case]['peakBytes'], results[case]['outputBytes']['v1'],
+                results[case].get('error', 0), results[case].get('deltaE', 0),
+                results[case]['reads']['v1']['buffered'], results[case]['reads']['v1']['unbuffered']))
+
+    return {
+        'settings': {'repeat': repeat, 'legacy': legacy, 'images': images, 'optimizer': optimizer, 'metric': metric,
+                     'kernel': kernel},
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cases': results,
+    }
+
+#Dither time (best of repeat), preview error and mean delta E of every
+#kernel on the dithered cases, plus the share of pixels that differ from the
+#floyd-steinberg output
+#@return dict: results for JSON output
+def runKernels(images=None, repeat=3, only=None, log=None, metric='rgb'):
+    results = {}
+    for name, res, dither, im in corpus(images):
+        case = _caseId(name, res, dither)
+        if not dither or (only and only not in case):
+            continue
+        arr = np.asarray(im.convert('RGB'))
+        palette = FastDither.get_custom_palette(im)
+        cell = FastDither.cells[Converter._resolution(res)]
+        reference = None
+        results[case] = {}
+        for kernel in [Kernel.floydSteinberg.name] + sorted(set(Kernel.kernels) - {Kernel.floydSteinberg.name}):
+            best = None
+            for i in range(repeat):
+                start = time.perf_counter()
+                pixels = FastDither.error_diffusion(arr, palette, cell=cell, metric=metric, kernel=kernel)
+                seconds = time.perf_counter() - start
+                best = seconds if best is None else min(best, seconds)
+            if reference is None:
+                reference = pixels
+            results[case][kernel] = {
+                'seconds': round(best, 6),
+                'error': round(previewError(im, pixels), 3),
+                'deltaE': round(previewDeltaE(im, pixels), 3),
+                'changed': round(float((pixels != reference).any(axis=-1).mean()), 4),
+            }
+            if log is not None:
+                log('%-28s %-16s %8.4fs  %9.1f error  %5.2f dE  %5.1f%% changed' % (case, kernel, best,
+                    results[case][kernel]['error'], results[case][kernel]['deltaE'], 100*results[case][kernel]['changed']))
+
+    return {
+        'settings': {'repeat': repeat, 'images': images, 'metric': metric},
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'kernels': results,
+    }
+
+#Default worker counts of runScaling: powers of 2 up to the cpu count
+def _workerCounts():
+    counts = [1]
+    while counts[-1]*2 <= (os.cpu_count() or 1):
+        counts.append(counts[-1]*2)
+    return counts
+
+#Dither time (best of repeat) of every dithered case on every worker count
+#and mode, and the speedup over one worker. Raises ValueError if a parallel
+#result differs from the sequential one
+#@param workers (list): worker counts, powers of 2 up to the cpu count if None
+#@return dict: results for JSON output
+def runScaling(images=None, repeat=3, only=None, log=None, workers=None, kernel='floyd-steinberg'):
+    workers = workers or _workerCounts()
+    results = {}
+    for name, res, dither, im in corpus(images):
+        case = _caseId(name, res, dither)
+        if not dither or (only and only not in case):
+            continue
+        arr = np.asarray(im.convert('RGB'))
+        palette = FastDither.get_custom_palette(im)
+        cell = FastDither.cells[Converter._resolution(res)]
+        reference = FastDither.error_diffusion(arr, palette, cell=cell, kernel=kernel)
+        results[case] = {}
+        for mode in Wavefront.modes:
+            results[case][mode] = {}
+            for count in workers:
+                best = None
+                for i in range(repeat):
+                    start = time.perf_counter()
+                    pixels = FastDither.error_diffusion(arr, palette, cell=cell, kernel=kernel, workers=count, mode=mode)
+                    seconds = time.perf_counter() - start
+                    best = seconds if best is None else min(best, seconds)
+                if not np.array_equal(pixels, reference):
+                    raise ValueError('%s dithers differently on %d %s workers' % (case, count, mode))
+                results[case][mode][str(count)] = round(best, 6)
+            base = results[case][mode][str(workers[0])]
+            if log is not None:
+                log('%-28s %-8s %s' % (case, mode, '  '.join('%d: %.4fs %.2fx' % (count, results[case][mode][str(count)],
+                    base/results[case][mode][str(count)]) for count in workers)))
+
+    return {
+        'settings': {'repeat': repeat, 'images': images, 'workers': workers, 'kernel': kernel},
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scaling': results,
+    }
+
+#Checks FastDither with exact=True against Dither.Dither on the hres
+#dithered cases, raises ValueError if a pixel or the palette differs, and
+#compares the pruned pair search (the default) against the exact output:
+#pixels that differ and the mean delta E between the two, plus the mean
+#delta E of both against the source. Images with fewer than 16 custom
+#colors are skipped, Dither.get_custom_palette fails on them
+#@param pairs (number): pairs the pruned search simulates, see FastDither
+#@return dict: results for JSON output
+def runExact(images=None, only=None, log=None, pairs=16):
+    lab = Metric.get('lab')
+    results = {}
+    for name, res, dither, im in corpus(images):
+        case = _caseId(name, res, dither)
+        #the original Dither only knows 2x4 cells
+        if not dither or res != 'hres' or (only and only not in case):
+            continue
+        palette = FastDither.get_custom_palette(im)
+        if len(palette) < 16:
+            results[case] = {'skipped': 'only %d custom colors' % len(palette)}
+            if log is not None:
+                log('%-28s skipped, only %d custom colors' % (case, len(palette)))
+            continue
+        start = time.perf_counter()
+        reference = _legacyDither(im)
+        legacySeconds = time.perf_counter() - start
+
+        if palette != [tuple(color) for color in reference.custom_palette]:
+            raise ValueError('%s: the custom palette differs from Dither' % case)
+        arr = np.asarray(im.convert('RGB'))
+        expected = np.asarray(reference.image.convert('RGB'))
+        exact = FastDither.error_diffusion(arr, palette, exact=True)
+        if exact.shape != expected.shape or not np.array_equal(exact, expected):
+            raise ValueError('%s: exact dither differs from Dither in %d pixels' % (case,
+                             (exact != expected).any(axis=-1).sum() if exact.shape == expected.shape else exact.size))
+
+        pruned = FastDither.error_diffusion(arr, palette, pairs=pairs)
+        differ = (pruned != exact).any(axis=-1)
+        results[case] = {
+            'legacySeconds': round(legacySeconds, 3),
+            'prunedPixels': int(differ.sum()),
+            'prunedShare': round(float(differ.mean()), 6),
+            'prunedDeltaE': round(float(np.sqrt(lab(exact, pruned)).mean()), 4),
+            'deltaE': {'exact': round(previewDeltaE(im, exact), 3), 'pruned': round(previewDeltaE(im, pruned), 3)},
+        }
+        if log is not None:
+            result = results[case]
+            log('%-28s exact ok  pruned %6d px %6.2f%%  %6.4f dE  source %5.2f/%5.2f dE  Dither %.1fs' % (case,
+                result['prunedPixels'], 100*result['prunedShare'], result['prunedDeltaE'], result['deltaE']['exact'],
+                result['deltaE']['pruned'], legacySeconds))
+
+    return {
+        'settings': {'images': images, 'pairs': pairs},
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'exact': results,
+    }
+
+#Stages, totals, peak memory, preview error, output sizes and reads that got
+#worse than the baseline by more than threshold (relative) and floor seconds
+#@return list of (case, metric, baseline, current)
+def compare(current, baseline, threshold=0.25, floor=0.002):
+    regressions = []
+    for case, result in current['cases'].items():
+        base = baseline['cases'].get(case)
+        if base is None:
+            continue
+
+        metrics = [('stage ' + stage, base['stages'].get(stage), seconds) for stage, seconds in result['stages'].items()]
+        metrics.append(('total', base['total'], result['total']))
+        for metric, old, new in metrics:
+            if old is not None and new > old*(1 + threshold) and new - old > floor:
+                regressions.append((case, metric, old, new))
+
+        if result['peakBytes'] > base['peakBytes']*(1 + threshold):
+            regressions.append((case, 'peakBytes', base['peakBytes'], result['peakBytes']))
+        for quality in ('error', 'deltaE'):
+            if quality in result and quality in base and result[quality] > base[quality]*(1 + threshold):
+                regressions.append((case, quality, base[quality], result[quality]))
+        for version, size in result['outputBytes'].items():
+            old = base['outputBytes'].get(version)
+            if old is not None and size > old:
+                regressions.append((case, 'outputBytes ' + version, old, size))
+        for version, reads in result['reads'].items():
+            old = base.get('reads', {}).get(version)
+            if old is not None and reads['buffered'] > old['buffered']:
+                regressions.append((case, 'reads ' + version, old['buffered'], reads['buffered']))
+    return regressions
+
+def _parser():
+    parser = ArgumentParser(prog='Benchmark', description='Time the conversion pipeline stage by stage')
+    parser.add_argument('--out', default=None, help='write the results as JSON to this file')
+    parser.add_argument('--baseline', default=None, help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='relative slowdown flagged as a regression')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case, the fastest counts')
+    parser.add_argument('--images', default=None, help='directory of additional *.png photos')
+    parser.add_argument('--only', default=None, help='run only cases whose id contains this')
+    parser.add_argument('--legacy', action='store_true', help='time the original pure Python pipeline')
+    parser.add_argument('--optimizer', choices=Converter.optimizers, default='adaptive', help='custom palette selection')
+    parser.add_argument('--metric', choices=sorted(Metric.metrics), default='rgb', help='color distance used to pick colors')
+    parser.add_argument('--kernel', choices=sorted(Kernel.kernels), default='floyd-steinberg', help='dither kernel of the dithered cases')
+    parser.add_argument('--kernels', action='store_true', help='compare the dither of every kernel instead')
+    parser.add_argument('--scaling', action='store_true', help='time the dither on several cores instead')
+    parser.add_argument('--workers', default=None, help='comma separated worker counts of --scaling')
+    parser.add_argument('--exact', action='store_true', help='check the exact dither against Dither.py and measure the pruned one instead')
+    return parser
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    if args.kernels or args.scaling or args.exact:
+        if args.kernels:
+            result = runKernels(args.images, args.repeat, args.only, log=print, metric=args.metric)
+        elif args.exact:
+            result = runExact(args.images, args.only, log=print)
+        else:
+            workers = [int(count) for count in args.workers.split(',')] if args.workers else None
+            result = runScaling(args.images, args.repeat, args.only, log=print, workers=workers, kernel=args.kernel)
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(result, f, indent=2)
+        return 0
+    result = run(args.images, args.repeat, args.legacy, args.only, log=print, optimizer=args.optimizer, metric=args.metric,
+                 kernel=args.kernel)
+
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(result, baseline, args.threshold)
+        for case, metric, old, new in regressions:
+            print('REGRESSION  %-28s %-18s %s -> %s' % (case, metric, old, new))
+        print('%d regressions against %s' % (len(regressions), args.baseline))
+        return 1 if regressions else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,194 @@
+#Content addressed cache of conversions. Entries are keyed by a hash of the
+#source image pixels and every parameter that changes the output
+#(resolution, dither, colors, format version, group ordering, palette
+#optimizer, color metric) and hold the encoded .bytes, the preview pixels
+#and small metadata such as the color switch counts.
+#
+#Two tiers: an in-memory LRU in front of a size-bounded directory on disk.
+#Disk entries are written atomically, so several processes (convert-batch
+#workers) can share one directory; a hit refreshes the file time and the
+#oldest files are evicted once the directory grows past its limit.
+#
+#Every thread gets its own copy of the preview pixels, changing them never
+#changes what later hits return.
+#
+#Usage:
+#   cache = Cache.Cache('~/.cache/yai')
+#   Converter.highRes(file, cache=cache)
+#   cache.stats     hits, misses, evictions, ...
+
+from collections import Counter, OrderedDict
+import numpy as np
+import copy, hashlib, json, os, tempfile, threading
+
+#bump when the converter output changes so old entries are not reused
+cacheVersion = 1
+
+suffix = '.npz'
+
+#Hash of the pixels of a PIL image, including its mode and palette since the
+#adaptive quantization depends on them
+def imageDigest(im):
+    h = hashlib.sha256()
+    h.update(('%s %d %d;' % (im.mode, im.size[0], im.size[1])).encode())
+    if im.mode == 'P' and im.getpalette() is not None:
+        h.update(bytes(im.getpalette()))
+    h.update(im.tobytes())
+    return h.hexdigest()
+
+class Cache():
+    #@param path (string): directory of the disk tier, memory only if None
+    #@param maxBytes (number): size limit of the disk tier
+    #@param memoryBytes (number): size limit of the memory tier
+    def __init__(self, path=None, maxBytes=256*2**20, memoryBytes=32*2**20):
+        self.path = os.path.expanduser(path) if path is not None else None
+        self.maxBytes = maxBytes
+        self.memoryBytes = memoryBytes
+        self.stats = Counter()
+        self._memory = OrderedDict()
+        self._memorySize = 0
+        self._diskSize = 0
+        self._lock = threading.Lock()
+        #guards _diskSize and eviction, taken before _lock when both are held
+        self._diskLock = threading.Lock()
+
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self._diskSize = sum(size for path, size, mtime in self._files())
+
+    #Cache key of a conversion, the kernel only counts when dithering
+    def key(self, im, res, dither, colors, version, order, optimizer='adaptive', metric='rgb', compress=False, index=False,
+            kernel='floyd-steinberg'):
+        params = json.dumps([cacheVersion, res, bool(dither), colors, version, bool(order), optimizer, metric, bool(compress), bool(index),
+                             kernel if dither else None])
+        return hashlib.sha256((imageDigest(im) + params).encode()).hexdigest()
+
+    #@return (data, pixels, meta) or None, pixels and meta are copies
+    def get(self, key):
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.stats['hits'] += 1
+                self.stats['memoryHits'] += 1
+                return _copy(entry)
+
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            self.stats['diskHits'] += 1
+            self._remember(key, entry)
+        return _copy(entry)
+
+    #Stores copies of pixels and meta
+    def put(self, key, data, pixels, meta=None):
+        entry = (bytes(data), np.array(pixels, dtype=np.uint8), copy.deepcopy(dict(meta or {})))
+        with self._lock:
+            self.stats['stores'] += 1
+            self._remember(key, entry)
+        if self.path is not None:
+            self._store(key, entry)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memorySize = 0
+        if self.path is None:
+            return
+        with self._diskLock:
+            for path, size, mtime in self._files():
+                _remove(path)
+            self._diskSize = 0
+
+    def _remember(self, key, entry):
+        size = len(entry[0]) + entry[1].nbytes
+        if size > self.memoryBytes:
+            return
+        if key in self._memory:
+            old = self._memory.pop(key)
+            self._memorySize -= len(old[0]) + old[1].nbytes
+        self._memory[key] = entry
+        self._memorySize += size
+        while self._memorySize > self.memoryBytes:
+            old = self._memory.popitem(last=False)[1]
+            self._memorySize -= len(old[0]) + old[1].nbytes
+
+    def _file(self, key):
+        return os.path.join(self.path, key + suffix)
+
+    def _files(self):
+        files = []
+        for name in os.listdir(self.path):
+            if not name.endswith(suffix):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((path, st.st_size, st.st_mtime))
+        return files
+
+    def _load(self, key):
+        if self.path is None:
+            return None
+        path = self._file(key)
+        try:
+            with np.load(path) as f:
+                entry = (f['data'].tobytes(), f['pixels'], json.loads(f['meta'].tobytes().decode()))
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def _store(self, key, entry):
+        data, pixels, meta = entry
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez_compressed(f, data=np.frombuffer(data, dtype=np.uint8), pixels=pixels,
+                                    meta=np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8))
+            size = os.path.getsize(tmp)
+            os.replace(tmp, self._file(key))
+        except OSError:
+            _remove(tmp)
+            return
+
+        with self._diskLock:
+            self._diskSize += size
+            if self._diskSize > self.maxBytes:
+                self._evict()
+
+    #Removes the least recently used files until the directory fits, called
+    #with _diskLock held
+    def _evict(self):
+        files = sorted(self._files(), key=lambda f: f[2])
+        total = sum(f[1] for f in files)
+        evicted = 0
+        for path, size, mtime in files:
+            if total <= self.maxBytes:
+                break
+            if _remove(path):
+                total -= size
+                evicted += 1
+        self._diskSize = total
+        with self._lock:
+            self.stats['evictions'] += evicted
+
+#Entry with its own pixels and meta
+def _copy(entry):
+    data, pixels, meta = entry
+    return data, pixels.copy(), copy.deepcopy(meta)
+
+def _remove(path):
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,79 @@
+#Array-backed chunk records passed between the stages. A CellGrid holds the
+#symbol, background and foreground color byte of every cell of an image as
+#parallel (rows, cols) uint8 arrays, cell (r, c) is chunk number
+#r*cols + c + 1 of the .bytes tables. An optional mask marks the cells that
+#are present, e.g. the cells of an animation frame or patch that changed.
+#
+#Grids index like NumPy arrays, slicing rows and columns gives a grid
+#sharing the arrays and assigning a grid to a slice copies its present
+#cells in, absent cells of a masked grid (a delta or patch) keep the old
+#records and the copied cells become present:
+#   frame = cells[r0:r1]
+#   cells[r0:r1, c0:c1] = update
+
+import numpy as np
+
+class CellGrid():
+    #@param symbol, bg, fg: (rows, cols) arrays of color and symbol bytes
+    #@param mask: (rows, cols) boolean array of present cells, None if all are
+    def __init__(self, symbol, bg, fg, mask=None):
+        self.symbol = np.asarray(symbol, dtype=np.uint8)
+        self.bg = np.asarray(bg, dtype=np.uint8)
+        self.fg = np.asarray(fg, dtype=np.uint8)
+        self.mask = None if mask is None else np.asarray(mask, dtype=bool)
+
+    #Grid of (symbol, bg, fg) records in scan order, None records are absent
+    @classmethod
+    def fromRecords(cls, records, cols):
+        present = np.array([record is not None for record in records], dtype=bool)
+        values = np.array([record or (0, 0, 0) for record in records], dtype=np.uint8).reshape(-1, 3)
+        rows = len(records)//cols
+        symbol, bg, fg = values[:rows*cols].T.reshape(3, rows, cols)
+        return cls(symbol, bg, fg, None if present.all() else present[:rows*cols].reshape(rows, cols))
+
+    @property
+    def shape(self):
+        return self.symbol.shape
+
+    def __len__(self):
+        return self.symbol.size
+
+    def __getitem__(self, index):
+        mask = None if self.mask is None else self.mask[index]
+        return CellGrid(self.symbol[index], self.bg[index], self.fg[index], mask)
+
+    #Copies the present cells of a grid in, see the module comment
+    def __setitem__(self, index, cells):
+        if cells.mask is None:
+            self.symbol[index] = cells.symbol
+            self.bg[index] = cells.bg
+            self.fg[index] = cells.fg
+        else:
+            present = cells.mask
+            self.symbol[index] = np.where(present, cells.symbol, self.symbol[index])
+            self.bg[index] = np.where(present, cells.bg, self.bg[index])
+            self.fg[index] = np.where(present, cells.fg, self.fg[index])
+        if self.mask is not None:
+            self.mask[index] = self.mask[index] | cells.present()
+
+    def copy(self):
+        return CellGrid(self.symbol.copy(), self.bg.copy(), self.fg.copy(),
+                        None if self.mask is None else self.mask.copy())
+
+    #Boolean array of the present cells
+    def present(self):
+        if self.mask is None:
+            return np.ones(self.shape, dtype=bool)
+        return self.mask
+
+    #Grid of the cells that differ from previous, the others are absent
+    def delta(self, previous):
+        changed = (self.symbol != previous.symbol) | (self.bg != previous.bg) | (self.fg != previous.fg)
+        return CellGrid(self.symbol, self.bg, self.fg, changed & self.present())
+
+    #(symbol, bg, fg) tuples in scan order, None for absent cells
+    def records(self):
+        records = list(zip(self.symbol.ravel().tolist(), self.bg.ravel().tolist(), self.fg.ravel().tolist()))
+        if self.mask is not None:
+            records = [record if present else None for record, present in zip(records, self.mask.ravel().tolist())]
+        return records
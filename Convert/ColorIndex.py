@@ -0,0 +1,111 @@
+#Nearest color lookup for the 240 color quantized cube plus a custom palette.
+#The cube is a Cartesian grid, so its nearest color is exact per channel and
+#comes from three 256 entry tables (ties go to the lower value, same as
+#Converter.quantizedColor and Dither.takeClosest). Custom palettes have at
+#most 16 colors and are searched with a vectorized distance matrix.
+#
+#Distances follow a Metric (rgb by default). Under other metrics the nearest
+#cube color is the closest of the 8 cube colors around a color.
+
+from functools import lru_cache
+from imageConverter import Metric
+import numpy as np
+
+rv = [0, 51, 102, 153, 204, 255]
+gv = [0, 36, 73, 109, 146, 182, 216, 255]
+bv = [0, 64, 128, 192, 255]
+
+#index of the nearest level for every channel value
+def _nearestTable(values):
+    values = np.array(values)
+    diff = np.abs(np.arange(256)[:, None] - values[None, :])
+    return diff.argmin(axis=1).astype(np.int32)
+
+#index of the level for every channel value, -1 if not a level
+def _memberTable(values):
+    idx = np.full(256, -1, dtype=np.int32)
+    idx[values] = np.arange(len(values))
+    return idx
+
+_levels = [np.array(v, dtype=np.int32) for v in (rv, gv, bv)]
+_nearest = [_nearestTable(v) for v in (rv, gv, bv)]
+_member = [_memberTable(v) for v in (rv, gv, bv)]
+
+def _channels(colors):
+    colors = np.asarray(colors, dtype=np.int32).clip(0, 255)
+    return colors[..., 0], colors[..., 1], colors[..., 2]
+
+#Byte value (r*40 + g*5 + b) of cube colors, -1 for colors not in the cube
+def cube_index(colors):
+    r, g, b = _channels(colors)
+    r, g, b = _member[0][r], _member[1][g], _member[2][b]
+    return np.where((r >= 0) & (g >= 0) & (b >= 0), r*40 + g*5 + b, -1)
+
+#Nearest cube color for every color in an (..., 3) array
+def quantized(colors):
+    r, g, b = _channels(colors)
+    return np.stack([_levels[0][_nearest[0][r]], _levels[1][_nearest[1][g]], _levels[2][_nearest[2][b]]], axis=-1)
+
+#Byte value of the nearest cube color for every color in an (..., 3) array
+def quantized_index(colors):
+    r, g, b = _channels(colors)
+    return _nearest[0][r]*40 + _nearest[1][g]*5 + _nearest[2][b]
+
+#Nearest cube color under a metric, out of the 8 cube colors whose levels
+#bracket every channel
+def nearest_cube(colors, metric=None):
+    metric = Metric.get(metric)
+    if metric.name == 'rgb':
+        return quantized(colors)
+
+    colors = np.asarray(colors, dtype=np.int32).clip(0, 255)
+    bounds = []
+    for i, levels in enumerate(_levels):
+        low = np.searchsorted(levels, colors[..., i], side='right') - 1
+        bounds.append((levels[low], levels[np.minimum(low + 1, len(levels) - 1)]))
+    candidates = np.stack([np.stack([bounds[0][i], bounds[1][j], bounds[2][k]], axis=-1)
+                           for i in (0, 1) for j in (0, 1) for k in (0, 1)], axis=-2)
+    d = metric.distance(metric.transform(candidates), metric.transform(colors)[..., None, :])
+    return np.take_along_axis(candidates, d.argmin(axis=-1)[..., None, None], axis=-2)[..., 0, :]
+
+def squared_distance(colors1, colors2):
+    diff = np.asarray(colors1, dtype=np.int32) - np.asarray(colors2, dtype=np.int32)
+    return (diff*diff).sum(axis=-1)
+
+class ColorIndex():
+    #@param metric: Metric or metric name, rgb if None
+    def __init__(self, palette=(), metric=None):
+        self.palette = np.array(palette, dtype=np.int32).reshape(-1, 3)
+        self.metric = Metric.get(metric)
+        self._palette = self.metric.transform(self.palette)
+
+    def __len__(self):
+        return len(self.palette)
+
+    #Distance from every color to every custom palette color
+    def distances(self, colors):
+        colors = self.metric.transform(np.asarray(colors, dtype=np.int32))
+        return self.metric.distance(colors[..., None, :], self._palette)
+
+    #Indices of the k nearest custom colors, closest first and ties in
+    #palette order. Returns an (..., k) array
+    def nearest_custom(self, colors, k=1):
+        d = self.distances(colors)
+        return np.argsort(d, axis=-1, kind='stable')[..., :min(k, len(self.palette))]
+
+    #Nearest color out of the cube and custom palette. Ties go to the custom
+    #palette like Dither.get_closest_color
+    def nearest(self, colors):
+        colors = np.asarray(colors, dtype=np.int32)
+        q = nearest_cube(colors, self.metric)
+        if not len(self.palette):
+            return q
+        c = self.palette[self.nearest_custom(colors)[..., 0]]
+        useQuant = self.metric(q, colors) < self.metric(c, colors)
+        return np.where(useQuant[..., None], q, c)
+
+#Cached index for a palette given as a tuple of RGB tuples, built once per
+#process and palette
+@lru_cache(maxsize=64)
+def get_index(palette=(), metric=None):
+    return ColorIndex(palette, metric)
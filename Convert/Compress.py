@@ -0,0 +1,100 @@
+#LZSS compression of the payload of compressed .bytes files (see Encoder,
+#flagCompressed). image.lua undoes it while streaming and only keeps the
+#last window bytes it decoded, so the format stays byte oriented:
+#   block:   flag byte, then up to 8 items. Bit i (lowest first) of the
+#            flag byte is 1 if item i is a literal, 0 if it is a match
+#   literal: one byte copied to the output
+#   match:   two bytes dddddddd ddddllll, copies l + minMatch bytes starting
+#            d + 1 bytes back in the output, the copy may overlap itself
+#The stream ends with the data, the last block may hold fewer than 8 items.
+#
+#Usage:
+#   packed = Compress.compress(payload)
+#   payload = Compress.decompress(packed)
+
+#bytes a match can reach back and its length range
+window = 4096
+minMatch = 3
+maxMatch = 18
+
+#earlier positions with the same 3 bytes tried per match
+chainLength = 32
+
+#LZSS stream of data, greedy longest match over hash chains
+#@return bytes
+def compress(data):
+    data = bytes(data)
+    size = len(data)
+    out = bytearray()
+    chains = {}
+    flagPos = 0
+    bit = 8
+    pos = 0
+
+    while pos < size:
+        if bit == 8:
+            flagPos = len(out)
+            out.append(0)
+            bit = 0
+
+        best = bestPos = 0
+        chain = chains.get(data[pos:pos + minMatch]) if pos + minMatch <= size else None
+        if chain:
+            limit = min(maxMatch, size - pos)
+            for candidate in reversed(chain):
+                if pos - candidate > window:
+                    break
+                length = minMatch
+                while length < limit and data[candidate + length] == data[pos + length]:
+                    length += 1
+                if length > best:
+                    best, bestPos = length, candidate
+                    if length == limit:
+                        break
+
+        if best:
+            distance = pos - bestPos - 1
+            out.append(distance >> 4)
+            out.append((distance & 15) << 4 | (best - minMatch))
+            step = best
+        else:
+            out[flagPos] |= 1 << bit
+            out.append(data[pos])
+            step = 1
+        bit += 1
+
+        for p in range(pos, min(pos + step, size - minMatch + 1)):
+            chain = chains.setdefault(data[p:p + minMatch], [])
+            chain.append(p)
+            if len(chain) > 2*chainLength:
+                del chain[:-chainLength]
+        pos += step
+    return bytes(out)
+
+#Data of an LZSS stream, raises ValueError on streams compress cannot produce
+#@return bytes
+def decompress(data):
+    out = bytearray()
+    size = len(data)
+    pos = 0
+    while pos < size:
+        flags = data[pos]
+        pos += 1
+        for bit in range(8):
+            if pos >= size:
+                break
+            if flags >> bit & 1:
+                out.append(data[pos])
+                pos += 1
+                continue
+            if pos + 1 >= size:
+                raise ValueError('truncated match at byte %d' % pos)
+            distance = (data[pos] << 4 | data[pos + 1] >> 4) + 1
+            length = (data[pos + 1] & 15) + minMatch
+            pos += 2
+            if distance > len(out):
+                raise ValueError('match reaches before the start at byte %d' % pos)
+            start = len(out) - distance
+            for i in range(length):
+                out.append(out[start + i])
+    return bytes(out)
@@ -5,8 +5,9 @@ Converts images to data format for displaying with image.lua
 @author: schnwil
 '''
 from PIL import Image
-from imageConverter import Dither
-import urllib.request, urllib.parse, sys, math
+from imageConverter import ColorIndex, Encoder, Engine, FastDither, Kernel, Metric, Palette, Profile, Wavefront
+import numpy as np
+import urllib.request, urllib.parse, sys, math, os, io
 
 rv = [0, 51, 102, 153, 204, 255]
 gv = [0, 36, 73, 109, 146, 182, 216, 255]
@@ -27,8 +28,15 @@ vers = 1
 hres = 32
 lres = 16
 customPalette = {}
+#custom palette selection, see convert
+optimizers = ('adaptive', 'kmeans')
 quantizedColors = _get_quantized_colors()
 
+#Legacy pure Python pipeline, from _getPix down to _initData together with
+#_tabularizeData, _createTable and _hex2bytes. convert no longer calls it,
+#it stays as the reference baseline of Benchmark --legacy, see
+#Benchmark._legacyConvert
+
 #Returns the RGB value at location and updates chunk
 def _getPix(pix, x, y, chunk, mode='RGB'):
     if mode == 'RGB':
@@ -88,19 +96,17 @@ def _updatePalette():
         eMin = 10000000
     
     quantizedReplacements = {}
-    customReplacements = {}    
-    for color in replacedColors:
-        e1 = 10000000
-        
-        for color1 in customPalette:
-            e2 = _getColorDist(color1, color)
-            if e2 < e1:
-                e1 = e2
-                customReplacements[color] = color1
-        for color1 in quantizedColors:
-            e2 = _getColorDist(color1, color)
-            if e2 < e1:
-                quantizedReplacements[color] = color1   
+    customReplacements = {}
+    replaced = list(replacedColors)
+    index = ColorIndex.get_index(tuple(customPalette))
+    
+    custom = index.palette[index.nearest_custom(replaced)[:, 0]]
+    quant = ColorIndex.quantized(replaced)
+    useQuant = ColorIndex.squared_distance(quant, replaced) < ColorIndex.squared_distance(custom, replaced)
+    for color, c1, c2, q in zip(replaced, custom.tolist(), quant.tolist(), useQuant.tolist()):
+        customReplacements[color] = tuple(c1)
+        if q:
+            quantizedReplacements[color] = tuple(c2)
     return customReplacements, quantizedReplacements
 
 def _repaintPix(pix, x_size, y_size):
@@ -126,8 +132,6 @@ def _repaintPix(pix, x_size, y_size):
     return pix
 
 def _color2palette(color):
-    quantColor = quantizedColor(color)
-    quantizedColors.add(quantColor)
     if color in customPalette:
         customPalette[color] = customPalette[color] + 1
     else:
@@ -349,15 +353,6 @@ def _hex2bytes(data):
     
     return bytes(b)
 
-#Upload data to pastebin as unlisted and 10 minute expiration date
-#@return url: byte array of the address on pastebin
-def _paste2pastebin(data, dev_key):
-    pastebin_args = {'api_dev_key':dev_key, 'api_paste_private': 1,'api_option':'paste', 'api_paste_code':data, 'api_paste_expire_date':'10M'}
-    response = urllib.request.urlopen('http://pastebin.com/api/api_post.php', urllib.parse.urlencode(pastebin_args).encode('utf-8'))
-    url = response.read()
-    
-    return url
-
 #After repainting, get the symbols and color information for each chunk
 def _postInit(pix, x_size, y_size, res):
     ylen = 4
@@ -409,37 +404,143 @@ def _initData(pix, x_size, y_size, res):
     
     return _postInit(pix, x_size, y_size, res)
 
-#Does heavy lifting for converting raw data to table data to byte array.
-#Uploads to pastebin if dev key is provided
-def _write2file(file, data, res, x_size, y_size, dev_key=None):
-    xWidth = 160
-    if res != hres and res != lres:
-        print('Error - wrong resolution trying to write file', file=sys.stderr)
-        return 
-    
-    data = _tabularizeData(data, res, xWidth)
-    data = _createTable(data, res)
-    data = _hex2bytes(data)
+#Upload data to pastebin as unlisted and 10 minute expiration date
+#@return url: byte array of the address on pastebin
+def _paste2pastebin(data, dev_key):
+    pastebin_args = {'api_dev_key':dev_key, 'api_paste_private': 1,'api_option':'paste', 'api_paste_code':data, 'api_paste_expire_date':'10M'}
+    response = urllib.request.urlopen('http://pastebin.com/api/api_post.php', urllib.parse.urlencode(pastebin_args).encode('utf-8'))
+    url = response.read()
     
-    header = sig
-    header.append(vers)
-    header.append(res)
+    return url
+
+#Default preview location, preview.png next to the image
+def _previewPath(file, preview):
+    if preview is None:
+        return os.path.join(os.path.dirname(file), 'preview.png')
+    return preview
+
+def quantizedColor(color):
+    return tuple(ColorIndex.quantized(color).tolist())
+
+#Returns an error message if the image is too large for res, else None
+def _checkSize(x_size, y_size, res):
+    x_max, y_max = (320, 200) if res == hres else (160, 100)
+    if x_size > x_max or y_size > y_max:
+        return 'Error - Image dimensions exceed range(%d,%d)(x,y): (%d, %d)' % (x_max, y_max, x_size, y_size)
+    return None
+
+#Opens a PIL Image, (H, W, 3) array or raw PNG bytes as a PIL Image
+def _toImage(image):
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = Image.open(io.BytesIO(image))
+    elif isinstance(image, np.ndarray):
+        image = Image.fromarray(np.asarray(image, dtype=np.uint8)[..., :3])
+    return image
+
+def _resolution(res):
+    if res in ('hres', hres):
+        return hres
+    if res in ('lres', lres):
+        return lres
+    raise ValueError('unknown resolution: %r' % (res,))
+
+#Converts an image in memory. Touches no globals and no files other than
+#those of the cache passed in, so it is safe to call from several threads
+#at once
+#@param image: PIL Image, (H, W, 3) uint8 array or raw PNG bytes
+#@param res: 'hres' or 'lres' (or hres/lres)
+#@param dither (boolean): dither the image, lres dithers 1x2 half-block cells
+#@param colors (number): colors of the adaptive quantization the custom palette
+#is picked from, with or without dither
+#@param preview (boolean): also return the preview
+#@param version (number): file format, 1 or 2 (horizontal runs, see Encoder)
+#@param order (boolean): reorder the groups to save color switches
+#@param stats (dict): receives the color switches before and after ordering
+#@param cache (Cache.Cache): reuse and store results, see Cache
+#@param optimizer: 'adaptive' picks the custom palette from an adaptive
+#quantization, 'kmeans' with Palette.optimize around the color cube
+#@param metric: color distance of every stage, 'rgb', 'redmean' or 'lab'
+#@param compress (boolean): compressed payload (format version 2), stats
+#then receives the compression ratio, see Encoder.encode
+#@param index (boolean): tile index for fast crops (format version 2, not
+#compressed), tiles of Encoder.indexTile cells
+#@param kernel: dither kernel, 'floyd-steinberg', 'atkinson', 'sierra-lite'
+#or 'bayer', see Kernel
+#@param ditherWorkers (number): threads or processes that dither at once, all
+#cores if None, the result is the same for any number, see Wavefront
+#@param ditherMode: 'thread' or 'process' dither workers
+#@return data, preview: bytes of the .bytes file, (H, W, 3) uint8 array or None
+@Profile.timed('convert')
+def convert(image, res='hres', dither=False, colors=32, preview=False, version=vers, order=True, stats=None, cache=None, optimizer='adaptive', metric='rgb', compress=False,
+            index=False, kernel='floyd-steinberg', ditherWorkers=1, ditherMode='thread'):
+    res = _resolution(res)
+    im = _toImage(image)
+    x_size, y_size = im.size
+    
+    error = _checkSize(x_size, y_size, res)
+    if error:
+        raise ValueError(error)
+    if version not in Encoder.versions:
+        raise ValueError('unknown format version: %r' % (version,))
+    if optimizer not in optimizers:
+        raise ValueError('unknown palette optimizer: %r' % (optimizer,))
+    if compress and version != 2:
+        raise ValueError('compression needs format version 2')
+    if index and (version != 2 or compress):
+        raise ValueError('the tile index needs uncompressed format version 2')
+    metric = Metric.get(metric)
+    kernel = Kernel.get(kernel)
+    if ditherMode not in Wavefront.modes:
+        raise ValueError('unknown dither mode: %r' % (ditherMode,))
+    
+    if stats is None:
+        stats = {}
+    if cache is not None:
+        key = cache.key(im, res, dither, colors, version, order, optimizer, metric.name, compress, index, kernel.name)
+        entry = cache.get(key)
+        if entry is not None:
+            data, pixels, meta = entry
+            stats.update(meta)
+            return data, (pixels if preview else None)
+    
+    if optimizer == 'kmeans':
+        palette = Palette.optimize(im, metric=metric)
     
-    if res == 32:
-        header.append(int(x_size/2))
-        header.append(int(y_size/4))
+    if dither:
+        if optimizer == 'adaptive':
+            palette = FastDither.get_custom_palette(im, colors)
+        pixels = FastDither.error_diffusion(np.asarray(im.convert('RGB')), palette, cell=FastDither.cells[res], metric=metric, kernel=kernel,
+                                               workers=ditherWorkers, mode=ditherMode)
+        cells = Engine.postInit(pixels, palette, res)
+    elif optimizer == 'kmeans':
+        cells, pixels = Engine.paletteData(np.asarray(im.convert('RGB')), palette, res, metric)
     else:
-        header.append(x_size)
-        header.append(int(y_size/2))
+        cells, palette, pixels = Engine.initData(Engine.quantize(im, colors, metric), res, metric)
     
-    header.append(len(customPalette))
-    for color in customPalette:
-        for chan in color:
-            header.append(chan)
+    data = Encoder.encode(cells, res, x_size, y_size, palette, version, order, stats, compress,
+                          Encoder.indexTile if index else None)
+    if cache is not None:
+        cache.put(key, data, pixels, {name: stats[name] for name in ('switches', 'compression') if name in stats})
+    return data, (pixels if preview else None)
+
+#Converts an image file and writes the .bytes file and preview
+def _convertFile(file, res, dither, colors, dev_key, output, preview, version, order, stats, cache, optimizer, metric, compress=False, index=False,
+                 kernel='floyd-steinberg', ditherWorkers=1, ditherMode='thread'):
+    im = Image.open(file)
+    error = _checkSize(im.size[0], im.size[1], res)
+    if error:
+        print(error + '\n', file=sys.stderr)
+        return
+    
+    preview = _previewPath(file, preview)
+    data, pixels = convert(im, res, dither, colors, bool(preview), version, order, stats, cache, optimizer, metric, compress, index, kernel,
+                          ditherWorkers, ditherMode)
+    if preview:
+        Image.fromarray(pixels).save(preview)
     
-    data = bytes(header) + data
-                
-    f = open(file[:-4] + '.bytes', 'wb')
+    if output is None:
+        output = file[:-4] + '.bytes'
+    f = open(output, 'wb')
     f.write(data)
     f.close()
     
@@ -449,96 +550,132 @@ def _write2file(file, data, res, x_size, y_size, dev_key=None):
     
     return data
 
-def quantizedColor(color):
-    eMin = 10000
-    result = color
-    for quant_color in quantizedColors:
-        tmpColor = quant_color[0], quant_color[1], quant_color[2]
-        e = _getColorDist(color, tmpColor)
-        if e < eMin:
-            eMin = e
-            result = tmpColor
-    return result
-
 #Converts a 160x100 or less pixel image into data for image.lua
 #@param dev_key: string of dev key from pastebin
 #@param file: string of absolute file path to image
+#@param output: path of the .bytes file, defaults to the image path
+#@param preview: path of the preview image, False to skip it
+#@param version: file format, 1 or 2 (horizontal runs)
+#@param order: reorder the groups to save color switches
+#@param stats: dict receiving the color switches before and after ordering
+#@param cache: Cache.Cache to skip conversions done before
+#@param optimizer: custom palette selection, 'adaptive' or 'kmeans'
+#@param dither: dither the half-block cells
+#@param metric: color distance, 'rgb', 'redmean' or 'lab'
+#@param compress: compressed payload, needs version 2
+#@param index: tile index for fast crops, needs version 2 without compress
+#@param kernel: dither kernel, see Kernel
+#@param ditherWorkers: threads or processes that dither at once, see Wavefront
+#@param ditherMode: 'thread' or 'process' dither workers
 #@return url: byte array of address of uploead on pastebin
-def lowRes(file, colors=32, dev_key=None):
-    im = Image.open(file)
-
-    im = im.convert(mode='P', palette=Image.ADAPTIVE, colors=colors)
-
-    im = im.convert('RGB')
-
-    pix = im.load()
-    
-    x_size = im.size[0]
-    y_size = im.size[1]
-    
-    if x_size > 160 or y_size > 100:
-        print('Error - Image dimensions exceed range(160,100)(x,y): (%d, %d)\n' % (x_size, y_size), file=sys.stderr)
-        return
-
-    result = _initData(pix, x_size, y_size, lres)
-
-    im.save(file[:file.rfind('/')] + '/preview.png')
-    
-    return _write2file(file, result, lres, x_size, y_size, dev_key)
+def lowRes(file, colors=32, dev_key=None, output=None, preview=None, version=vers, order=True, stats=None, cache=None, optimizer='adaptive', dither=False, metric='rgb', compress=False,
+           index=False, kernel='floyd-steinberg', ditherWorkers=1, ditherMode='thread'):
+    return _convertFile(file, lres, dither, colors, dev_key, output, preview, version, order, stats, cache, optimizer, metric, compress, index, kernel,
+                        ditherWorkers, ditherMode)
 
 #Converts a 320x200 or less pixel image into data for image.lua
 #@param dev_key: string of dev key from pastebin
 #@param file: string of absolute file path to image
+#@param output: path of the .bytes file, defaults to the image path
+#@param preview: path of the preview image, False to skip it
+#@param version: file format, 1 or 2 (horizontal runs)
+#@param order: reorder the groups to save color switches
+#@param stats: dict receiving the color switches before and after ordering
+#@param cache: Cache.Cache to skip conversions done before
+#@param optimizer: custom palette selection, 'adaptive' or 'kmeans'
+#@param metric: color distance, 'rgb', 'redmean' or 'lab'
+#@param compress: compressed payload, needs version 2
+#@param index: tile index for fast crops, needs version 2 without compress
+#@param kernel: dither kernel, see Kernel
+#@param ditherWorkers: threads or processes that dither at once, see Wavefront
+#@param ditherMode: 'thread' or 'process' dither workers
 #@return url: byte array of address of uploead on pastebin
-def highRes(file, dither=False, colors=32, dev_key=None):
-    pix = None
-    im = Image.open(file)
-    x_size = im.size[0]
-    y_size = im.size[1]
-    result = ''
-    
-    if x_size > 320 or y_size > 200:
-        print('Error - Image dimensions exceed range(320,200)(x,y): (%d, %d)\n' % (x_size, y_size), file=sys.stderr)
-        return
-    
-    if dither:
-        dither = Dither.Dither(file).error_diffusion()
-        im = dither.image
-        pix = im.load()
-        global customPalette 
-        customPalette = dither.custom_palette
-        result = _postInit(pix, x_size, y_size, hres)
-    else:
-        im = im.convert(mode='P', palette=Image.ADAPTIVE, colors=colors)
-        im = im.convert('RGB')
-    
-        pix = im.load()
-        
-        result = _initData(pix, x_size, y_size, hres)
-
-    im.save(file[:file.rfind('\\')] + '\\preview.png')
-    
-    return _write2file(file, result, hres, x_size, y_size, dev_key)
+def highRes(file, dither=False, colors=32, dev_key=None, output=None, preview=None, version=vers, order=True, stats=None, cache=None, optimizer='adaptive', metric='rgb', compress=False,
+            index=False, kernel='floyd-steinberg', ditherWorkers=1, ditherMode='thread'):
+    return _convertFile(file, hres, dither, colors, dev_key, output, preview, version, order, stats, cache, optimizer, metric, compress, index, kernel,
+                        ditherWorkers, ditherMode)
 
 if __name__ == '__main__':
     filepath = ''
     res = ''
     devKey = None
-    
-    if len(sys.argv) > 3:
-        filepath = sys.argv[1]
-        res = sys.argv[2]
-        dither = sys.argv[3]
-    if len(sys.argv) > 4:    
-        devKey = sys.argv[4]
-    
-    if res == 'hres':
-        highRes(filepath, dither=dither, dev_key=devKey)
-    elif res == 'lres':
-        lowRes(filepath, dev_key=devKey)
+    dither = False
+    
+    if len(sys.argv) > 1 and sys.argv[1] == 'convert-batch':
+        from imageConverter import Batch
+        sys.exit(Batch.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'convert-tiled':
+        from imageConverter import Tiles
+        sys.exit(Tiles.main(sys.argv[2:]))
+    if len(sys.argv) > 1 and sys.argv[1] == 'convert-server':
+        from imageConverter import Server
+        sys.exit(Server.main(sys.argv[2:]))
+    
+    argv = sys.argv
+    options = {'--profile': None, '--cache': None, '--kernel': 'floyd-steinberg', '--dither-workers': '1', '--dither-mode': 'thread'}
+    for option in options:
+        if option in argv and argv.index(option) + 1 < len(argv):
+            i = argv.index(option)
+            options[option] = argv[i+1]
+            argv = argv[:i] + argv[i+2:]
+    profile = options['--profile']
+    kernel = options['--kernel']
+    ditherWorkers = int(options['--dither-workers']) or None
+    ditherMode = options['--dither-mode']
+    compress = '--compress' in argv
+    index = '--index' in argv
+    argv = [arg for arg in argv if arg not in ('--compress', '--index')]
+    cache = None
+    if options['--cache'] is not None:
+        from imageConverter import Cache
+        cache = Cache.Cache(options['--cache'])
+    
+    if len(argv) > 3:
+        filepath = argv[1]
+        res = argv[2]
+        dither = argv[3].lower() == 'true'
+    if len(argv) > 4:    
+        devKey = argv[4]
+    
+    def run():
+        stats = {}
+        version = 2 if compress or index else vers
+        if res == 'hres':
+            highRes(filepath, dither=dither, dev_key=devKey, cache=cache, version=version, stats=stats, compress=compress, index=index,
+                    kernel=kernel, ditherWorkers=ditherWorkers, ditherMode=ditherMode)
+        else:
+            lowRes(filepath, dev_key=devKey, cache=cache, dither=dither, version=version, stats=stats, compress=compress, index=index,
+                   kernel=kernel, ditherWorkers=ditherWorkers, ditherMode=ditherMode)
+        if 'compression' in stats:
+            print('Compression: %(raw)d -> %(bytes)d bytes, ratio %(ratio).2f' % stats['compression'])
+        if cache is not None:
+            print('Cache: %d hits, %d misses' % (cache.stats['hits'], cache.stats['misses']))
+    
+    if kernel not in Kernel.kernels:
+        print('unknown dither kernel: %s, one of %s' % (kernel, ', '.join(sorted(Kernel.kernels))))
+    elif ditherMode not in Wavefront.modes:
+        print('unknown dither mode: %s, one of %s' % (ditherMode, ', '.join(Wavefront.modes)))
+    elif res in ('hres', 'lres') and profile is None:
+        run()
+    elif res in ('hres', 'lres'):
+        with Profile.profiling() as profiler:
+            run()
+        profiler.save(profile)
+        for name, total in profiler.summary()['stages'].items():
+            print('%-12s %8.4fs total %8.4fs self %6d calls' % (name, total['seconds'], total['self'], total['calls']))
     else:
-        print('Usage: python <converter.py> <filepath_to_image> <resolution> <dev_key>')
+        print('Usage: python <converter.py> <filepath_to_image> <resolution> <dither> <dev_key>')
         print('<filepath_to_image>: absolute path to image')
         print('<resolution>: hres or lres')
         print('<dither>: true or false')
-        print('<dev_key>: optional pastebin developer key')
\ No newline at end of file
+        print('<dev_key>: optional pastebin developer key')
+        print('--profile <trace.json>: write a per stage timing trace')
+        print('--cache <dir>: reuse conversions stored in this directory')
+        print('--compress: compressed format version 2 file, prints the compression ratio')
+        print('--index: format version 2 file with a tile index, image.imshowCrop reads only the tiles it shows')
+        print('--kernel <name>: dither kernel, floyd-steinberg (default), atkinson, sierra-lite or bayer')
+        print('--dither-workers <n>: dither on n threads (0 for every core), same result as one')
+        print('--dither-mode <thread|process>: dither workers are threads (default) or processes')
+        print('Batch usage: python <converter.py> convert-batch <dir_or_glob> [options], see --help')
+        print('Tiled usage: python <converter.py> convert-tiled <image> --out <dir> [options], see --help')
+        print('Server usage: python <converter.py> convert-server [--port 8765] [options], see --help')
@@ -7,6 +7,7 @@
 from argparse import ArgumentParser
 from PIL import Image
 from _bisect import bisect_left
+from imageConverter import ColorIndex
 
 rv = [0, 51, 102, 153, 204, 255]
 gv = [0, 36, 73, 109, 146, 182, 216, 255]
@@ -43,33 +44,16 @@ class Dither():
         return (color1[0] - color2[0])*(color1[0] - color2[0]) + (color1[1] - color2[1])*(color1[1] - color2[1]) + (color1[2] - color2[2])*(color1[2] - color2[2])
     
     def get_closest_palette_color(self, color_in):
+        index = ColorIndex.get_index(tuple(custom_palette))
         
-        t = 1000000000 #max error
-        best_match = [0,0,0,0]
-        eMin = [t,t,t,t]
-        for color in custom_palette:
-            e = self.get_color_distance(color, color_in)
-            for i in range(4):
-                if e < eMin[i]:
-                    eMin[i] = e
-                    best_match[i] = color
-                    break
-                
         result = []
-        for color in best_match:
-            if color != 0:
-                result.append(color)
+        for i in index.nearest_custom(color_in, 4).tolist():
+            result.append(custom_palette[i])
         
         return result
 
     def get_quantized_color(self, color_in):
-        red_oldpixel, green_oldpixel, blue_oldpixel = color_in
-
-        red_newpixel = self.takeClosest(rv, red_oldpixel)[0]
-        green_newpixel = self.takeClosest(gv, green_oldpixel)[0]
-        blue_newpixel = self.takeClosest(bv, blue_oldpixel)[0]
-        
-        return red_newpixel, green_newpixel, blue_newpixel
+        return tuple(ColorIndex.quantized(color_in).tolist())
     
     def distribute_error(self, pixel, x, y, x_lim, y_lim, color_org, color_use, doBackError=True):
         pixel[x,y] = color_use
@@ -161,18 +145,23 @@ class Dither():
     
     def get_chunk_colors(self, pixel, x, y):
         colors = []
+        chunk = []
         
         for yi in range(4):
             for xi in range(2):
-                color_cur = pixel[x+xi, y+yi]
-                color_q = self.get_quantized_color(color_cur)
-                color_c = self.get_closest_palette_color(color_cur)
-                
-                if color_q not in colors:
-                    colors.append(color_q)
-                for i in range(4):
-                    if color_c[i] not in colors:
-                        colors.append(color_c[i])
+                chunk.append(pixel[x+xi, y+yi])
+        
+        index = ColorIndex.get_index(tuple(custom_palette))
+        colors_q = ColorIndex.quantized(chunk).tolist()
+        colors_c = index.nearest_custom(chunk, 4).tolist()
+        
+        for color_q, color_c in zip(colors_q, colors_c):
+            color_q = tuple(color_q)
+            if color_q not in colors:
+                colors.append(color_q)
+            for i in color_c:
+                if custom_palette[i] not in colors:
+                    colors.append(custom_palette[i])
         
         return colors
     
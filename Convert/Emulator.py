@@ -0,0 +1,669 @@
+#Offline emulator of image.lua. Parses .bytes files the way
+#image.imshowCrop, _showHRes, _showLRes and _showRuns do (including the
+#fixed 160 wide coordinates of version 1 and its loop that stops once all
+#but one cell were read), draws into a NumPy framebuffer of characters and
+#colors and counts every gpu call on the way.
+#
+#Call counts are turned into an on-screen time estimate with a Budget:
+#OpenComputers lets a computer spend a fixed call budget per tick (1/20 s)
+#and charges every gpu call a cost, once the budget is used up the
+#computer sleeps until the next tick. The default costs follow a tier 3
+#GPU and CPU, override them for other setups.
+#
+#Indexed images (indexed flag) are drawn like image._showTiles, reading
+#only the tile lists and runs of the tiles that show.
+#Animations (animated flag) are played once like image.imshow does, with the
+#gpu calls of every frame kept in Result.frames. Patches (patch flag) are
+#drawn like images, pass the gpu the patched image was drawn on.
+#Compressed payloads (compressed flag) are decoded after the palette like
+#image._inflate does.
+#
+#Files are read through a buffer of blockSize bytes like image._reader,
+#Result.reads counts the f:read calls that reach the file and
+#Result.bytesRead the bytes they return. A block size of 1 gives about the
+#reads of a decoder that reads every field on its own.
+#
+#Usage: python Emulator.py <file.bytes> [--x-off N] [--y-off N] [--x-cut N] [--y-cut N] [--budget N]
+#                          [--block-size N] [--preview out.png]
+
+from argparse import ArgumentParser
+from collections import Counter
+from imageConverter import ColorIndex
+import numpy as np
+import json, math, sys
+
+hres = 32
+lres = 16
+sig = [89, 65, 73, 76]
+version = 2
+
+#header flags of format version 2
+animated = 1
+patch = 2
+compressed = 4
+indexed = 8
+
+#bytes image.lua reads from the file at once and the LZ window of
+#compressed payloads
+blockSize = 512
+window = 4096
+
+#screen of a tier 3 GPU and screen
+xMax = 160
+yMax = 50
+
+brailleBase = 0x2800
+lowChar = 0x2584
+
+#braille dot weights in cell order (row major, 2 columns)
+dotWeights = np.array([1, 8, 2, 16, 4, 32, 64, 128], dtype=np.int32)
+
+#Cost per call and call budget per tick, modelled after a tier 3 GPU and CPU
+class Budget():
+    def __init__(self, costs=None, callBudget=1.5, tickSeconds=0.05):
+        self.costs = {
+            'set': 1/256,
+            'fill': 1/128,
+            'setBackground': 1/128,
+            'setForeground': 1/128,
+            'setPaletteColor': 1/16,
+        }
+        if costs is not None:
+            self.costs.update(costs)
+        self.callBudget = callBudget
+        self.tickSeconds = tickSeconds
+
+    #Budget spent by the given call counts
+    def cost(self, calls):
+        return sum(self.costs.get(name, 0)*count for name, count in calls.items())
+
+    #Ticks and seconds until all calls went through
+    def seconds(self, calls):
+        ticks = math.ceil(round(self.cost(calls)/self.callBudget, 9))
+        return ticks*self.tickSeconds
+
+#Stand-in for component.gpu. Keeps the character, foreground and background
+#of every cell and counts the calls made to it
+class GPU():
+    def __init__(self, width=xMax, height=yMax):
+        self.width = width
+        self.height = height
+        self.chars = np.full((height, width), 0x20, dtype=np.int32)
+        self.fg = np.full((height, width), 0xFFFFFF, dtype=np.int32)
+        self.bg = np.zeros((height, width), dtype=np.int32)
+        #default palette of a tier 3 GPU, shades of gray
+        self.palette = [(i + 1)*0x0F0F0F for i in range(16)]
+        self.background = 0x000000
+        self.foreground = 0xFFFFFF
+        self.calls = Counter()
+
+    def maxResolution(self):
+        return self.width, self.height
+
+    def getBackground(self):
+        self.calls['getBackground'] += 1
+        return self.background, False
+
+    def getForeground(self):
+        self.calls['getForeground'] += 1
+        return self.foreground, False
+
+    def setBackground(self, color):
+        self.calls['setBackground'] += 1
+        old, self.background = self.background, color
+        return old
+
+    def setForeground(self, color):
+        self.calls['setForeground'] += 1
+        old, self.foreground = self.foreground, color
+        return old
+
+    def getPaletteColor(self, index):
+        self.calls['getPaletteColor'] += 1
+        return self.palette[index]
+
+    def setPaletteColor(self, index, color):
+        self.calls['setPaletteColor'] += 1
+        self.palette[index] = color
+
+    #Writes a string starting at x, y (1 based), clipped to the screen
+    def set(self, x, y, text):
+        self.calls['set'] += 1
+        self._draw(x, y, [ord(c) for c in text])
+
+    def fill(self, x, y, w, h, char):
+        self.calls['fill'] += 1
+        for row in range(y, y + h):
+            self._draw(x, row, [ord(char)]*w)
+
+    def _draw(self, x, y, codes):
+        if y < 1 or y > self.height or not codes:
+            return
+        x0 = max(x, 1)
+        x1 = min(x + len(codes) - 1, self.width)
+        if x0 > x1:
+            return
+        row = y - 1
+        self.chars[row, x0-1:x1] = codes[x0-x:x1-x+1]
+        self.fg[row, x0-1:x1] = self.foreground
+        self.bg[row, x0-1:x1] = self.background
+
+    #Renders the cells as pixels, 2x4 per cell for hres and 1x2 for lres,
+    #the same layout as the converter preview
+    #@return (H, W, 3) uint8 array
+    def pixels(self, res=hres, width=None, height=None):
+        chars = self.chars[:height, :width]
+        fg = _rgb(self.fg[:height, :width])
+        bg = _rgb(self.bg[:height, :width])
+
+        braille = (chars >= brailleBase) & (chars < brailleBase + 256)
+        bits = np.where(braille, chars - brailleBase, 0)
+        dots = (bits[..., None] & dotWeights) != 0
+        #lower half block covers the two bottom rows of a braille cell
+        dots |= (chars == lowChar)[..., None] & (np.arange(8) >= 4)
+
+        if res == lres:
+            #top and bottom half of the cell
+            dots = np.stack([dots[..., :4].any(axis=-1), dots[..., 4:].any(axis=-1)], axis=-1)
+            ylen, xlen = 2, 1
+        else:
+            ylen, xlen = 4, 2
+
+        cells = np.where(dots[..., None], fg[:, :, None], bg[:, :, None])
+        h, w = chars.shape
+        return cells.reshape(h, w, ylen, xlen, 3).transpose(0, 2, 1, 3, 4).reshape(h*ylen, w*xlen, 3).astype(np.uint8)
+
+def _rgb(colors):
+    return np.stack([(colors >> 16) & 255, (colors >> 8) & 255, colors & 255], axis=-1)
+
+#Buffered file reader like image._reader, counts the f:read calls it makes
+class Reader():
+    def __init__(self, data, blockSize=blockSize):
+        self.data = data
+        self.blockSize = blockSize
+        self.pos = 0
+        #file positions of the buffered bytes
+        self.start = self.end = 0
+        self.reads = 0
+        self.bytesRead = 0
+
+    #False if the file ends before n bytes are buffered, see Reader:_fill
+    def _fill(self, n):
+        while self.end - self.pos < n:
+            self.reads += 1
+            if self.end >= len(self.data):
+                return False
+            end = min(len(self.data), self.end + max(self.blockSize, n - (self.end - self.pos)))
+            self.bytesRead += end - self.end
+            self.start, self.end = self.pos, end
+        return True
+
+    #Next n bytes as a tuple, None at the end of the file like Reader:bytes
+    def bytes(self, n):
+        if not self._fill(n):
+            return None
+        self.pos += n
+        return tuple(self.data[self.pos - n:self.pos])
+
+    #Next n bytes where image.lua uses the result directly
+    def need(self, n):
+        values = self.bytes(n)
+        if values is None:
+            raise ValueError('unexpected end of file at byte %d' % self.seek())
+        return values
+
+    def byte(self):
+        return self.need(1)[0]
+
+    #Seeking inside the buffer keeps it, see Reader:seek
+    def seek(self, whence='cur', offset=0):
+        if whence == 'set':
+            if not self.start <= offset <= self.end:
+                self.start = self.end = offset
+            self.pos = offset
+        return self.pos
+
+#Decoded stream of a compressed payload like image._inflate, takes the
+#compressed bytes from the reader of the file one at a time
+class Inflate(Reader):
+    def __init__(self, f):
+        self.f = f
+        self.base = f.seek()
+        self.got = []
+        self._reset()
+
+    def _reset(self):
+        self.f.seek('set', self.base)
+        self.win = {}
+        self.out = 0
+        self.flags = 0
+        self.items = 0
+        self.copyFrom = 0
+        self.copyLeft = 0
+
+    def _in(self):
+        b = self.f.bytes(1)
+        return None if b is None else b[0]
+
+    #Next decoded byte, None at the end of the payload
+    def _next(self):
+        if self.copyLeft == 0:
+            if self.items == 0:
+                self.flags = self._in()
+                if self.flags is None:
+                    return None
+                self.items = 8
+            literal = self.flags & 1
+            self.flags >>= 1
+            self.items -= 1
+
+            if literal:
+                b = self._in()
+                if b is None:
+                    return None
+                self.win[self.out % window] = b
+                self.out += 1
+                return b
+
+            hi, lo = self._in(), self._in()
+            if lo is None:
+                return None
+            self.copyFrom = self.out - (hi*16 + lo//16) - 1
+            self.copyLeft = lo % 16 + 3
+            if self.copyFrom < 0:
+                raise ValueError('match reaches before the start of the payload')
+
+        b = self.win[self.copyFrom % window]
+        self.copyFrom += 1
+        self.copyLeft -= 1
+        self.win[self.out % window] = b
+        self.out += 1
+        return b
+
+    def bytes(self, n):
+        values = []
+        for i in range(n):
+            b = self._next()
+            if b is None:
+                return None
+            values.append(b)
+        return tuple(values)
+
+    def seek(self, whence='cur', offset=0):
+        if whence == 'set':
+            if offset < self.out:
+                self._reset()
+            while self.out < offset and self._next() is not None:
+                pass
+        return self.out
+
+#Result of drawing one file
+class Result():
+    def __init__(self, gpu, reader, error=None):
+        self.gpu = gpu
+        self.calls = gpu.calls
+        self.reads = reader.reads
+        self.bytesRead = reader.bytesRead
+        self.error = error
+        #per frame of an animation {'delay': 1/100 s, 'calls': Counter}
+        self.frames = []
+
+    def seconds(self, budget=None):
+        return (budget or Budget()).seconds(self.calls)
+
+#0xRRGGBB of the 240 color bytes of the color cube
+cubeColors = [ColorIndex.rv[colorByte // 40]*65536 + ColorIndex.gv[(colorByte % 40) // 5]*256
+              + ColorIndex.bv[colorByte % 5] for colorByte in range(240)]
+
+#Color of every color byte like image._colorTable, the last 16 are the
+#custom palette colors currently set
+def _colorTable(gpu):
+    return cubeColors + [gpu.getPaletteColor(i) for i in range(16)]
+
+def _readPalette(f, gpu):
+    for i in range(f.byte()):
+        r, g, b = f.need(3)
+        gpu.setPaletteColor(i, r*65536 + g*256 + b)
+
+def _getColors(gpu):
+    return gpu.getBackground()[0], gpu.getForeground()[0]
+
+#Cell table of format version 1, see image._showHRes and image._showLRes
+def _showTable(f, gpu, res, xOff, yOff, xCut, yCut):
+    xCut += xOff
+    yCut += yOff
+    xSize, ySize = f.need(2)
+
+    if res == hres:
+        _readPalette(f, gpu)
+    if xSize > gpu.width or ySize > gpu.height:
+        return 'wrong size (x,y): %i %i' % (xSize, ySize)
+    if res == lres:
+        _readPalette(f, gpu)
+
+    bgColorCur, fgColorCur = _getColors(gpu)
+    colorTable = _colorTable(gpu)
+    bgColorPrev = fgColorPrev = None
+    char = chr(lowChar)
+    chunknum = 1
+
+    while chunknum < xSize*ySize:
+        if res == hres:
+            symbol, bg = f.need(2)
+        else:
+            bg, fg = f.need(2)
+            symbol = None
+
+        bgColor = colorTable[bg]
+        if bgColor != bgColorPrev:
+            bgColorPrev = bgColor
+            gpu.setBackground(bgColor)
+
+        if symbol != 0:
+            fgColor = colorTable[f.byte() if res == hres else fg]
+            if fgColor != fgColorPrev:
+                fgColorPrev = fgColor
+                gpu.setForeground(fgColor)
+        if res == hres:
+            char = chr(brailleBase + symbol)
+
+        fb = f.byte()
+        while fb != 255:
+            x = fb + xOff
+            y = f.byte() + yOff
+            if x <= xCut and y <= yCut:
+                gpu.set(x, y, char)
+            fb = f.byte()
+            chunknum += 1
+
+    gpu.setBackground(bgColorCur)
+    gpu.setForeground(fgColorCur)
+
+def _readSize(f, gpu):
+    xSize, ySize = f.need(2)
+    if xSize > gpu.width or ySize > gpu.height:
+        return 'wrong size (x,y): %i %i' % (xSize, ySize)
+    return None
+
+#Runs of format version 2, see image._showRuns
+#@param packed (boolean): compressed flag
+def _showRuns(f, gpu, res, xOff, yOff, xCut, yCut, packed=False):
+    error = _readSize(f, gpu)
+    if error:
+        return error
+    _readPalette(f, gpu)
+    if packed:
+        f = Inflate(f)
+
+    bgColorCur, fgColorCur = _getColors(gpu)
+    colorTable = _colorTable(gpu)
+    _drawGroups(f, gpu, res, xOff, yOff, xCut + xOff, yCut + yOff, colorTable, {}, None, packed)
+    gpu.setBackground(bgColorCur)
+    gpu.setForeground(fgColorCur)
+
+#Indexed image, the groups of a full draw or the segments of the tiles that
+#show, see image._showTiles
+def _showTiles(f, gpu, res, xOff, yOff, xCut, yCut):
+    xSize, ySize = f.need(2)
+    if xSize > gpu.width or ySize > gpu.height:
+        return 'wrong size (x,y): %i %i' % (xSize, ySize)
+    _readPalette(f, gpu)
+
+    tileWidth, tileHeight, countHi, countLo, *length = f.need(8)
+    groupCount = countHi*256 + countLo
+    groups = f.seek()
+    cols, rows = -(-xSize // tileWidth), -(-ySize // tileHeight)
+    index = groups + int.from_bytes(bytes(length), 'big')
+    lists = index + 4*cols*rows
+
+    x0, x1 = max(1, 1 - xOff), min(xSize, xCut, gpu.width - xOff)
+    y0, y1 = max(1, 1 - yOff), min(ySize, yCut, gpu.height - yOff)
+
+    bgColorCur, fgColorCur = _getColors(gpu)
+    colorTable = _colorTable(gpu)
+    colors = {}
+    if x0 <= x1 and y0 <= y1:
+        c0, c1 = (x0 - 1)//tileWidth, (x1 - 1)//tileWidth
+        r0, r1 = (y0 - 1)//tileHeight, (y1 - 1)//tileHeight
+        if c0 == 0 and r0 == 0 and c1 == cols - 1 and r1 == rows - 1:
+            _drawGroups(f, gpu, res, xOff, yOff, xCut + xOff, yCut + yOff, colorTable, colors, groupCount)
+        else:
+            offsets = {}
+            for r in range(r0, r1 + 1):
+                f.seek('set', index + 4*(r*cols + c0))
+                offsets[r] = int.from_bytes(bytes(f.need(4)), 'big')
+            segments = []
+            for r in range(r0, r1 + 1):
+                f.seek('set', lists + offsets[r])
+                for c in range(c0, c1 + 1):
+                    hi, lo = f.need(2)
+                    for s in range(hi*256 + lo):
+                        o1, o2, o3, bg, fg = f.need(5)
+                        segments.append(((o1*256 + o2)*256 + o3, bg, fg, c, r))
+            segments.sort(key=lambda segment: segment[0])
+
+            for offset, bg, fg, c, r in segments:
+                bgColor = colorTable[bg]
+                if bgColor != colors.get('bg'):
+                    colors['bg'] = bgColor
+                    gpu.setBackground(bgColor)
+                f.seek('set', groups + offset)
+                _drawRuns(f, gpu, res, xOff, yOff, xCut + xOff, yCut + yOff, colorTable[fg], colors, False,
+                          (c*tileWidth + 1, r*tileHeight + 1, (c + 1)*tileWidth, (r + 1)*tileHeight))
+
+    gpu.setBackground(bgColorCur)
+    gpu.setForeground(fgColorCur)
+
+#Frames of an animation, see image._playFrames. Delays are recorded, not
+#waited for
+#@param onFrame: function called with the gpu and frame index after every frame
+def _playFrames(f, gpu, res, xOff, yOff, xCut, yCut, loops, frames, onFrame=None, packed=False):
+    error = _readSize(f, gpu)
+    if error:
+        return error
+    _readPalette(f, gpu)
+    if packed:
+        f = Inflate(f)
+    hi, lo = f.need(2)
+    frameCount = hi*256 + lo
+    first = f.seek()
+
+    bgColorCur, fgColorCur = _getColors(gpu)
+    colorTable = _colorTable(gpu)
+    colors = {}
+    for loop in range(loops):
+        f.seek('set', first)
+        for i in range(frameCount):
+            before = Counter(gpu.calls)
+            delayHi, delayLo, groupsHi, groupsLo = f.need(4)
+            delay = delayHi*256 + delayLo
+            _drawGroups(f, gpu, res, xOff, yOff, xCut + xOff, yCut + yOff, colorTable, colors,
+                        groupsHi*256 + groupsLo, packed)
+            frames.append({'delay': delay, 'calls': gpu.calls - before})
+            if onFrame is not None:
+                onFrame(gpu, i)
+
+    gpu.setBackground(bgColorCur)
+    gpu.setForeground(fgColorCur)
+
+#Groups of runs, see image._drawGroups
+#@param colorTable (list): color of every color byte, see _colorTable
+#@param colors (dict): 'bg' and 'fg' set last, kept between calls
+#@param groups (number): groups to draw, None draws until the end of file
+#@param delta (boolean): delta coded coordinates of the compressed flag
+def _drawGroups(f, gpu, res, xOff, yOff, xCut, yCut, colorTable, colors, groups=None, delta=False):
+    drawn = 0
+    while groups is None or drawn < groups:
+        pair = f.bytes(2)
+        if pair is None:
+            break
+        drawn += 1
+
+        bgColor = colorTable[pair[0]]
+        if bgColor != colors.get('bg'):
+            colors['bg'] = bgColor
+            gpu.setBackground(bgColor)
+        _drawRuns(f, gpu, res, xOff, yOff, xCut, yCut, colorTable[pair[1]], colors, delta)
+
+#Runs of a group, see image._drawRuns
+#@param tile (tuple): first and last column and row (x0, y0, x1, y1) of a
+#tile, the runs end at the first run outside of it
+def _drawRuns(f, gpu, res, xOff, yOff, xCut, yCut, fgColor, colors, delta=False, tile=None):
+    yPrev = xEnd = 0
+    while True:
+        x = f.byte()
+        if x == 255:
+            break
+        y, n = f.need(2)
+        if tile and not (tile[0] <= x <= tile[2] and tile[1] <= y <= tile[3]):
+            break
+        if delta:
+            if y == 0:
+                x += xEnd
+            y += yPrev
+            yPrev, xEnd = y, x + n
+        x += xOff
+        y += yOff
+        fill = text = None
+        blank = False
+
+        if res == hres:
+            kind, symbol = f.need(2)
+            if kind == 1:
+                fill = chr(brailleBase + symbol)
+                blank = symbol == 0
+            else:
+                text = ''.join(chr(brailleBase + b) for b in (symbol,) + f.need(n - 1))
+        else:
+            fill = chr(lowChar)
+
+        visible = min(n, xCut - x + 1)
+        if y <= yCut and visible > 0:
+            if not blank and fgColor != colors.get('fg'):
+                colors['fg'] = fgColor
+                gpu.setForeground(fgColor)
+            if fill:
+                gpu.fill(x, y, visible, 1, fill)
+            else:
+                gpu.set(x, y, text[:visible])
+
+#Draws a .bytes file like image.imshowCrop. Errors image.lua writes to
+#stderr end up in Result.error, files image.lua would crash on raise
+#ValueError
+#@param file: bytes of the file or its path
+#@param gpu (GPU): screen to draw on, a new one if None
+#@param loops (number): times to play an animation
+#@param onFrame: function called with the gpu and frame index after every
+#frame of an animation
+#@param blockSize (number): bytes read from the file at once
+#@return Result: gpu, call counts and f:read count
+def imshowCrop(file, xOff=0, yOff=0, xCut=None, yCut=None, gpu=None, loops=1, onFrame=None, blockSize=blockSize):
+    if isinstance(file, str):
+        with open(file, 'rb') as fh:
+            file = fh.read()
+    if gpu is None:
+        gpu = GPU()
+    if xCut is None:
+        xCut = xMax - xOff
+    if yCut is None:
+        yCut = yMax - yOff
+    f = Reader(file, blockSize)
+
+    header = f.bytes(6)
+    if header is None or list(header[:4]) != sig:
+        return Result(gpu, f, 'wrong header')
+
+    vers, res = header[4:]
+    if vers < 1 or vers > version:
+        return Result(gpu, f, 'wrong version: File=%i, YAI=%i' % (vers, version))
+
+    if res != hres and res != lres:
+        return Result(gpu, f, 'unknown resolution byte')
+
+    frames = []
+    if vers == 1:
+        error = _showTable(f, gpu, res, xOff, yOff, xCut, yCut)
+    else:
+        flags = f.byte()
+        kind, packed = flags % compressed, flags >= compressed
+        if flags == indexed:
+            error = _showTiles(f, gpu, res, xOff, yOff, xCut, yCut)
+        elif flags >= 2*compressed:
+            error = 'unsupported flags: %i' % flags
+        elif kind == 0 or kind == patch:
+            error = _showRuns(f, gpu, res, xOff, yOff, xCut, yCut, packed)
+        elif kind == animated:
+            error = _playFrames(f, gpu, res, xOff, yOff, xCut, yCut, loops, frames, onFrame, packed)
+        else:
+            error = 'unsupported flags: %i' % flags
+    result = Result(gpu, f, error)
+    result.frames = frames
+    return result
+
+#Draws a .bytes file like image.imshow
+def imshow(file, xOff=0, yOff=0, gpu=None, blockSize=blockSize):
+    return imshowCrop(file, xOff, yOff, xMax - xOff, yMax - yOff, gpu, blockSize=blockSize)
+
+#Draws a patch over the image on gpu like image.applyPatch
+def applyPatch(file, xOff=0, yOff=0, gpu=None, blockSize=blockSize):
+    if isinstance(file, str):
+        with open(file, 'rb') as fh:
+            file = fh.read()
+    if file[4:5] != bytes([2]) or file[6:7] not in (bytes([patch]), bytes([patch | compressed])):
+        return Result(gpu or GPU(), Reader(file, blockSize), 'not a patch')
+    return imshow(file, xOff, yOff, gpu, blockSize)
+
+#Plays an animation like image.play
+def play(file, xOff=0, yOff=0, loops=1, gpu=None, onFrame=None, blockSize=blockSize):
+    return imshowCrop(file, xOff, yOff, xMax - xOff, yMax - yOff, gpu, loops, onFrame, blockSize)
+
+#True if two screens show the same characters and colors
+def sameScreen(a, b):
+    return all(np.array_equal(getattr(a, name), getattr(b, name)) for name in ('chars', 'fg', 'bg'))
+
+#Call counts, read count and estimated time of a file as a dict. Frames of
+#an animation that take longer to draw than their delay are 'late'
+def report(result, budget=None):
+    budget = budget or Budget()
+    out = {
+        'calls': dict(sorted(result.calls.items())),
+        'reads': result.reads,
+        'bytesRead': result.bytesRead,
+        'cost': round(budget.cost(result.calls), 4),
+        'seconds': round(budget.seconds(result.calls), 4),
+        'error': result.error,
+    }
+    if result.frames:
+        frames = []
+        for frame in result.frames:
+            seconds = budget.seconds(frame['calls'])
+            frames.append({'delay': frame['delay'], 'calls': sum(frame['calls'].values()),
+                           'seconds': round(seconds, 4), 'late': seconds > frame['delay']/100})
+        out['frames'] = frames
+    return out
+
+def main(argv=None):
+    parser = ArgumentParser(prog='Emulator', description='Draw a .bytes file like image.lua and count the gpu calls')
+    parser.add_argument('file')
+    parser.add_argument('--x-off', type=int, default=0)
+    parser.add_argument('--y-off', type=int, default=0)
+    parser.add_argument('--x-cut', type=int, default=None, help='last image column drawn, like image.imshowCrop')
+    parser.add_argument('--y-cut', type=int, default=None, help='last image row drawn')
+    parser.add_argument('--budget', type=float, default=1.5, help='call budget per tick')
+    parser.add_argument('--block-size', type=int, default=blockSize,
+                        help='bytes read from the file at once, 1 reads every field on its own')
+    parser.add_argument('--preview', default=None, help='write the rendered screen to this png')
+    args = parser.parse_args(argv)
+
+    result = imshowCrop(args.file, args.x_off, args.y_off, args.x_cut, args.y_cut, blockSize=args.block_size)
+    print(json.dumps(report(result, Budget(callBudget=args.budget)), indent=2))
+
+    if args.preview:
+        from PIL import Image
+        with open(args.file, 'rb') as fh:
+            res = fh.read(6)[5]
+        Image.fromarray(result.gpu.pixels(res)).save(args.preview)
+    return 1 if result.error else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
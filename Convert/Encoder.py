@@ -0,0 +1,515 @@
+#Binary encoder for the .bytes format read by image.lua. Works on the
+#CellGrid of an image and writes straight into a bytearray, producing the
+#same bytes as Converter._tabularizeData, _createTable and _hex2bytes
+#without going through hex strings. Cells are grouped and split into runs
+#with array operations, only the groups are handled one by one.
+#
+#Format version 2 stores horizontal runs of chunks that share their colors
+#so that image.lua draws every run with one gpu.set or gpu.fill:
+#   header: sig, 2, res, flags, xSize, ySize, paletteLen, palette
+#   group:  bg, fg, runs..., 255 (groups follow each other until EOF)
+#   run:    x, y, n and for hres a kind byte, 1 = fill with the following
+#           symbol, 0 = set the n following symbols. lres runs are always
+#           filled with the lower half block
+#Unlike version 1, coordinates are the real cell position of a run.
+#Decoders reject files with unknown flags. The animated flag (Sequence)
+#stores several frames after the palette:
+#   frames: frameCount (2 bytes), then per frame delay in 1/100 s (2 bytes),
+#           groupCount (2 bytes) and groupCount groups
+#The first frame holds every cell, the following ones only the cells that
+#changed since the frame before.
+#The patch flag (Incremental) marks a file holding only the cells of an
+#image that changed, drawn over the image it was made from. Its palette is
+#empty, the colors of the image it patches stay set.
+#
+#The compressed flag combines with the others and marks a compressed
+#payload: everything after the palette is LZSS compressed with Compress,
+#and inside every group the runs store their coordinates as deltas:
+#   run:    dx, dy, n, ... with dy the rows since the run before in the
+#           group (since row 0 for the first run) and dx the cells since
+#           the end (x + n) of the run before if dy is 0, else x itself
+#Runs of a group share rows and follow each other closely, so the deltas
+#repeat far more often than the coordinates and compress better.
+#
+#The indexed flag (encode with index) splits an image into tiles of cells
+#so that decoders can find the runs a crop shows without reading the rest:
+#   index:  tileWidth, tileHeight (cells), groupCount (2 bytes) and the
+#           length of the groups (4 bytes)
+#   groups: groupCount groups like a plain file, ordered over the whole
+#           image, every run lies inside one tile and the runs of a group
+#           are in tile order
+#   tiles:  for every tile in row major order the offset (4 bytes) of its
+#           list counted from the end of these offsets, then the lists
+#   list:   segmentCount (2 bytes), then per segment the offset of its
+#           first run counted from the start of the groups (3 bytes) and
+#           the bg, fg of its group, segments in group order
+#A segment is the runs of one group inside one tile, it ends at the first
+#run outside the tile or at the end of the group. A full draw reads the
+#groups like a plain file with the same color switches, runs end at tile
+#borders, which costs a few more fill and set calls. A crop reads the lists
+#of the tiles it shows and draws their segments in file order, so in the
+#global group order. The index needs an uncompressed payload.
+#
+#Both versions can reorder their groups with Order to save color switches,
+#decoders draw the groups in any order.
+
+from imageConverter import Compress, Order, Profile
+import numpy as np
+
+hres = 32
+lres = 16
+sig = [89, 65, 73, 76]
+vers = 1
+versions = (1, 2)
+
+#header flags of format version 2
+flagAnimated = 1
+flagPatch = 2
+flagCompressed = 4
+flagIndexed = 8
+
+#cells per tile (columns, rows) of the index
+indexTile = (16, 8)
+
+#run kinds of format version 2
+runSet = 0
+runFill = 1
+
+#Coordinate table uses a fixed row width like Converter._tabularizeData
+xWidth = 160
+
+#Runs of format version 2, start is the cell number (0 based) of the first
+#cell of the run, fg is -1 for runs of blanks and fill marks runs of one
+#repeated symbol
+runType = np.dtype([('bg', np.uint8), ('fg', np.int16), ('y', np.uint8), ('x', np.uint8),
+                    ('n', np.uint8), ('start', np.int32), ('fill', bool)])
+
+#Groups chunk numbers by (symbol, bg, fg) key in order of first appearance.
+#Blank hres chunks (symbol 0) carry no foreground, their key is (0, bg)
+#@param cells (CellGrid): cells of the whole image
+#@return list of (key, chunk numbers), chunk numbers are 1 based
+@Profile.timed('tabularize')
+def tabularize(cells, res):
+    symbol, bg, fg = (a.ravel().astype(np.int32) for a in (cells.symbol, cells.bg, cells.fg))
+    if res == hres:
+        keys = (symbol << 16) | (bg << 8) | np.where(symbol == 0, 0, fg)
+    else:
+        keys = (bg << 8) | fg
+    unique, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    #chunk numbers sorted by group, group k is numbers[ends[k] - counts[k]:ends[k]]
+    numbers = np.argsort(inverse, kind='stable') + 1
+    counts = np.bincount(inverse)
+    ends = np.cumsum(counts)
+
+    groups = []
+    appearance = np.argsort(first)
+    for key, end, count in zip(unique[appearance].tolist(), ends[appearance].tolist(), counts[appearance].tolist()):
+        if res != hres:
+            key = (key >> 8, key & 255)
+        elif key >> 16:
+            key = (key >> 16, (key >> 8) & 255, key & 255)
+        else:
+            key = (0, key >> 8)
+        groups.append((key, numbers[end - count:end]))
+    return groups
+
+#Orders the groups by background then foreground color, descending
+#@return list of (key, chunk numbers)
+@Profile.timed('table')
+def createTable(groups, res):
+    if res == hres:
+        def sortKey(item):
+            key = item[0]
+            return key[1]*1000 + (key[2] if len(key) == 3 else 0)
+    else:
+        def sortKey(item):
+            key = item[0]
+            return key[0]*1000 + key[1]
+    return sorted(groups, key=sortKey, reverse=True)
+
+#Writes the table, every group is its key, the coordinates of its chunks
+#and a 255 delimiter
+@Profile.timed('encode')
+def writeTable(table, out=None):
+    if out is None:
+        out = bytearray()
+    if not table:
+        return out
+    keys = [key for key, cells in table]
+    keyLen = np.array([len(key) for key in keys])
+    counts = np.array([len(cells) for key, cells in table])
+    groupSize = keyLen + 2*counts + 1
+    groupPos = np.cumsum(groupSize) - groupSize
+
+    buf = np.empty(int(groupSize.sum()), dtype=np.uint8)
+    buf[np.repeat(groupPos, keyLen) + np.arange(keyLen.sum()) - np.repeat(np.cumsum(keyLen) - keyLen, keyLen)] = \
+        [color for key in keys for color in key]
+    buf[groupPos + groupSize - 1] = 255
+    #screen coordinates of chunk number n in a table xWidth wide
+    n = np.concatenate([cells for key, cells in table]) - 1
+    groupOf = np.repeat(np.arange(len(table)), counts)
+    pos = groupPos[groupOf] + keyLen[groupOf] + 2*(np.arange(len(n)) - (np.cumsum(counts) - counts)[groupOf])
+    buf[pos] = n % xWidth + 1
+    buf[pos + 1] = n // xWidth + 1
+    out += buf.tobytes()
+    return out
+
+#(bg, fg) color key of a table entry, fg None if the group sets no foreground
+def _tableColors(entry, res):
+    key = entry[0]
+    if res == hres:
+        return (key[1], key[2]) if len(key) == 3 else (key[1], None)
+    return key
+
+def _runColors(entry):
+    (bg, fg), runs = entry
+    if (runs['fg'] < 0).all():
+        return bg, None
+    return bg, fg
+
+#Reorders a version 1 table or a version 2 run table with Order.orderTable
+#@param stats (dict): receives the setBackground/setForeground calls of the
+#table before and after as 'switches' {'before': (bg, fg), 'after': (bg, fg)}
+@Profile.timed('order')
+def orderTable(table, res, version=vers, stats=None):
+    if version == 1:
+        colorKey = lambda entry: _tableColors(entry, res)
+        ordered = Order.orderTable(table, colorKey, lambda entry: len(entry[1]))
+    else:
+        colorKey = _runColors
+        ordered = Order.orderTable(table, colorKey)
+
+    if stats is not None:
+        stats['switches'] = {
+            'before': Order.switchCount([colorKey(entry) for entry in table]),
+            'after': Order.switchCount([colorKey(entry) for entry in ordered]),
+        }
+    return ordered
+
+def header(res, x_size, y_size, palette, version=vers, flags=0):
+    out = bytearray(sig)
+    out.append(version)
+    out.append(res)
+    if version >= 2:
+        out.append(flags)
+    if res == hres:
+        out.append(int(x_size/2))
+        out.append(int(y_size/4))
+    else:
+        out.append(x_size)
+        out.append(int(y_size/2))
+
+    out.append(len(palette))
+    for color in palette:
+        out += bytes(color)
+    return out
+
+#Splits every row into runs of chunks with the same background and
+#foreground. Blank hres chunks (symbol 0) fit any foreground, absent cells
+#are skipped and end the run
+#@param cells (CellGrid)
+#@return runType array of the runs in scan order
+@Profile.timed('tabularize')
+def findRuns(cells, res):
+    rows, cols = cells.shape
+    size = rows*cols
+    present = cells.present().ravel()
+    symbol, bg, fg = cells.symbol.ravel(), cells.bg.ravel(), cells.fg.ravel()
+    index = np.arange(size)
+    solid = present if res != hres else present & (symbol != 0)
+
+    #runs end at the start of a row, after an absent cell and where the
+    #background changes
+    split = np.ones(size, dtype=bool)
+    split[1:] = (bg[1:] != bg[:-1]) | ~present[:-1]
+    split[::cols] = True
+    segment = np.maximum.accumulate(np.where(split, index, 0))
+    #and where the foreground differs from the last solid cell of the run
+    last = np.maximum.accumulate(np.where(solid, index, -1))
+    last = np.concatenate(([-1], last[:-1]))
+    split |= solid & (last >= segment) & (fg != fg[np.maximum(last, 0)])
+
+    starts = np.flatnonzero(split & present)
+    ends = np.flatnonzero(split | ~present)
+    ends = np.append(ends, size)[np.searchsorted(ends, starts, side='right')]
+
+    runs = np.empty(len(starts), dtype=runType)
+    if not len(starts):
+        return runs
+    first = np.minimum.reduceat(np.where(solid, index, size), starts)
+    runs['bg'] = bg[starts]
+    runs['fg'] = np.where(first < size, fg[np.minimum(first, size - 1)].astype(np.int16), -1)
+    runs['y'] = starts // cols + 1
+    runs['x'] = starts % cols + 1
+    runs['n'] = ends - starts
+    runs['start'] = starts
+    runs['fill'] = (np.minimum.reduceat(np.where(present, symbol, 255), starts)
+                    == np.maximum.reduceat(np.where(present, symbol, 0), starts))
+    return runs
+
+#Groups runs by (bg, fg). Runs of blanks join the first group with the same
+#background, or a (bg, bg) group if there is none
+#@return list of ((bg, fg), runs) in order of first appearance, runs in scan order
+@Profile.timed('tabularize')
+def groupRuns(runs):
+    solid = runs['fg'] >= 0
+    keys = runs['bg'].astype(np.int32)*256 + np.where(solid, runs['fg'], 0)
+    unique, first = np.unique(keys[solid], return_index=True)
+    order = unique[np.argsort(first)].tolist()
+
+    byBg = {}
+    for key in order:
+        byBg.setdefault(key >> 8, key)
+    blanks, firstBlank = np.unique(runs['bg'][~solid], return_index=True)
+    for bg in blanks[np.argsort(firstBlank)].tolist():
+        if bg not in byBg:
+            byBg[bg] = bg*257
+            order.append(bg*257)
+
+    position = np.zeros(2**16, dtype=np.int32)
+    position[order] = np.arange(len(order))
+    blankKeys = np.zeros(256, dtype=np.int32)
+    blankKeys[list(byBg)] = list(byBg.values())
+    group = position[np.where(solid, keys, blankKeys[runs['bg']])]
+
+    perm = np.argsort(group, kind='stable')
+    parts = np.split(runs[perm], np.cumsum(np.bincount(group, minlength=len(order)))[:-1])
+    return [((key >> 8, key & 255), part) for key, part in zip(order, parts)]
+
+#Orders the run groups by background then foreground color, descending
+#@return list of ((bg, fg), runs)
+@Profile.timed('table')
+def createRunTable(groups):
+    return sorted(groups, key=lambda item: item[0][0]*1000 + item[0][1], reverse=True)
+
+#Byte layout of the run groups as writeRuns writes them
+#@return runs, counts, groupPos, groupSize, runPos: the runs of all groups
+#in table order, runs per group, offset and size of every group and offset
+#of every run
+def runLayout(table, res):
+    runs = np.concatenate([runs for key, runs in table])
+    counts = np.array([len(runs) for key, runs in table])
+    n = runs['n'].astype(np.int64)
+    head = 4 if res == hres else 3
+    size = head + (np.where(runs['fill'], 1, n) if res == hres else np.zeros_like(n))
+
+    groupOf = np.repeat(np.arange(len(table)), counts)
+    groupSize = 3 + np.bincount(groupOf, weights=size, minlength=len(table)).astype(np.int64)
+    groupPos = np.cumsum(groupSize) - groupSize
+    runPos = np.cumsum(size) - size
+    firstRun = np.cumsum(counts) - counts
+    runPos = groupPos[groupOf] + 2 + runPos - runPos[firstRun][groupOf]
+    return runs, counts, groupPos, groupSize, runPos
+
+#Writes the run groups, every group is its colors, its runs and a 255
+#delimiter, laid out for all runs at once
+#@param symbols: symbol of every cell in scan order, see findRuns
+#@param delta (boolean): delta coded coordinates of the compressed flag
+@Profile.timed('encode')
+def writeRuns(table, res, symbols, out=None, delta=False):
+    if out is None:
+        out = bytearray()
+    if not table:
+        return out
+    runs, counts, groupPos, groupSize, runPos = runLayout(table, res)
+    n = runs['n'].astype(np.int64)
+    start = runs['start'].astype(np.int64)
+    firstRun = np.cumsum(counts) - counts
+
+    buf = np.empty(int(groupSize.sum()), dtype=np.uint8)
+    buf[groupPos] = [key[0] for key, runs in table]
+    buf[groupPos + 1] = [key[1] for key, runs in table]
+    buf[groupPos + groupSize - 1] = 255
+    x, y = runs['x'].astype(np.int64), runs['y'].astype(np.int64)
+    if delta:
+        first = np.zeros(len(runs), dtype=bool)
+        first[firstRun] = True
+        prevY = np.where(first, 0, np.roll(y, 1))
+        prevEnd = np.where(first, 0, np.roll(x + n, 1))
+        y = y - prevY
+        x = np.where(y == 0, x - prevEnd, x)
+    buf[runPos] = x
+    buf[runPos + 1] = y
+    buf[runPos + 2] = runs['n']
+    if res == hres:
+        fill = runs['fill']
+        buf[runPos + 3] = np.where(fill, runFill, runSet)
+        buf[runPos[fill] + 4] = symbols[start[fill]]
+        #symbols of the other runs, one range per run
+        length = n[~fill]
+        offset = np.cumsum(length) - length
+        src = np.repeat(start[~fill] - offset, length) + np.arange(length.sum())
+        buf[src + np.repeat(runPos[~fill] + 4 - start[~fill], length)] = symbols[src]
+    out += buf.tobytes()
+    return out
+
+#Complete .bytes file for the cells of an image
+#@param cells (CellGrid): symbol, bg and fg bytes of every chunk
+#@param palette: custom palette colors in header order
+#@param version (number): 1 for the cell table, 2 for horizontal runs
+#@param order (boolean): reorder the groups to save color switches
+#@param stats (dict): receives the color switches, see orderTable, and with
+#compress the sizes, see _finish
+#@param compress (boolean): compressed payload, format version 2 only
+#@param index: (columns, rows) cells per tile of a tile index, see
+#writeIndexed, None for no index. Format version 2 only, not compressed
+#@return bytes
+def encode(cells, res, x_size, y_size, palette, version=vers, order=True, stats=None, compress=False, index=None):
+    if compress and version != 2:
+        raise ValueError('compression needs format version 2')
+    if index is not None:
+        if version != 2 or compress:
+            raise ValueError('the tile index needs uncompressed format version 2')
+        out = header(res, x_size, y_size, palette, 2, flagIndexed)
+        return bytes(writeIndexed(cells, res, index, order, out, stats))
+
+    if version == 1:
+        table = createTable(tabularize(cells, res), res)
+    elif version == 2:
+        table = createRunTable(groupRuns(findRuns(cells, res)))
+    else:
+        raise ValueError('unknown format version: %r' % (version,))
+
+    if order:
+        table = orderTable(table, res, version, stats)
+
+    out = header(res, x_size, y_size, palette, version, flagCompressed if compress else 0)
+    if version == 1:
+        writeTable(table, out)
+        return bytes(out)
+    body = writeRuns(table, res, cells.symbol.ravel(), delta=compress)
+    return _finish(out, body, compress, stats)
+
+#Writes the groups and the tile index of an image, see flagIndexed. Runs
+#are split at tile borders, then grouped and ordered over the whole image
+#like a plain version 2 file, the runs of a group in tile order so that the
+#runs of one tile in one group follow each other as a segment
+#@param tile: (columns, rows) cells per tile
+#@param stats (dict): receives the color switches, see orderTable
+@Profile.timed('encode')
+def writeIndexed(cells, res, tile, order=True, out=None, stats=None):
+    if out is None:
+        out = bytearray()
+    tileWidth, tileHeight = tile
+    if not (0 < tileWidth < 256 and 0 < tileHeight < 256):
+        raise ValueError('tile size must be 1 to 255 cells: %r' % (tile,))
+    rows, cols = cells.shape
+    tileRows, tileCols = -(-rows // tileHeight), -(-cols // tileWidth)
+
+    parts = []
+    for r0 in range(0, rows, tileHeight):
+        for c0 in range(0, cols, tileWidth):
+            part = cells[r0:r0 + tileHeight, c0:c0 + tileWidth]
+            runs = findRuns(part, res)
+            width = part.shape[1]
+            runs['start'] = (r0 + runs['start'] // width)*cols + c0 + runs['start'] % width
+            runs['x'] += c0
+            runs['y'] += r0
+            parts.append(runs)
+    table = createRunTable(groupRuns(np.concatenate(parts)))
+    if order:
+        table = orderTable(table, res, 2, stats)
+    body = writeRuns(table, res, cells.symbol.ravel())
+
+    if len(body) >= 2**24:
+        raise ValueError('indexed groups must be shorter than 16 MiB: %d bytes' % len(body))
+    segments = np.empty((0, 5), dtype=np.uint8)
+    tileOf = np.empty(0, dtype=np.int64)
+    if table:
+        #a segment starts where the group or the tile changes
+        runs, counts, groupPos, groupSize, runPos = runLayout(table, res)
+        groupOf = np.repeat(np.arange(len(table)), counts)
+        tileOf = (runs['y'].astype(np.int64) - 1)//tileHeight*tileCols + (runs['x'].astype(np.int64) - 1)//tileWidth
+        key = groupOf*tileRows*tileCols + tileOf
+        starts = np.flatnonzero(np.append(True, key[1:] != key[:-1]))
+        segments = np.empty((len(starts), 5), dtype=np.uint8)
+        segments[:, :3] = runPos[starts].astype('>u4').view(np.uint8).reshape(-1, 4)[:, 1:]
+        segments[:, 3:] = np.array([key for key, runs in table], dtype=np.uint8)[groupOf[starts]]
+        tileOf = tileOf[starts]
+
+    #segments of every tile in group order, tiles in row major order
+    perm = np.argsort(tileOf, kind='stable')
+    perTile = np.bincount(tileOf, minlength=tileRows*tileCols)
+    sizes = 2 + 5*perTile
+    lists = bytearray()
+    for t, part in enumerate(np.split(segments[perm], np.cumsum(perTile)[:-1])):
+        lists += int(perTile[t]).to_bytes(2, 'big')
+        lists += part.tobytes()
+
+    out.append(tileWidth)
+    out.append(tileHeight)
+    out += len(table).to_bytes(2, 'big')
+    out += len(body).to_bytes(4, 'big')
+    out += body
+    out += (np.cumsum(sizes) - sizes).astype('>u4').tobytes()
+    out += lists
+    return out
+
+#Appends the payload to the header, compressed with Compress if compress
+#is set
+#@param stats (dict): receives the size of the file without and with
+#compression as 'compression' {'raw': n, 'bytes': n, 'ratio': raw/bytes}
+@Profile.timed('encode')
+def _finish(out, body, compress, stats=None):
+    if not compress:
+        out += body
+        return bytes(out)
+    raw = len(out) + len(body)
+    out += Compress.compress(body)
+    if stats is not None:
+        stats['compression'] = {'raw': raw, 'bytes': len(out), 'ratio': round(raw/len(out), 3)}
+    return bytes(out)
+
+#Animated .bytes file (format version 2 with the animated flag), frames
+#share the palette of the header
+#@param frames: CellGrid per frame, see encode
+#@param delays: display time per frame in 1/100 s
+#@param order (boolean): reorder the groups of every frame
+#@param stats (dict): receives the changed cells, groups and bytes of
+#every frame as 'frames' [{'cells': n, 'groups': n, 'bytes': n}, ...],
+#bytes before compression, and with compress the sizes, see _finish
+#@param compress (boolean): compressed payload
+#@return bytes
+def encodeFrames(frames, res, x_size, y_size, palette, delays, order=True, stats=None, compress=False):
+    if len(frames) != len(delays):
+        raise ValueError('every frame needs a delay')
+    if not 0 < len(frames) < 2**16:
+        raise ValueError('frame count must be 1 to 65535: %d' % len(frames))
+
+    out = header(res, x_size, y_size, palette, 2, flagAnimated | (flagCompressed if compress else 0))
+    body = bytearray(len(frames).to_bytes(2, 'big'))
+    previous = None
+    frameStats = []
+    for cells, delay in zip(frames, delays):
+        changed = cells if previous is None else cells.delta(previous)
+        previous = cells
+
+        table = createRunTable(groupRuns(findRuns(changed, res)))
+        if order:
+            table = orderTable(table, res, 2)
+        body += min(max(int(delay), 0), 2**16 - 1).to_bytes(2, 'big')
+        body += len(table).to_bytes(2, 'big')
+        start = len(body)
+        writeRuns(table, res, changed.symbol.ravel(), body, compress)
+        frameStats.append({'cells': int(changed.present().sum()),
+                           'groups': len(table), 'bytes': len(body) - start + 4})
+
+    if stats is not None:
+        stats['frames'] = frameStats
+    return _finish(out, body, compress, stats)
+
+#Patch file (format version 2 with the patch flag) of the cells that
+#changed, see CellGrid.delta
+#@param changed (CellGrid): the image with only the changed cells present
+#@param stats (dict): receives the color switches, see orderTable, and with
+#compress the sizes, see _finish
+#@param compress (boolean): compressed payload
+#@return bytes
+def encodePatch(changed, res, x_size, y_size, order=True, stats=None, compress=False):
+    table = createRunTable(groupRuns(findRuns(changed, res)))
+    if order:
+        table = orderTable(table, res, 2, stats)
+
+    out = header(res, x_size, y_size, [], 2, flagPatch | (flagCompressed if compress else 0))
+    body = writeRuns(table, res, changed.symbol.ravel(), delta=compress)
+    return _finish(out, body, compress, stats)
@@ -0,0 +1,194 @@
+#Array-backed engine for the non-dithered highRes/lowRes pipeline. The image
+#is reshaped into a (H/ylen, W/xlen, ylen*xlen, 3) block tensor so that the
+#two color selection, merging, palette counting, repainting and symbol bit
+#packing run as batched NumPy operations. Produces the same chunks and
+#palette as Converter._initData, as a CellGrid for Encoder.
+#Color distances follow a Metric, rgb reproduces Converter._initData.
+
+from imageConverter import CellGrid, ColorIndex, Metric, Profile
+from PIL import Image
+import numpy as np
+
+hres = 32
+lres = 16
+
+#unique colors remapped per step by quantize under a metric
+remapSlice = 4096
+
+#braille dot weights in chunk order (row major, 2 columns)
+symbolWeights = np.array([1, 8, 2, 16, 4, 32, 64, 128], dtype=np.int32)
+
+def _chunkShape(res):
+    if res == hres:
+        return 4, 2, 4
+    return 2, 1, 0
+
+#Adaptive palette quantization of a PIL image. PIL maps the pixels in RGB,
+#under other metrics they are mapped to the nearest adaptive palette color
+#@return (H, W, 3) uint8 array
+@Profile.timed('quantize')
+def quantize(im, colors=32, metric=None):
+    metric = Metric.get(metric)
+    adaptive = im.convert(mode='P', palette=Image.ADAPTIVE, colors=colors)
+    if metric.name == 'rgb':
+        return np.asarray(adaptive.convert('RGB'))
+
+    used = np.unique(np.asarray(adaptive))
+    index = ColorIndex.ColorIndex(np.array(adaptive.getpalette()[:3*(used.max() + 1)]).reshape(-1, 3)[used], metric)
+    arr = np.asarray(im.convert('RGB'))
+    colors, inverse = np.unique(_pack(arr), return_inverse=True)
+    colors = _unpack(colors)
+    #in slices, the distances of every unique color at once grow with the image
+    nearest = np.concatenate([index.nearest_custom(colors[i:i+remapSlice])[:, 0]
+                              for i in range(0, len(colors), remapSlice)])
+    return index.palette[nearest][inverse.reshape(arr.shape[:2])].astype(np.uint8)
+
+#Packs RGB triples along the last axis into 0xRRGGBB integers
+def _pack(colors):
+    colors = colors.astype(np.int32)
+    return (colors[..., 0] << 16) | (colors[..., 1] << 8) | colors[..., 2]
+
+def _unpack(packed):
+    return np.stack([(packed >> 16) & 255, (packed >> 8) & 255, packed & 255], axis=-1)
+
+def _toBlocks(arr, ylen, xlen):
+    h, w = arr.shape[0] // ylen, arr.shape[1] // xlen
+    arr = arr[:h*ylen, :w*xlen]
+    return arr.reshape(h, ylen, w, xlen, 3).transpose(0, 2, 1, 3, 4).reshape(h, w, ylen*xlen, 3)
+
+def _fromBlocks(blocks, ylen, xlen):
+    h, w = blocks.shape[:2]
+    return blocks.reshape(h, w, ylen, xlen, 3).transpose(0, 2, 1, 3, 4).reshape(h*ylen, w*xlen, 3)
+
+
+#Picks the reference color and the color furthest from it for every chunk,
+#then merges every pixel to the closer of the two (ties go to the reference)
+@Profile.timed('merge')
+def mergeChunks(blocks, ref, metric=None):
+    Profile.count('colorDistances', 2*blocks[..., 0].size)
+    Profile.count('pixels', blocks[..., 0].size)
+    metric = Metric.get(metric)
+    points = metric.transform(blocks)
+    color1 = blocks[:, :, ref]
+    d1 = metric.distance(points, points[:, :, ref, None])
+    far = d1.argmax(axis=-1)
+    color2 = np.take_along_axis(blocks, far[:, :, None, None], axis=2)[:, :, 0]
+    d2 = metric.distance(points, np.take_along_axis(points, far[:, :, None, None], axis=2))
+
+    merged = np.where((d1 > d2)[..., None], color2[:, :, None], color1[:, :, None])
+    return merged, color1, color2
+
+#Counts palette usage in the same order as Converter._color2palette,
+#returns packed colors by first appearance and their counts
+@Profile.timed('palette')
+def countPalette(color1, color2):
+    seq = np.stack([_pack(color1), _pack(color2)], axis=-1).ravel()
+    colors, first, counts = np.unique(seq, return_index=True, return_counts=True)
+    order = np.argsort(first, kind='stable')
+    return colors[order], counts[order] - 1
+
+#Prunes the palette down to 16 colors like Converter._updatePalette.
+#Returns the kept colors and, for every palette entry, its replacement
+@Profile.timed('palette')
+def prunePalette(colors, counts, metric=None):
+    replace = np.arange(len(colors))
+    if len(colors) <= 16:
+        return colors, replace
+
+    keep = (colors != 0xFFFFFF) & (colors != 0)
+    candidates = np.flatnonzero(keep)
+    excess = len(candidates) - 16
+    if excess > 0:
+        order = candidates[np.argsort(counts[candidates], kind='stable')]
+        keep[order[:excess]] = False
+
+    kept = np.flatnonzero(keep)
+    removed = np.flatnonzero(~keep)
+    rgb = _unpack(colors)
+    index = ColorIndex.ColorIndex(rgb[kept], metric)
+    Profile.count('colorDistances', len(removed)*len(kept))
+    replace[removed] = kept[index.nearest_custom(rgb[removed])[:, 0]]
+    return colors[kept], replace
+
+#Maps every pixel to its (possibly replaced) palette color
+@Profile.timed('repaint')
+def repaint(blocks, colors, replace):
+    Profile.count('pixels', blocks[..., 0].size)
+    order = np.argsort(colors)
+    packed = _pack(blocks)
+    idx = order[np.searchsorted(colors[order], packed)]
+    return _unpack(colors[replace[idx]])
+
+#Converts colors to their byte representation, quantized colors map into the
+#6-8-5 cube and the rest into the custom palette starting at 240
+def colorBytes(colors, palette):
+    cube = ColorIndex.cube_index(colors)
+
+    packed = _pack(colors)
+    order = np.argsort(palette)
+    pos = np.searchsorted(palette[order], packed).clip(0, max(len(palette) - 1, 0))
+    custom = order[pos] + 240 if len(palette) else np.zeros_like(packed)
+    return np.where(cube >= 0, cube, custom)
+
+#Returns symbol, background and foreground bytes for every chunk
+@Profile.timed('postInit')
+def chunkData(blocks, palette, res):
+    color1 = blocks[:, :, 0]
+    diff = (blocks != color1[:, :, None]).any(axis=-1)
+    color2 = np.take_along_axis(blocks, diff.argmax(axis=-1)[:, :, None, None], axis=2)[:, :, 0]
+
+    if res == hres:
+        symbol = diff.astype(np.int32) @ symbolWeights
+    else:
+        symbol = np.zeros(color1.shape[:2], dtype=np.int32)
+    return symbol, colorBytes(color1, palette), colorBytes(color2, palette)
+
+
+#Merge pixels and build the palette for a (H, W, 3) RGB array
+#@return cells, palette, pixels: CellGrid for Encoder.encode,
+#dict of palette colors in header order, repainted (H, W, 3) uint8 array
+def initData(arr, res, metric=None):
+    ylen, xlen, ref = _chunkShape(res)
+    blocks = _toBlocks(np.asarray(arr, dtype=np.int32)[..., :3], ylen, xlen)
+
+    merged, color1, color2 = mergeChunks(blocks, ref, metric)
+    colors, counts = countPalette(color1, color2)
+    palette, replace = prunePalette(colors, counts, metric)
+    merged = repaint(merged, colors, replace)
+
+    symbol, bg, fg = chunkData(merged, palette, res)
+
+    customPalette = {}
+    for color, count in zip(_unpack(palette).tolist(), counts[np.isin(colors, palette)].tolist()):
+        customPalette[tuple(color)] = count
+
+    pixels = _fromBlocks(merged, ylen, xlen).astype(np.uint8)
+    return CellGrid.CellGrid(symbol, bg, fg), customPalette, pixels
+
+#CellGrid of an image that already holds at most two colors per
+#chunk, e.g. dithered output, same chunks as Converter._postInit
+#@param palette: custom palette colors in header order
+def postInit(arr, palette, res):
+    ylen, xlen, ref = _chunkShape(res)
+    blocks = _toBlocks(np.asarray(arr, dtype=np.int32)[..., :3], ylen, xlen)
+    palette = _pack(np.array(palette, dtype=np.int32).reshape(-1, 3))
+
+    return CellGrid.CellGrid(*chunkData(blocks, palette, res))
+
+
+#Merge pixels like initData but paint them with the nearest cube or fixed
+#custom palette color instead of building a palette, so that several
+#images share one palette
+#@param palette: custom palette colors in header order
+#@return cells, pixels: CellGrid and painted (H, W, 3) uint8 array
+def paletteData(arr, palette, res, metric=None):
+    ylen, xlen, ref = _chunkShape(res)
+    blocks = _toBlocks(np.asarray(arr, dtype=np.int32)[..., :3], ylen, xlen)
+
+    merged, color1, color2 = mergeChunks(blocks, ref, metric)
+    index = ColorIndex.ColorIndex(palette, metric)
+    colors, inverse = np.unique(_pack(merged), return_inverse=True)
+    merged = index.nearest(_unpack(colors))[inverse.reshape(merged.shape[:3])]
+
+    symbol, bg, fg = chunkData(merged, _pack(index.palette), res)
+    return CellGrid.CellGrid(symbol, bg, fg), _fromBlocks(merged, ylen, xlen).astype(np.uint8)
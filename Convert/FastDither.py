@@ -0,0 +1,298 @@
+#Array-backed replacement for Dither.Dither. Works in place on a float NumPy
+#buffer and evaluates the candidate color pairs of a chunk as one batch
+#instead of cropping and re-dithering the image once per pair.
+#
+#Candidate pairs are pruned before the batch: every pair is scored by the
+#error of snapping the chunk to it without error diffusion (cheap, fully
+#vectorized) and only the best `pairs` of them go through the diffusion
+#simulation. With exact=True every pair is simulated, which reproduces the
+#exhaustive search of Dither.dither_chunk pixel for pixel (quality
+#equivalence mode, checked against Dither on the test images).
+#
+#Any cell geometry works, hres cells are 2x4 pixels and lres half-block
+#cells 1x2 (top pixel background, bottom pixel foreground).
+#
+#Chunks are visited as a skewed wavefront: chunk row r+1 trails row r by
+#`lag` chunks, which is far enough that no chunk of a wave reads or writes
+#pixels touched by another chunk of the same wave, and every pixel still
+#receives its error in the same order as the sequential scan. A whole wave
+#is therefore dithered with one set of array operations and the result is
+#identical to visiting the chunks one by one.
+#
+#The diffusion kernel is picked from Kernel, the lag follows its reach. An
+#ordered kernel diffuses nothing, its chunks are dithered in plain batches.
+#Wavefront runs bands of chunk rows on several cores with the same result.
+
+from functools import lru_cache
+import os
+import numpy as np
+from PIL import Image
+from imageConverter import ColorIndex, Engine, Kernel, Metric, Profile
+
+x_step = 2
+y_step = 4
+
+#chunks per batch of an ordered dither
+batch = 256
+
+#cell (width, height) in pixels per resolution
+cells = {Engine.hres: (x_step, y_step), Engine.lres: (1, 2)}
+
+#Top 16 colors of an adaptive 32 color quantization, white and black
+#excluded, same as Dither.get_custom_palette
+@Profile.timed('palette')
+def get_custom_palette(img, colors=32):
+    #Dither counts column by column, ties keep that order
+    packed = Engine.quantize(img, colors).astype(np.int32).transpose(1, 0, 2)
+    packed = ((packed[..., 0] << 16) | (packed[..., 1] << 8) | packed[..., 2]).ravel()
+
+    uniq, first, counts = np.unique(packed, return_index=True, return_counts=True)
+    order = np.lexsort((first, -counts))
+    palette = []
+    for c in uniq[order].tolist():
+        if c == 0xFFFFFF or c == 0:
+            continue
+        palette.append(((c >> 16) & 255, (c >> 8) & 255, c & 255))
+    return palette[:16]
+
+#Candidate colors of a batch of (B, n, 3) chunks: the quantized color and
+#the 4 nearest custom colors of every pixel under the metric of the index,
+#in order of appearance.
+#@return colors, count: (B, m, 3) colors with the first count[b] valid
+def get_chunk_colors(chunks, index):
+    q = ColorIndex.nearest_cube(chunks, index.metric)
+    c = index.palette[index.nearest_custom(chunks, 4)]
+    cand = np.concatenate([q[:, :, None, :], c], axis=2).reshape(len(chunks), -1, 3)
+
+    packed = (cand[..., 0] << 16) | (cand[..., 1] << 8) | cand[..., 2]
+    seen = np.tril(packed[:, :, None] == packed[:, None, :], -1).any(axis=2)
+    order = np.argsort(seen, axis=1, kind='stable')
+    count = (~seen).sum(axis=1)
+
+    cand = np.take_along_axis(cand, order[:, :count.max(), None], axis=1)
+    return cand, count
+
+#Kernel taps of every chunk pixel (row major), split into taps that land
+#inside the chunk as (pixel, weight) and taps that leave it as (dx, dy, weight).
+#Taps into the chunk on the left are dropped like doBackError=False. With
+#back=True taps down into the next chunk row on the left are kept, which a
+#one pixel wide cell needs so as not to lose 3/8 of every error
+def _chunk_taps(cw, ch, back=False, taps=Kernel.floydSteinberg.taps):
+    inner, outer = [], []
+    for yi in range(ch):
+        for xi in range(cw):
+            local_in, local_out = [], []
+            for dx, dy, w in taps:
+                xt, yt = xi + dx, yi + dy
+                if 0 <= xt < cw and 0 <= yt < ch:
+                    local_in.append((yt*cw + xt, w))
+                elif xt >= 0 or (back and yt >= ch):
+                    local_out.append((xt, yt, w))
+            inner.append(local_in)
+            outer.append(local_out)
+    return inner, outer
+
+#Chunks row r+1 has to trail row r by so that a wave never overlaps
+def _lag(cw, taps=Kernel.floydSteinberg.taps):
+    dx = [t[0] for t in taps] or [0]
+    return (max(dx) - min(dx) - 1) // cw + 2
+
+#Kernel taps and wavefront lag of a cell geometry. 2x4 cells drop the back
+#error like Dither, other geometries keep it
+#@param kernel: Kernel of the error diffusion, floyd-steinberg if None
+#@return inner, outer, lag
+@lru_cache(maxsize=None)
+def _geometry(cw, ch, kernel=None):
+    taps = Kernel.get(kernel).taps
+    return _chunk_taps(cw, ch, (cw, ch) != (x_step, y_step), taps) + (_lag(cw, taps),)
+
+#Snaps every pixel to the closer color of its pair while diffusing the error
+#inside the chunk, for all pairs of all chunks at once.
+#@param chunks (B, n, 3), c1 and c2 (B, P, 3)
+#@param inner: taps inside the chunk, see _chunk_taps
+#@param metric: Metric of the pixel to color distances, rgb if None
+#@return error (B, P), use2 (B, P, n) and the pixel values each decision saw
+def evaluate_pairs(chunks, c1, c2, inner=None, metric=None):
+    if inner is None:
+        inner = _geometry(x_step, y_step)[0]
+    metric = Metric.get(metric)
+    if metric.name != 'rgb':
+        t1, t2 = metric.transform(c1), metric.transform(c2)
+    n = chunks.shape[1]
+    work = np.repeat(chunks[:, None, :, :], c1.shape[1], axis=1)
+    error = np.zeros(c1.shape[:2])
+    use2 = np.empty(c1.shape[:2] + (n,), dtype=bool)
+    step = c2 - c1
+
+    for k in range(n):
+        org = work[:, :, k]
+        e1 = org - c1
+        e2 = org - c2
+        if metric.name == 'rgb':
+            d1 = np.einsum('...j,...j->...', e1, e1)
+            d2 = np.einsum('...j,...j->...', e2, e2)
+        else:
+            point = metric.transform(org)
+            d1 = metric.distance(point, t1)
+            d2 = metric.distance(point, t2)
+        pick = d2 < d1
+        use2[..., k] = pick
+        error += np.minimum(d1, d2)
+
+        if inner[k]:
+            diff = e1 - pick[..., None]*step
+            for t, w in inner[k]:
+                target = work[:, :, t]
+                target += np.trunc(diff*w)
+                np.minimum(target, 255, out=target)
+                np.maximum(target, 0, out=target)
+
+    return error, use2, work
+
+#Cheap score of every pair: snapping error without diffusion
+def _pair_bound(chunks, palette, i, j, metric=None):
+    metric = Metric.get(metric)
+    d = metric.distance(metric.transform(chunks)[:, None, :, :], metric.transform(palette)[:, :, None, :])
+    return np.minimum(d[:, i], d[:, j]).sum(axis=2)
+
+#Picks the best pair for every chunk of a wave and diffuses its error
+#@param x, y (array, array): top left pixel of every chunk
+#@param cell (tuple): chunk width and height in pixels
+#@param errors: (H, W, 3) array receiving the error every pixel diffused, None to skip
+#@param kernel: Kernel of the error diffusion, floyd-steinberg if None
+#@return color1, color2: (B, 3) chosen colors
+def dither_chunks(buf, x, y, index, exact=False, pairs=16, cell=(x_step, y_step), errors=None, kernel=None):
+    cw, ch = cell
+    inner, outer, lag = _geometry(cw, ch, kernel)
+    n = cw*ch
+    yy = y[:, None] + np.repeat(np.arange(ch), cw)[None, :]
+    xx = x[:, None] + np.tile(np.arange(cw), ch)[None, :]
+    chunks = buf[yy, xx]
+
+    palette, count = get_chunk_colors(chunks.astype(np.int32), index)
+    palette = palette.astype(np.float64)
+    i, j = np.triu_indices(palette.shape[1], 1)
+    i, j = np.broadcast_to(i, (len(x), len(i))), np.broadcast_to(j, (len(x), len(j)))
+    valid = j < count[:, None]
+
+    if not exact and i.shape[1] > pairs:
+        bound = np.where(valid, _pair_bound(chunks, palette, i[0], j[0], index.metric), np.inf)
+        Profile.count('colorDistances', len(x)*n*palette.shape[1])
+        keep = np.sort(np.argsort(bound, axis=1, kind='stable')[:, :pairs], axis=1)
+        i, j = np.take_along_axis(i, keep, 1), np.take_along_axis(j, keep, 1)
+        valid = np.take_along_axis(valid, keep, 1)
+
+    if Profile.enabled():
+        Profile.count('candidatePairs', int(valid.sum()))
+        Profile.count('colorDistances', 2*n*i.size)
+        Profile.count('pixels', n*len(x))
+    c1 = np.take_along_axis(palette, i[..., None], 1)
+    c2 = np.take_along_axis(palette, j[..., None], 1)
+    error, use2, work = evaluate_pairs(chunks, c1, c2, inner, index.metric)
+    best = np.where(valid, error, np.inf).argmin(axis=1)
+
+    b = np.arange(len(x))
+    color1, color2 = c1[b, best], c2[b, best]
+    pick = use2[b, best]
+    colors = np.where(pick[..., None], color2[:, None], color1[:, None])
+    diff = work[b, best] - colors
+    buf[yy, xx] = colors
+    if errors is not None:
+        errors[yy, xx] = diff
+
+    spread_error(buf, x, y, diff, outer)
+    return color1, color2
+
+#Adds the error leaving a batch of chunks to the pixels around them, pixel
+#by pixel in scan order and clipped after every addition
+#@param diff: (B, n, 3) error of every chunk pixel
+#@param outer: taps leaving the chunk, see _chunk_taps
+def spread_error(buf, x, y, diff, outer):
+    y_lim, x_lim = buf.shape[:2]
+    for k in range(len(outer)):
+        for dx, dy, w in outer[k]:
+            xt, yt = x + dx, y + dy
+            inside = (xt >= 0) & (xt < x_lim) & (yt < y_lim)
+            xt, yt = xt[inside], yt[inside]
+            buf[yt, xt] = np.clip(buf[yt, xt] + np.trunc(diff[inside, k]*w), 0, 255)
+
+#Dithers an (H, W, 3) array with the given custom palette
+#@param cell (tuple): chunk width and height in pixels, see cells
+#@param kernel: Kernel or its name, floyd-steinberg if None
+#@param workers (number): threads or processes dithering at once, see Wavefront
+#@param mode: 'thread' or 'process' workers
+#@return uint8 array where every chunk holds at most 2 colors
+@Profile.timed('dither')
+def error_diffusion(arr, palette, exact=False, pairs=16, cell=(x_step, y_step), metric=None, kernel=None, workers=1, mode='thread'):
+    buf = np.array(arr, dtype=np.float64)[..., :3]
+    if workers != 1:
+        from imageConverter import Wavefront
+        return Wavefront.diffuse(buf, palette, exact, pairs, cell, metric=metric, kernel=kernel, workers=workers, mode=mode).astype(np.uint8)
+    return diffuse(buf, palette, exact, pairs, cell, metric=metric, kernel=kernel).astype(np.uint8)
+
+#Dithers a float (H, W, 3) buffer in place. Only the chunks of a region are
+#dithered, pixels around it receive the error leaving the region, which
+#carries it into a following tile
+#@param origin (tuple): top left pixel (x, y) of the region
+#@param chunks (tuple): chunk rows and columns of the region, all whole
+#chunks from origin on if None
+#@param metric: Metric of the pair search, rgb if None
+#@param errors: (H, W, 3) array receiving the error every pixel diffused, None to skip
+#@param kernel: Kernel or its name, floyd-steinberg if None
+#@return buf
+def diffuse(buf, palette, exact=False, pairs=16, cell=(x_step, y_step), origin=(0, 0), chunks=None, metric=None, errors=None,
+            kernel=None):
+    cw, ch = cell
+    x0, y0 = origin
+    kernel = Kernel.get(kernel)
+    index = ColorIndex.ColorIndex(palette, metric)
+    rows, cols = chunks or ((buf.shape[0] - y0) // ch, (buf.shape[1] - x0) // cw)
+    if kernel.ordered:
+        return _ordered(buf, index, exact, pairs, cell, origin, rows, cols, errors, kernel)
+    lag = _geometry(cw, ch, kernel)[2]
+
+    for wave in range(cols + lag*(rows - 1) if rows and cols else 0):
+        r = np.arange(max(0, -(-(wave - cols + 1) // lag)), min(rows - 1, wave // lag) + 1)
+        c = wave - lag*r
+        dither_chunks(buf, x0 + c*cw, y0 + r*ch, index, exact, pairs, cell, errors, kernel)
+
+    return buf
+
+#Ordered dither of a region: adds the threshold of the kernel to every pixel
+#and snaps every chunk to its best pair without diffusing, all chunks at
+#once in batches that bound the memory of the pair search
+def _ordered(buf, index, exact, pairs, cell, origin, rows, cols, errors, kernel):
+    cw, ch = cell
+    x0, y0 = origin
+    region = buf[y0:y0 + rows*ch, x0:x0 + cols*cw]
+    region += kernel.threshold(cols*cw, rows*ch, origin)[..., None]
+    np.clip(region, 0, 255, out=region)
+
+    r, c = np.divmod(np.arange(rows*cols), cols)
+    for start in range(0, rows*cols, batch):
+        dither_chunks(buf, x0 + c[start:start+batch]*cw, y0 + r[start:start+batch]*ch, index, exact, pairs, cell, errors, kernel)
+    return buf
+
+class FastDither():
+    def __init__(self, path, output=False, exact=False, pairs=16, kernel=None):
+        self.path = path
+        self.pixel = None
+        self.custom_palette = None
+        self.output = output
+        self.exact = exact
+        self.pairs = pairs
+        self.kernel = kernel
+        self.image = None
+
+    def error_diffusion(self):
+        img = Image.open(self.path)
+
+        self.custom_palette = get_custom_palette(img)
+        self.pixel = error_diffusion(np.asarray(img.convert('RGB')), self.custom_palette, self.exact, self.pairs,
+                                     kernel=self.kernel)
+        self.image = Image.fromarray(self.pixel)
+
+        if self.output:
+            self.image.save(os.path.join(os.path.dirname(self.path), 'preview.png'))
+
+        return self
@@ -0,0 +1,207 @@
+#Incremental re-conversion for images where only a small area changes, e.g.
+#dashboards. A State keeps what a conversion worked out (palette, cell
+#grid, painted pixels and for dithering the error every pixel diffused)
+#and update re-processes only the cells under a dirty rectangle:
+#
+#   state = Incremental.convert(image, 'hres')
+#   open('dash.bytes', 'wb').write(state.encode())
+#   ...
+#   state, changed = Incremental.update(state, newImage, (x, y, w, h))
+#   open('patch.bytes', 'wb').write(Incremental.patch(state, changed))
+#   on OC: image.applyPatch("/home/patch.bytes", 0, 0)
+#
+#The palette stays the one of the first conversion, so updated cells are
+#painted with the nearest cube or custom palette color (Engine.paletteData)
+#and every patch applies on top of what the screen shows.
+#
+#Dithering spreads the error of a pixel right and down (and with half-block
+#cells also down left), so the dirty cells plus a margin of cells below and
+#to the right (and left for half-block cells) are dithered again. The margin
+#is the wavefront lag of the dither kernel (see FastDither._geometry), which
+#grows with how far the kernel reaches. The
+#error flowing into that region from the cells around it is replayed from
+#the stored errors, interleaved with the wavefront of the region in the
+#order of the first pass, so every addition is clipped just like it was
+#then and an update with unchanged pixels gives the same cells. Cells beyond
+#the margin keep their old colors, the error a change would carry past the
+#margin is dropped. An ordered kernel (bayer) diffuses nothing, only the
+#dirty cells are dithered again.
+
+from imageConverter import ColorIndex, Converter, Encoder, Engine, FastDither, Kernel, Metric
+import numpy as np
+import math
+
+hres = Converter.hres
+lres = Converter.lres
+
+#What a conversion of one image worked out, see convert
+class State():
+    def __init__(self, res, source, palette, cells, pixels, dither=False, metric='rgb', errors=None, kernel='floyd-steinberg'):
+        self.res = res
+        self.source = source
+        self.palette = palette
+        self.cells = cells
+        self.pixels = pixels
+        self.dither = dither
+        self.metric = metric
+        self.errors = errors
+        self.kernel = kernel
+        self.height, self.width = source.shape[:2]
+
+    #Complete .bytes file of the current image
+    def encode(self, version=2, order=True, stats=None, compress=False):
+        return Encoder.encode(self.cells, self.res, self.width, self.height, self.palette, version, order, stats, compress)
+
+#Converts an image and keeps the state update needs. Same result as
+#Converter.convert with the adaptive palette
+#@param image: PIL Image, (H, W, 3) uint8 array or raw PNG bytes
+#@param kernel: dither kernel, see Kernel
+#@return State
+def convert(image, res='hres', dither=False, colors=32, metric='rgb', kernel='floyd-steinberg'):
+    res = Converter._resolution(res)
+    im = Converter._toImage(image)
+    error = Converter._checkSize(im.size[0], im.size[1], res)
+    if error:
+        raise ValueError(error)
+    metric = Metric.get(metric)
+    kernel = Kernel.get(kernel)
+    source = np.array(im.convert('RGB'), dtype=np.uint8)
+
+    if dither:
+        palette = FastDither.get_custom_palette(im, colors)
+        buf = source.astype(np.float64)
+        errors = np.zeros(buf.shape, dtype=np.float32)
+        FastDither.diffuse(buf, palette, cell=FastDither.cells[res], metric=metric, errors=errors, kernel=kernel)
+        pixels = buf.astype(np.uint8)
+        cells = Engine.postInit(pixels, palette, res)
+        return State(res, source, palette, cells, pixels, True, metric.name, errors, kernel.name)
+
+    cells, palette, pixels = Engine.initData(Engine.quantize(im, colors, metric), res, metric)
+    return State(res, source, list(palette), cells, pixels, False, metric.name)
+
+#Bounding box (x, y, w, h) of the pixels that differ, None if none do
+def dirtyRect(old, new):
+    diff = (np.asarray(old)[..., :3] != np.asarray(new)[..., :3]).any(axis=-1)
+    rows, cols = np.flatnonzero(diff.any(axis=1)), np.flatnonzero(diff.any(axis=0))
+    if not len(rows):
+        return None
+    return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+#Cells below and right of the dirty rectangle dithered again
+def ditherMargin(res, kernel=None):
+    kernel = Kernel.get(kernel)
+    if kernel.ordered:
+        return 0
+    cw, ch = FastDither.cells[Converter._resolution(res)]
+    return FastDither._geometry(cw, ch, kernel)[2]
+
+#Cells (r0, c0, r1, c1) to convert again for a dirty rectangle, end exclusive
+def _region(state, rect):
+    cw, ch = FastDither.cells[state.res]
+    rows, cols = state.cells.shape
+    x, y, w, h = rect
+    r0, c0 = max(0, y//ch), max(0, x//cw)
+    r1, c1 = min(rows, math.ceil((y + h)/ch)), min(cols, math.ceil((x + w)/cw))
+    if state.dither:
+        margin = ditherMargin(state.res, state.kernel)
+        r1, c1 = min(rows, r1 + margin), min(cols, c1 + margin)
+        #cells other than 2x4 keep the error diffused down left
+        if (cw, ch) != (FastDither.x_step, FastDither.y_step):
+            c0 = max(0, c0 - margin)
+    return r0, c0, r1, c1
+
+#Dithers a region again. The wavefront runs over the region and the cells
+#around it that diffuse into it: region chunks are dithered, the chunks
+#around it add the error the first pass stored for them, so the region gets
+#every addition in the order of the first pass
+#@param errors: (H, W, 3) array receiving the error of the region pixels
+def _rediffuse(buf, state, region, errors):
+    cw, ch = FastDither.cells[state.res]
+    r0, c0, r1, c1 = region
+    kernel = Kernel.get(state.kernel)
+    if kernel.ordered:
+        FastDither.diffuse(buf, state.palette, cell=(cw, ch), origin=(c0*cw, r0*ch), chunks=(r1 - r0, c1 - c0),
+                           metric=state.metric, errors=errors, kernel=kernel)
+        return
+    inner, outer, lag = FastDither._geometry(cw, ch, kernel)
+    #pixels reached relative to the chunk, as chunks up, left and right
+    reach = [(xt, yt) for k in range(cw*ch) for xt, yt, w in outer[k]]
+    rows, cols = state.cells.shape
+    top = max(0, r0 - max(yt for xt, yt in reach)//ch)
+    left = max(0, c0 - max(xt for xt, yt in reach)//cw)
+    right = min(cols, c1 - min(0, min(xt for xt, yt in reach)//cw))
+    index = ColorIndex.ColorIndex(state.palette, state.metric)
+    yy = np.repeat(np.arange(ch), cw)[None, :]
+    xx = np.tile(np.arange(cw), ch)[None, :]
+
+    rows, cols = r1 - top, right - left
+    for wave in range(cols + lag*(rows - 1)):
+        r = np.arange(max(0, -(-(wave - cols + 1) // lag)), min(rows - 1, wave // lag) + 1)
+        c = wave - lag*r
+        y, x = (top + r)*ch, (left + c)*cw
+        inside = (y >= r0*ch) & (x >= c0*cw) & (x < c1*cw)
+        if inside.any():
+            FastDither.dither_chunks(buf, x[inside], y[inside], index, cell=(cw, ch), errors=errors, kernel=kernel)
+        x, y = x[~inside], y[~inside]
+        if len(x):
+            diff = state.errors[y[:, None] + yy, x[:, None] + xx].astype(np.float64)
+            FastDither.spread_error(buf, x, y, diff, outer)
+
+#Converts the cells under a dirty rectangle of a new version of the image
+#@param image: the new image, same size as the state
+#@param rect: dirty (x, y, w, h) in pixels, the pixels that differ if None
+#@return (State, changed): the new state and a CellGrid where only the
+#cells that changed are present, see patch and cellUpdates
+def update(state, image, rect=None):
+    im = Converter._toImage(image)
+    source = np.array(im.convert('RGB'), dtype=np.uint8)
+    if source.shape != state.source.shape:
+        raise ValueError('image size changed: %s, was %s' % (source.shape[1::-1], state.source.shape[1::-1]))
+    if rect is None:
+        rect = dirtyRect(state.source, source)
+    cells = state.cells.copy()
+    if rect is None:
+        return State(state.res, source, state.palette, cells, state.pixels, state.dither,
+                     state.metric, state.errors, state.kernel), cells.delta(state.cells)
+
+    cw, ch = FastDither.cells[state.res]
+    r0, c0, r1, c1 = region = _region(state, rect)
+    y0, y1, x0, x1 = r0*ch, r1*ch, c0*cw, c1*cw
+    pixels = state.pixels.copy()
+    errors = None
+
+    if state.dither:
+        buf = source.astype(np.float64)
+        errors = state.errors.copy()
+        _rediffuse(buf, state, region, errors)
+        pixels[y0:y1, x0:x1] = buf[y0:y1, x0:x1].astype(np.uint8)
+        converted = Engine.postInit(pixels[y0:y1, x0:x1], state.palette, state.res)
+        keep = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+    else:
+        #without dithering cells do not affect each other, unchanged ones
+        #keep the colors of the first conversion
+        converted, painted = Engine.paletteData(source[y0:y1, x0:x1], state.palette, state.res, state.metric)
+        same = (source[y0:y1, x0:x1] == state.source[y0:y1, x0:x1]).all(axis=-1)
+        keep = same.reshape(r1 - r0, ch, c1 - c0, cw).all(axis=(1, 3))
+        pixels[y0:y1, x0:x1] = np.where(np.repeat(np.repeat(keep, ch, 0), cw, 1)[..., None],
+                                        state.pixels[y0:y1, x0:x1], painted)
+
+    old = cells[r0:r1, c0:c1]
+    for name in ('symbol', 'bg', 'fg'):
+        getattr(converted, name)[keep] = getattr(old, name)[keep]
+    cells[r0:r1, c0:c1] = converted
+
+    changed = cells.delta(state.cells)
+    return State(state.res, source, state.palette, cells, pixels, state.dither, state.metric, errors, state.kernel), changed
+
+#Patch file of the changed cells for image.applyPatch
+#@param compress (boolean): compressed payload, see Encoder
+def patch(state, changed, order=True, stats=None, compress=False):
+    return Encoder.encodePatch(changed, state.res, state.width, state.height, order, stats, compress)
+
+#Changed cells as (x, y, symbol, bg, fg) in screen cells, 1 based like the
+#.bytes coordinates
+def cellUpdates(state, changed):
+    rows, cols = np.nonzero(changed.present())
+    return list(zip((cols + 1).tolist(), (rows + 1).tolist(), changed.symbol[rows, cols].tolist(),
+                    changed.bg[rows, cols].tolist(), changed.fg[rows, cols].tolist()))
@@ -0,0 +1,71 @@
+#Dither kernels: the error diffusion kernels of the wavefront dither in
+#FastDither and an ordered (Bayer) dither.
+#   floyd-steinberg  the Dither.coeff table, what the converter always used
+#   atkinson         6/8 of the error to 6 neighbours, the rest is dropped,
+#                    which keeps flat areas clean on 2x4 braille cells
+#   sierra-lite      2/4 right, 1/4 below left and below, a short reach
+#   bayer            4x4 threshold matrix added to the pixels before the
+#                    pair search, no error diffusion, so every chunk of the
+#                    image is independent and dithered in one batch
+#
+#A diffusion kernel is a list of (dx, dy, weight) taps relative to the pixel
+#the error comes from. Taps reaching left into another chunk are dropped for
+#2x4 cells like Dither does.
+#
+#Usage:
+#   kernel = Kernel.get('atkinson')
+#   FastDither.error_diffusion(arr, palette, kernel=kernel)
+
+import numpy as np
+from imageConverter.Dither import coeff
+
+class Diffusion():
+    ordered = False
+
+    def __init__(self, name, taps):
+        self.name = name
+        self.taps = tuple(taps)
+
+class Bayer():
+    name = 'bayer'
+    ordered = True
+    taps = ()
+
+    #@param size (number): side of the threshold matrix, a power of 2
+    #@param spread (number): threshold range in channel values, about the
+    #step between two levels of the color cube
+    def __init__(self, size=4, spread=48):
+        matrix = np.zeros((1, 1))
+        while len(matrix) < size:
+            matrix = np.block([[4*matrix, 4*matrix + 2], [4*matrix + 3, 4*matrix + 1]])
+        self.matrix = matrix
+        self.spread = spread
+
+    #Threshold offset of every pixel, the matrix is anchored at pixel (0, 0)
+    #so that regions dithered on their own line up
+    #@param origin (tuple): top left pixel (x, y) of the region
+    #@return (h, w) array
+    def threshold(self, w, h, origin=(0, 0)):
+        n = len(self.matrix)
+        yy = (np.arange(h) + origin[1]) % n
+        xx = (np.arange(w) + origin[0]) % n
+        return ((self.matrix[yy[:, None], xx[None, :]] + 0.5)/(n*n) - 0.5)*self.spread
+
+floydSteinberg = Diffusion('floyd-steinberg', [(i - 1, j - 1, coeff[j*3+i]) for j in range(3) for i in range(3) if coeff[j*3+i] != 0])
+
+kernels = {kernel.name: kernel for kernel in (
+    floydSteinberg,
+    Diffusion('atkinson', [(1, 0, 1/8), (2, 0, 1/8), (-1, 1, 1/8), (0, 1, 1/8), (1, 1, 1/8), (0, 2, 1/8)]),
+    Diffusion('sierra-lite', [(1, 0, 2/4), (-1, 1, 1/4), (0, 1, 1/4)]),
+    Bayer(),
+)}
+
+#Kernel by name, kernels pass through and None is floyd-steinberg
+def get(kernel=None):
+    if kernel is None:
+        return floydSteinberg
+    if isinstance(kernel, str):
+        if kernel not in kernels:
+            raise ValueError('unknown dither kernel: %r' % (kernel,))
+        return kernels[kernel]
+    return kernel
@@ -0,0 +1,100 @@
+#Color distance metrics for every stage that picks colors: chunk color
+#selection, palette pruning, quantization, the k-means palette and the
+#dither pair search.
+#   rgb      squared Euclidean RGB distance, what the converter always used
+#   redmean  RGB weighted by the mean red of both colors, a cheap
+#            approximation of perceived distance
+#   lab      squared CIELAB distance (delta E 1976) under D65
+#
+#A metric splits into transform and distance: colors are transformed once
+#per image or palette (for lab the conversion to CIELAB) and distance is
+#evaluated on the transformed arrays, so no stage converts the same colors
+#per distance call.
+#
+#Usage:
+#   metric = Metric.get('lab')
+#   pixels, palette = metric.transform(pixels), metric.transform(palette)
+#   d = metric.distance(pixels[:, None], palette)
+
+import numpy as np
+
+class RGB():
+    name = 'rgb'
+
+    #Colors in the space distance works on, integer RGB stays integer so
+    #that results match the converter bit for bit
+    def transform(self, colors):
+        return np.asarray(colors)
+
+    #RGB colors of transformed colors
+    def inverse(self, colors):
+        return np.asarray(colors)
+
+    #Squared distance between transformed colors, broadcast over (..., 3)
+    def distance(self, colors1, colors2):
+        diff = colors1 - colors2
+        return (diff*diff).sum(axis=-1)
+
+    #Distance between untransformed colors
+    def __call__(self, colors1, colors2):
+        return self.distance(self.transform(colors1), self.transform(colors2))
+
+class Redmean(RGB):
+    name = 'redmean'
+
+    def transform(self, colors):
+        return np.asarray(colors, dtype=np.float64)
+
+    def distance(self, colors1, colors2):
+        diff = colors1 - colors2
+        mean = (colors1[..., 0] + colors2[..., 0])/2
+        return ((2 + mean/256)*diff[..., 0]**2 + 4*diff[..., 1]**2
+                + (2 + (255 - mean)/256)*diff[..., 2]**2)
+
+#sRGB channel value to linear light
+_linear = np.array([c/12.92 if c <= 0.04045 else ((c + 0.055)/1.055)**2.4
+                    for c in np.arange(256)/255.0])
+
+#linear RGB to XYZ divided by the D65 white point
+_toXYZ = np.array([[0.4124564, 0.3575761, 0.1804375],
+                   [0.2126729, 0.7151522, 0.0721750],
+                   [0.0193339, 0.1191920, 0.9503041]]) / np.array([[0.95047], [1.0], [1.08883]])
+_fromXYZ = np.linalg.inv(_toXYZ)
+
+_epsilon = 216/24389
+_kappa = 24389/27
+
+class Lab(RGB):
+    name = 'lab'
+
+    def transform(self, colors):
+        colors = np.asarray(colors)
+        if colors.dtype.kind in 'iu':
+            rgb = _linear[colors.clip(0, 255)]
+        else:
+            c = colors.clip(0, 255)/255.0
+            rgb = np.where(c <= 0.04045, c/12.92, ((c + 0.055)/1.055)**2.4)
+        xyz = rgb @ _toXYZ.T
+        f = np.where(xyz > _epsilon, np.cbrt(xyz), (_kappa*xyz + 16)/116)
+        return np.stack([116*f[..., 1] - 16, 500*(f[..., 0] - f[..., 1]), 200*(f[..., 1] - f[..., 2])], axis=-1)
+
+    def inverse(self, colors):
+        colors = np.asarray(colors, dtype=np.float64)
+        fy = (colors[..., 0] + 16)/116
+        f = np.stack([fy + colors[..., 1]/500, fy, fy - colors[..., 2]/200], axis=-1)
+        xyz = np.where(f**3 > _epsilon, f**3, (116*f - 16)/_kappa)
+        rgb = (xyz @ _fromXYZ.T).clip(0, 1)
+        c = np.where(rgb <= 0.0031308, 12.92*rgb, 1.055*rgb**(1/2.4) - 0.055)
+        return c*255
+
+metrics = {metric.name: metric for metric in (RGB(), Redmean(), Lab())}
+
+#Metric by name, metrics pass through and None is rgb
+def get(metric=None):
+    if metric is None:
+        return metrics['rgb']
+    if isinstance(metric, str):
+        if metric not in metrics:
+            raise ValueError('unknown color metric: %r' % (metric,))
+        return metrics[metric]
+    return metric
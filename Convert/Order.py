@@ -0,0 +1,113 @@
+#Orders the groups of a .bytes table so that image.lua switches colors as
+#rarely as possible. image.lua calls gpu.setBackground only when the
+#background differs from the previous group and gpu.setForeground only when
+#the foreground differs (blank hres groups set no foreground at all), so the
+#groups are the nodes of a path and the number of color calls between two
+#consecutive groups is the edge weight. The path is built greedily:
+#   - stay on the current background while it has groups left, groups that
+#     only show the background first, then foregrounds no other background
+#     shares, so the group left last can hand its foreground on
+#   - then move to a background that has a group with the current
+#     foreground, a background with only blank groups, or start over
+#Groups are only reordered, so every decoder of the format reads the result.
+
+#Color calls needed to draw groups with the given color keys in order
+#@param keys: (bg, fg) per group, fg None for groups that set no foreground
+#@return (number, number): setBackground and setForeground calls
+def switchCount(keys):
+    bgCalls = fgCalls = 0
+    bgPrev = fgPrev = None
+    for bg, fg in keys:
+        if bg != bgPrev:
+            bgPrev = bg
+            bgCalls += 1
+        if fg is not None and fg != fgPrev:
+            fgPrev = fg
+            fgCalls += 1
+    return bgCalls, fgCalls
+
+#Greedy path over the distinct color keys
+#@param keys: distinct (bg, fg) keys, ties are broken in this order
+#@return list of keys in drawing order
+def orderKeys(keys):
+    byBg = {}
+    byFg = {}
+    for key in keys:
+        byBg.setdefault(key[0], []).append(key)
+        if key[1] is not None:
+            byFg.setdefault(key[1], []).append(key)
+
+    visited = set()
+    #backgrounds with groups left, per foreground
+    fgBgs = {}
+    for key in keys:
+        if key[1] is not None:
+            fgBgs.setdefault(key[1], set()).add(key[0])
+
+    blanks = [key for key in keys if key[1] is None]
+    #first possibly unvisited position in keys and blanks
+    pos = [0, 0]
+
+    def left(candidates):
+        return [key for key in candidates if key not in visited]
+
+    def first(candidates, i):
+        while pos[i] < len(candidates) and candidates[pos[i]] in visited:
+            pos[i] += 1
+        return candidates[pos[i]] if pos[i] < len(candidates) else None
+
+    path = []
+    bg = fg = None
+    while len(path) < len(keys):
+        nextKey = None
+        sameBg = left(byBg.get(bg, ()))
+        if sameBg:
+            blank = [key for key in sameBg if key[1] is None]
+            if blank:
+                nextKey = blank[0]
+            else:
+                for key in sameBg:
+                    if len(fgBgs[key[1]]) == 1:
+                        nextKey = key
+                        break
+                else:
+                    nextKey = sameBg[0]
+        else:
+            sameFg = left(byFg.get(fg, ()))
+            if sameFg:
+                nextKey = sameFg[0]
+            else:
+                nextKey = first(blanks, 1) or first(keys, 0)
+
+        visited.add(nextKey)
+        path.append(nextKey)
+        bg = nextKey[0]
+        if nextKey[1] is not None:
+            fg = nextKey[1]
+            fgBgs[fg].discard(bg)
+    return path
+
+#Reorders a table by the color key of its groups. Groups with the same key
+#stay together in table order, except that a group with more than one cell
+#is moved last: image.lua 1 stops reading once it has seen all but one
+#cell, which would drop a single cell group at the very end. A group of the
+#last key is preferred, it costs no extra color switch
+#@param colorKey: function of a table entry returning its (bg, fg) key
+#@param size: function of a table entry returning its number of cells
+#@return list: the reordered table
+def orderTable(table, colorKey, size=None):
+    blocks = {}
+    for entry in table:
+        blocks.setdefault(colorKey(entry), []).append(entry)
+
+    result = []
+    for key in orderKeys(list(blocks)):
+        result += blocks[key]
+
+    if size is not None and result and size(result[-1]) == 1:
+        last = len(blocks[colorKey(result[-1])])
+        multi = [i for i in range(len(result) - 1, -1, -1) if size(result[i]) > 1]
+        if multi:
+            same = [i for i in multi if i >= len(result) - last]
+            result.append(result.pop(same[0] if same else multi[0]))
+    return result
@@ -0,0 +1,109 @@
+#Custom palette optimizer. The 16 custom colors are spent on the colors the
+#240 color cube represents worst: the cube is treated as fixed cluster
+#centers and the custom colors as free ones, so k-means minimizes the error
+#left after snapping every pixel to the nearest cube or custom color. Runs
+#mini-batch k-means on a random subsample of the pixels with a fixed
+#number of iterations, so the cost does not grow with the image size.
+#
+#Centers are seeded k-means++ style, weighted by the error the cube and the
+#centers picked so far leave. A center that has not won a pixel yet is
+#moved to the pixel of the mini-batch that is furthest from every color.
+#
+#Under a metric other than rgb the clustering runs on the transformed pixels
+#(for lab in CIELAB) and the centers are transformed back to RGB at the end.
+
+from imageConverter import ColorIndex, Metric, Profile
+import numpy as np
+
+#pixels drawn from the image, per mini-batch and mini-batches run
+sampleSize = 8192
+batchSize = 1024
+iterations = 30
+
+#Distance of every color in an (N, 3) array to its nearest cube color
+def cubeError(colors, metric=None):
+    metric = Metric.get(metric)
+    if metric.name == 'rgb':
+        return ColorIndex.squared_distance(ColorIndex.quantized(colors), colors).astype(np.float64)
+    return metric(ColorIndex.nearest_cube(colors, metric), colors).astype(np.float64)
+
+def _distances(pixels, centers, metric):
+    if metric.name != 'rgb':
+        return metric.distance(pixels[:, None, :], centers[None, :, :])
+    diff = pixels[:, None, :] - centers[None, :, :]
+    return np.einsum('ijk,ijk->ij', diff, diff)
+
+#k-means++ seeding against the residual error of the cube
+def _seed(pixels, residual, size, rng, metric):
+    centers = []
+    residual = residual.copy()
+    for i in range(size):
+        total = residual.sum()
+        if total <= 0:
+            break
+        pick = pixels[rng.choice(len(pixels), p=residual/total)]
+        centers.append(pick)
+        residual = np.minimum(residual, metric.distance(pixels, pick))
+    return np.array(centers, dtype=np.float64).reshape(-1, 3)
+
+#Error of every pixel after the nearest cube or custom color and the custom
+#color each pixel maps to, -1 where the cube is closer
+def _assign(pixels, cube, centers, metric):
+    if not len(centers):
+        return cube, np.full(len(pixels), -1)
+    d = _distances(pixels, centers, metric)
+    k = d.argmin(axis=1)
+    dk = d[np.arange(len(pixels)), k]
+    return np.minimum(cube, dk), np.where(dk < cube, k, -1)
+
+#Picks custom palette colors for an image
+#@param img: PIL Image or (H, W, 3) array
+#@param size (number): custom colors to pick, at most 16
+#@param seed (number): seed of the subsample, the result is deterministic
+#@param metric: Metric or name of the color distance, rgb if None
+#@return list of (r, g, b), most used first, unused colors dropped
+@Profile.timed('palette')
+def optimize(img, size=16, sample=sampleSize, batch=batchSize, iterations=iterations, seed=0, metric=None):
+    metric = Metric.get(metric)
+    if hasattr(img, 'convert'):
+        img = img.convert('RGB')
+    pixels = np.asarray(img, dtype=np.int32)[..., :3].reshape(-1, 3)
+    rng = np.random.default_rng(seed)
+    if len(pixels) > sample:
+        pixels = pixels[rng.choice(len(pixels), sample, replace=False)]
+    cube = cubeError(pixels.astype(np.float64), metric)
+    pixels = np.asarray(metric.transform(pixels), dtype=np.float64)
+
+    centers = _seed(pixels, cube, size, rng, metric)
+    counts = np.zeros(len(centers))
+    Profile.count('colorDistances', iterations*min(batch, len(pixels))*len(centers))
+
+    for i in range(iterations if len(centers) else 0):
+        idx = rng.integers(0, len(pixels), min(batch, len(pixels)))
+        residual, owner = _assign(pixels[idx], cube[idx], centers, metric)
+
+        won = np.bincount(owner[owner >= 0], minlength=len(centers))
+        sums = np.zeros_like(centers)
+        np.add.at(sums, owner[owner >= 0], pixels[idx][owner >= 0])
+        counts += won
+        moved = won > 0
+        centers[moved] += (sums[moved] - won[moved, None]*centers[moved])/counts[moved, None]
+
+        #restart centers that never won a pixel at the worst represented one
+        for k in np.flatnonzero(counts == 0):
+            worst = residual.argmax()
+            if residual[worst] <= 0:
+                break
+            centers[k] = pixels[idx][worst]
+            residual[worst] = 0
+
+    centers = np.clip(np.rint(metric.inverse(centers)), 0, 255).astype(np.int32)
+    residual, owner = _assign(pixels, cube, np.asarray(metric.transform(centers), dtype=np.float64), metric)
+    usage = np.bincount(owner[owner >= 0], minlength=len(centers))
+
+    palette = []
+    for k in np.argsort(-usage, kind='stable'):
+        color = tuple(centers[k].tolist())
+        if usage[k] > 0 and color not in palette:
+            palette.append(color)
+    return palette
@@ -0,0 +1,177 @@
+#Opt-in profiling of the conversion pipeline. Pipeline functions are marked
+#with @timed('<stage>') or wrapped in `with stage('<stage>'):` and bump
+#counters (color distance evaluations, candidate pairs, pixels touched)
+#with count(). Nothing is recorded unless a Profiler is active, then every
+#stage records its wall time, number of calls and, with memory=True, the
+#peak memory it allocated (tracemalloc, slows the conversion down).
+#
+#Disabled, a hook costs one global lookup and a None check, counters are
+#bumped once per batch of work and never per pixel.
+#
+#Usage:
+#   with Profile.profiling() as profiler:
+#       Converter.convert(image)
+#   profiler.summary()            per stage totals and counters
+#   profiler.save('trace.json')   Chrome trace format (chrome://tracing)
+
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+import json, os, threading, time, tracemalloc
+
+_active = None
+
+class _Frame():
+    def __init__(self, name, start, memory):
+        self.name = name
+        self.start = start
+        self.memory = memory
+        self.peak = memory
+        self.inner = 0.0
+
+class Profiler():
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.events = []
+        self.counts = Counter()
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def enter(self, name):
+        stack = self._stack()
+        memory = 0
+        if self.memory:
+            memory, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+            tracemalloc.reset_peak()
+        stack.append(_Frame(name, time.perf_counter(), memory))
+
+    def exit(self):
+        end = time.perf_counter()
+        stack = self._stack()
+        frame = stack.pop()
+        if stack:
+            stack[-1].inner += end - frame.start
+        event = {
+            'name': frame.name,
+            'start': frame.start - self.origin,
+            'seconds': end - frame.start,
+            'self': end - frame.start - frame.inner,
+            'thread': threading.get_ident(),
+            'depth': len(stack),
+        }
+        if self.memory:
+            peak = max(frame.peak, tracemalloc.get_traced_memory()[1])
+            event['allocated'] = peak - frame.memory
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, peak)
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, name, n):
+        with self._lock:
+            self.counts[name] += n
+
+    #Totals per stage: wall time, time outside nested stages (self), calls
+    #and the largest allocation
+    #@return dict: {'stages': {name: {...}}, 'counts': {...}}
+    def summary(self):
+        stages = {}
+        for event in self.events:
+            total = stages.setdefault(event['name'], {'seconds': 0.0, 'self': 0.0, 'calls': 0})
+            total['seconds'] += event['seconds']
+            total['self'] += event['self']
+            total['calls'] += 1
+            if 'allocated' in event:
+                total['allocated'] = max(total.get('allocated', 0), event['allocated'])
+        for total in stages.values():
+            total['seconds'] = round(total['seconds'], 6)
+            total['self'] = round(total['self'], 6)
+        return {'stages': stages, 'counts': dict(self.counts)}
+
+    #Events in the Chrome trace event format
+    def trace(self):
+        pid = os.getpid()
+        events = []
+        for event in self.events:
+            args = {'allocated': event['allocated']} if 'allocated' in event else {}
+            events.append({'name': event['name'], 'ph': 'X', 'pid': pid, 'tid': event['thread'],
+                           'ts': round(event['start']*1e6, 1), 'dur': round(event['seconds']*1e6, 1), 'args': args})
+        return {'traceEvents': events, 'otherData': {'summary': self.summary()}}
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.trace(), f, indent=1)
+
+#Activates a profiler for the duration of the block. Profilers do not
+#nest, the previous one is restored afterwards
+@contextmanager
+def profiling(memory=False):
+    global _active
+    previous = _active
+    profiler = Profiler(memory)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _active = profiler
+    try:
+        yield profiler
+    finally:
+        _active = previous
+        if started:
+            tracemalloc.stop()
+
+def enabled():
+    return _active is not None
+
+@contextmanager
+def _stage(profiler, name):
+    profiler.enter(name)
+    try:
+        yield
+    finally:
+        profiler.exit()
+
+class _Null():
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc):
+        return False
+
+_null = _Null()
+
+#Context manager timing a block as a stage
+def stage(name):
+    if _active is None:
+        return _null
+    return _stage(_active, name)
+
+#Decorator timing every call of a function as a stage
+def timed(name):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _active
+            if profiler is None:
+                return func(*args, **kwargs)
+            profiler.enter(name)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.exit()
+        return wrapper
+    return decorator
+
+#Adds n to a counter of the active profiler
+def count(name, n=1):
+    if _active is not None:
+        _active.count(name, n)
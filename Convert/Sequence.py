@@ -0,0 +1,147 @@
+#Converts animated GIFs and numbered frame sequences into one animated
+#.bytes file (format version 2 with the animated flag, see Encoder). All
+#frames share one custom palette, so image.lua sets the palette once, and
+#every frame after the first stores only the cells that changed, so a
+#frame costs gpu calls in proportion to what moved on screen.
+#
+#The frames are stacked into one tall image before quantization and palette
+#pruning, which picks the palette for the whole animation the same way
+#highRes/lowRes pick it for one image. Frames are not dithered, the error
+#diffusion pattern would change between frames and flicker.
+#
+#Usage: python Sequence.py <gif_or_glob> [--res hres|lres] [--out file] ...
+#   on OC: image.play("/home/anim.bytes", 0, 0, 0)
+
+from argparse import ArgumentParser
+from imageConverter import Converter, Encoder, Engine
+from PIL import Image, ImageSequence
+import numpy as np
+import glob, json, os, sys
+
+hres = Converter.hres
+
+#frame delay in 1/100 s when a GIF frame has none, like most GIF viewers
+defaultDelay = 10
+
+#Frames and delays of an animated image file (GIF, APNG, WebP)
+#@return (list of PIL RGB images, list of delays in 1/100 s)
+def loadAnimation(file):
+    frames = []
+    delays = []
+    with Image.open(file) as im:
+        for frame in ImageSequence.Iterator(im):
+            frames.append(frame.convert('RGB'))
+            duration = frame.info.get('duration') or 0
+            delays.append(int(round(duration/10)) or defaultDelay)
+    return frames, delays
+
+#Frames of a sequence of image files, sorted by name
+def loadFiles(files):
+    frames = []
+    for file in files:
+        with Image.open(file) as im:
+            frames.append(im.convert('RGB'))
+    return frames, [defaultDelay]*len(frames)
+
+#Frames of an animated image, a glob pattern or a directory of frames
+def loadFrames(source):
+    if os.path.isdir(source):
+        files = sorted(glob.glob(os.path.join(source, '*.png')))
+    elif os.path.isfile(source):
+        return loadAnimation(source)
+    else:
+        files = sorted(glob.glob(source))
+    if not files:
+        raise ValueError('no frames found: %s' % source)
+    return loadFiles(files)
+
+#Converts frames into an animated .bytes file
+#@param frames: PIL Images or (H, W, 3) uint8 arrays of the same size
+#@param res: 'hres' or 'lres'
+#@param delays: display time per frame in 1/100 s
+#@param preview (boolean): also return the repainted frames
+#@param stats (dict): receives per frame cells, groups and bytes, see
+#Encoder.encodeFrames
+#@param compress (boolean): compressed payload, see Encoder
+#@return (bytes, list of (H, W, 3) uint8 arrays or None)
+def convertFrames(frames, res='hres', colors=32, delays=None, order=True, preview=False, stats=None, compress=False):
+    res = Converter._resolution(res)
+    frames = [np.asarray(Converter._toImage(frame).convert('RGB')) for frame in frames]
+    if not frames:
+        raise ValueError('no frames to convert')
+    if delays is None:
+        delays = [defaultDelay]*len(frames)
+
+    y_size, x_size = frames[0].shape[:2]
+    if any(frame.shape[:2] != (y_size, x_size) for frame in frames):
+        raise ValueError('frames differ in size')
+    error = Converter._checkSize(x_size, y_size, res)
+    if error:
+        raise ValueError(error)
+
+    #whole chunks only, so that no chunk spans two frames
+    ylen = 4 if res == hres else 2
+    y_size -= y_size % ylen
+    stacked = np.concatenate([frame[:y_size] for frame in frames])
+
+    cells, palette, pixels = Engine.initData(Engine.quantize(Image.fromarray(stacked), colors), res)
+    rows = cells.shape[0]//len(frames)
+    frameCells = [cells[i*rows:(i + 1)*rows] for i in range(len(frames))]
+
+    data = Encoder.encodeFrames(frameCells, res, x_size, y_size, palette, delays, order, stats, compress)
+    if not preview:
+        return data, None
+    height = pixels.shape[0]//len(frames)
+    return data, [pixels[i*height:(i + 1)*height] for i in range(len(frames))]
+
+#Default output next to the source
+def _outputPath(source):
+    if os.path.isfile(source):
+        return os.path.splitext(source)[0] + '.bytes'
+    if os.path.isdir(source):
+        return os.path.join(source, 'animation.bytes')
+    return os.path.join(os.path.dirname(source), 'animation.bytes')
+
+def _parser():
+    parser = ArgumentParser(prog='Sequence', description='Convert an animation for image.play')
+    parser.add_argument('source', help='animated GIF, directory of frames or glob pattern of frames')
+    parser.add_argument('--res', choices=('hres', 'lres'), default='hres')
+    parser.add_argument('--colors', type=int, default=32, help='colors of the adaptive quantization')
+    parser.add_argument('--delay', type=int, default=None, help='delay of every frame in 1/100 s')
+    parser.add_argument('--out', default=None, help='output .bytes file')
+    parser.add_argument('--preview', default=None, help='directory for a preview png per frame')
+    parser.add_argument('--no-order', action='store_true', help='keep groups in color order')
+    parser.add_argument('--compress', action='store_true', help='compress the frames, image.lua decodes them while playing')
+    return parser
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    frames, delays = loadFrames(args.source)
+    if args.delay is not None:
+        delays = [args.delay]*len(frames)
+
+    stats = {}
+    try:
+        data, previews = convertFrames(frames, args.res, args.colors, delays, not args.no_order,
+                                       args.preview is not None, stats, args.compress)
+    except ValueError as e:
+        print('Error - %s' % e, file=sys.stderr)
+        return 1
+
+    out = args.out or _outputPath(args.source)
+    with open(out, 'wb') as f:
+        f.write(data)
+
+    if previews is not None:
+        os.makedirs(args.preview, exist_ok=True)
+        for i, pixels in enumerate(previews):
+            Image.fromarray(pixels).save(os.path.join(args.preview, 'frame%04d.png' % i))
+
+    report = {'output': out, 'bytes': len(data), 'frames': stats['frames']}
+    if 'compression' in stats:
+        report['compression'] = stats['compression']
+    print(json.dumps(report, indent=1))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,333 @@
+#Local conversion service for asset pipelines. An asyncio HTTP server takes
+#image uploads, converts them on a process pool and answers with the .bytes
+#data.
+#
+#   POST /convert?res=hres&dither=1&colors=32&version=2&order=1&optimizer=adaptive&metric=rgb&compress=0&index=0
+#        body: PNG (or any PIL readable) image, answer: the .bytes file
+#   GET  /metrics   JSON counters, queue depth, throughput and latencies
+#   GET  /health    200 while the server runs
+#
+#Identical requests (same image bytes and parameters) that arrive while one
+#of them is being converted are coalesced, they all wait on the first one.
+#Conversions wait in a bounded queue in front of the pool, when every
+#worker is busy and the queue is full requests are turned away with 503 and
+#a Retry-After header instead of piling up.
+#
+#Usage: python Server.py [--host 127.0.0.1] [--port 8765] [--workers N] [--queue 64] [--cache <dir>]
+#   or: python Converter.py convert-server ...
+#   curl --data-binary @image.png -o image.bytes 'http://127.0.0.1:8765/convert?res=hres'
+
+from argparse import ArgumentParser
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+from imageConverter import Batch, Converter, Encoder, Kernel, Metric
+import asyncio, hashlib, json, multiprocessing, os, sys, time
+
+#largest accepted upload and request head in bytes
+maxBody = 16*2**20
+maxHead = 64*2**10
+
+#latencies kept for the percentiles and the window of the throughput
+latencySamples = 1024
+throughputWindow = 60.0
+
+_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+#Conversion parameters of a query string, raises ValueError on bad values
+#@return dict of keyword arguments for Converter.convert
+def parseParams(query):
+    params = dict(parse_qsl(query))
+    unknown = set(params) - {'res', 'dither', 'colors', 'version', 'order', 'optimizer', 'metric', 'compress', 'index', 'kernel'}
+    if unknown:
+        raise ValueError('unknown parameters: %s' % ', '.join(sorted(unknown)))
+
+    res = params.get('res', 'hres')
+    Converter._resolution(res)
+    try:
+        colors = int(params.get('colors', 32))
+        version = int(params.get('version', Converter.vers))
+    except ValueError:
+        raise ValueError('colors and version must be integers')
+    if not 1 <= colors <= 256:
+        raise ValueError('colors must be between 1 and 256')
+    if version not in Encoder.versions:
+        raise ValueError('unknown format version: %r' % (version,))
+    optimizer = params.get('optimizer', 'adaptive')
+    if optimizer not in Converter.optimizers:
+        raise ValueError('unknown palette optimizer: %r' % (optimizer,))
+    metric = params.get('metric', 'rgb')
+    Metric.get(metric)
+    compress = _flag(params, 'compress', False)
+    if compress and version != 2:
+        raise ValueError('compression needs format version 2')
+    index = _flag(params, 'index', False)
+    if index and (version != 2 or compress):
+        raise ValueError('the tile index needs uncompressed format version 2')
+    dither = _flag(params, 'dither', False)
+    #the kernel changes nothing without dither, same requests coalesce
+    kernel = Kernel.get(params.get('kernel')).name
+    if not dither:
+        kernel = Kernel.floydSteinberg.name
+
+    return {'res': res, 'dither': dither, 'colors': colors, 'version': version,
+            'order': _flag(params, 'order', True), 'optimizer': optimizer, 'metric': metric, 'compress': compress,
+            'index': index, 'kernel': kernel}
+
+def _flag(params, name, default):
+    value = params.get(name)
+    if value is None:
+        return default
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError('%s must be true or false' % name)
+
+#Key of a request, equal for identical uploads with identical parameters
+def requestKey(body, params):
+    return hashlib.sha256(body).hexdigest() + json.dumps(params, sort_keys=True)
+
+#Converts one upload inside a worker, never raises
+#@param cache (tuple): (directory, size limit) of a shared cache or None
+#@return (data, None, seconds) or (None, error message, seconds)
+def _convertJob(body, params, cache=None):
+    start = time.perf_counter()
+    try:
+        data = Converter.convert(body, cache=Batch._workerCache(*cache) if cache else None, **params)[0]
+        return data, None, time.perf_counter() - start
+    except (ValueError, OSError) as e:
+        return None, str(e) or type(e).__name__, time.perf_counter() - start
+
+class Server():
+    #@param workers (number): conversion processes, defaults to the cpu count
+    #@param queueSize (number): conversions waiting for a worker before
+    #requests are rejected with 503
+    #@param cache (string): directory of a conversion cache shared by the workers
+    def __init__(self, host='127.0.0.1', port=8765, workers=None, queueSize=64, cache=None, cacheBytes=256*2**20):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queueSize = queueSize
+        self.cache = (cache, cacheBytes) if cache else None
+        self.stats = Counter()
+        self._latencies = deque(maxlen=latencySamples)
+        self._pending = {}
+        self._server = None
+        self._pool = None
+        self._tasks = []
+
+    async def start(self):
+        workers = self.workers or os.cpu_count() or 1
+        #forked workers would inherit the sockets of open connections and
+        #keep them open after the server closed them
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else None)
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        self._capacity = workers + self.queueSize
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.ensure_future(self._work()) for i in range(workers)]
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, limit=maxHead)
+        #port 0 binds a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started = time.monotonic()
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._pool is not None:
+            self._pool.shutdown()
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    #Counters, queue depth, throughput over the last window and latency
+    #percentiles in seconds of the recent conversion requests
+    def metrics(self):
+        now = time.monotonic()
+        uptime = now - self._started
+        latencies = sorted(seconds for end, seconds in self._latencies)
+        recent = sum(1 for end, seconds in self._latencies if now - end <= throughputWindow)
+        return {
+            'uptime': round(uptime, 3),
+            'requests': dict(self.stats),
+            'queued': self._queue.qsize(),
+            'queueSize': self.queueSize,
+            'inflight': len(self._pending) - self._queue.qsize(),
+            'throughput': round(recent/max(min(uptime, throughputWindow), 1e-9), 3),
+            'latency': {
+                'p50': _percentile(latencies, 0.5),
+                'p95': _percentile(latencies, 0.95),
+                'p99': _percentile(latencies, 0.99),
+                'max': latencies[-1] if latencies else None,
+            },
+        }
+
+    #Takes conversions off the queue and runs them on the pool
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            key, body, params, future = await self._queue.get()
+            try:
+                result = await loop.run_in_executor(self._pool, _convertJob, body, params, self.cache)
+                future.set_result(result)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                del self._pending[key]
+                self._queue.task_done()
+
+    #Queues a conversion or joins an identical one in flight
+    #@return (future, coalesced) or (None, False) if the queue is full
+    def _submit(self, body, params):
+        key = requestKey(body, params)
+        future = self._pending.get(key)
+        if future is not None:
+            return future, True
+        if len(self._pending) >= self._capacity:
+            return None, False
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((key, body, params, future))
+        self._pending[key] = future
+        return future, False
+
+    async def _convert(self, query, body):
+        start = time.monotonic()
+        self.stats['convert'] += 1
+        try:
+            params = parseParams(query)
+        except ValueError as e:
+            self.stats['invalid'] += 1
+            return 400, str(e).encode(), {}
+
+        future, coalesced = self._submit(body, params)
+        if future is None:
+            self.stats['rejected'] += 1
+            return 503, b'conversion queue full', {'Retry-After': '1'}
+        if coalesced:
+            self.stats['coalesced'] += 1
+
+        try:
+            data, error, seconds = await asyncio.shield(future)
+        except Exception as e:
+            self.stats['failed'] += 1
+            return 500, ('%s: %s' % (type(e).__name__, e)).encode(), {}
+        if error is not None:
+            self.stats['invalid'] += 1
+            return 400, error.encode(), {}
+
+        end = time.monotonic()
+        self.stats['converted'] += 1
+        self._latencies.append((end, end - start))
+        headers = {'Content-Type': 'application/octet-stream', 'X-Convert-Seconds': '%.4f' % seconds}
+        if coalesced:
+            headers['X-Coalesced'] = '1'
+        return 200, data, headers
+
+    async def _route(self, method, target, body):
+        url = urlsplit(target)
+        if url.path == '/convert':
+            if method != 'POST':
+                return 405, b'use POST', {'Allow': 'POST'}
+            return await self._convert(url.query, body)
+        if url.path in ('/metrics', '/health'):
+            if method != 'GET':
+                return 405, b'use GET', {'Allow': 'GET'}
+            if url.path == '/health':
+                return 200, b'ok', {}
+            return 200, json.dumps(self.metrics(), indent=1).encode(), {'Content-Type': 'application/json'}
+        return 404, b'not found', {}
+
+    #One connection, requests are served in turn while it is kept alive
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except asyncio.IncompleteReadError:
+                    break
+                except asyncio.LimitOverrunError:
+                    await _respond(writer, 413, b'request head too large', {}, False)
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                try:
+                    method, target, protocol = lines[0].split(' ')
+                    headers = {}
+                    for line in lines[1:]:
+                        if line:
+                            name, value = line.split(':', 1)
+                            headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get('content-length', 0))
+                    if length < 0:
+                        raise ValueError('negative content length')
+                except ValueError:
+                    await _respond(writer, 400, b'malformed request', {}, False)
+                    break
+                keepAlive = protocol == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+
+                if length > maxBody:
+                    await _respond(writer, 413, b'upload too large', {}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                status, data, extra = await self._route(method, target, body)
+                await _respond(writer, status, data, extra, keepAlive)
+                if not keepAlive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+async def _respond(writer, status, data, headers, keepAlive):
+    lines = ['HTTP/1.1 %d %s' % (status, _reasons[status]),
+             'Content-Length: %d' % len(data),
+             'Connection: %s' % ('keep-alive' if keepAlive else 'close')]
+    if 'Content-Type' not in headers:
+        lines.append('Content-Type: text/plain; charset=utf-8')
+    lines += ['%s: %s' % item for item in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + data)
+    await writer.drain()
+
+def _percentile(values, q):
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, int(q*len(values)))], 6)
+
+def _parser():
+    parser = ArgumentParser(prog='convert-server', description='Serve image conversions over HTTP on a process pool')
+    parser.add_argument('--host', default='127.0.0.1', help='address to bind, localhost by default')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, defaults to the cpu count')
+    parser.add_argument('--queue', type=int, default=64, help='conversions waiting for a worker before requests get 503')
+    parser.add_argument('--cache', default=None, metavar='DIR', help='reuse conversions stored in this directory')
+    parser.add_argument('--cache-size', type=int, default=256, metavar='MB', help='size limit of the cache directory')
+    return parser
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+
+    async def run():
+        server = await Server(args.host, args.port, args.workers, args.queue,
+                              args.cache, args.cache_size*2**20).start()
+        print('Serving conversions on http://%s:%d/convert' % (server.host, server.port))
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,249 @@
+#Tiled conversion of images larger than one screen, for walls of screens.
+#The source is read in row bands one screen high and every band is cut
+#into screen sized tiles, written as one .bytes file each plus a
+#layout.json manifest of where every tile goes.
+#
+#Palettes are either per tile (every tile is converted like a standalone
+#image) or global: one custom palette picked from a sample of the whole
+#source, shared by all tiles so that colors match across screen borders.
+#Dithering carries the error across tile borders: the error leaving the
+#bottom of a band lands in the next band. With a global palette a band is
+#dithered in one go and the result is the same as dithering the whole
+#image at once. Per tile palettes dither the tiles of a band left to right,
+#the error leaving the right edge lands in the next tile. The rows a band
+#carries follow the reach of the dither kernel, see Kernel.
+#
+#Memory is bounded by the band: .npy and binary .ppm sources are memory
+#mapped and only one band is read at a time. Other formats are decoded by
+#PIL, which always holds the whole image in its own pixel format while
+#decoding, and copied band by band into a memory mapped temporary file,
+#the decoded image is closed before the first tile is cut.
+#
+#Usage: python Tiles.py <image> --out <dir> [--res hres|lres] [--dither] [--palette tile|global]
+#   or: python Converter.py convert-tiled <image> ...
+
+from argparse import ArgumentParser
+from imageConverter import Converter, Encoder, Engine, FastDither, Kernel
+from PIL import Image
+import numpy as np
+import json, math, os, sys, tempfile
+
+hres = Converter.hres
+lres = Converter.lres
+
+#size of one screen in pixels per resolution
+screens = {hres: (320, 200), lres: (160, 100)}
+
+#pixels per chunk (x, y)
+chunks = {hres: (2, 4), lres: (1, 2)}
+
+#pixels sampled from the source to pick a global palette
+sampleSize = 320*200
+
+#Source image read in row bands
+class Source():
+    #@param source: path of an image, .npy or .ppm file, or (H, W, 3) array
+    def __init__(self, source):
+        if isinstance(source, np.ndarray):
+            arr = source
+        elif source.lower().endswith('.npy'):
+            arr = np.load(source, mmap_mode='r')
+        elif source.lower().endswith(('.ppm', '.pnm')):
+            arr = _mapPPM(source)
+        else:
+            arr = _mapPIL(source)
+
+        if arr.ndim != 3 or arr.shape[2] < 3:
+            raise ValueError('source must be an RGB image')
+        self._arr = arr
+        self.height, self.width = arr.shape[:2]
+
+    #Rows y0 to y1 (exclusive) as an (y1 - y0, W, 3) uint8 array
+    def rows(self, y0, y1):
+        return np.array(self._arr[y0:y1, :, :3], dtype=np.uint8)
+
+#Memory maps the pixels of a binary 8 bit PPM file
+def _mapPPM(path):
+    with open(path, 'rb') as f:
+        head = f.read(512)
+
+    fields = []
+    pos = 0
+    while len(fields) < 4:
+        while head[pos:pos+1].isspace():
+            pos += 1
+        if head[pos:pos+1] == b'#':
+            pos = head.index(b'\n', pos) + 1
+            continue
+        end = pos
+        while end < len(head) and not head[end:end+1].isspace():
+            end += 1
+        fields.append(head[pos:end])
+        pos = end
+
+    if fields[0] != b'P6' or int(fields[3]) != 255:
+        raise ValueError('only binary 8 bit PPM files are supported: %s' % path)
+    width, height = int(fields[1]), int(fields[2])
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=pos + 1, shape=(height, width, 3))
+
+#Decodes an image with PIL and copies its RGB pixels into an anonymous
+#temporary file that is memory mapped, rows pixel rows at a time
+def _mapPIL(path, rows=200):
+    with Image.open(path) as im:
+        width, height = im.size
+        arr = np.memmap(tempfile.TemporaryFile(), dtype=np.uint8, mode='w+', shape=(height, width, 3))
+        for y in range(0, height, rows):
+            arr[y:y+rows] = np.asarray(im.crop((0, y, width, min(y + rows, height))).convert('RGB'))
+    return arr
+
+#Tiles of the wall as (row, col, x, y, width, height) in pixels, edge
+#tiles are cut down to whole chunks and dropped if none is left
+def tileGrid(width, height, res):
+    tw, th = screens[res]
+    xlen, ylen = chunks[res]
+    tiles = []
+    for row, y in enumerate(range(0, height, th)):
+        h = min(th, height - y)
+        h -= h % ylen
+        for col, x in enumerate(range(0, width, tw)):
+            w = min(tw, width - x)
+            w -= w % xlen
+            if w and h:
+                tiles.append((row, col, x, y, w, h))
+    return tiles
+
+#Custom palette of the whole source from an evenly spaced sample of its
+#pixels, read band by band
+def samplePalette(source, res, colors=32):
+    step = max(1, math.ceil(math.sqrt(source.width*source.height/sampleSize)))
+    th = screens[res][1]
+    sample = []
+    for y in range(0, source.height, th):
+        band = source.rows(y, min(y + th, source.height))
+        sample.append(band[(-y) % step::step, ::step].copy())
+    return FastDither.get_custom_palette(Image.fromarray(np.concatenate(sample)), colors)
+
+#Converts a source larger than one screen into one .bytes file per tile
+#@param source: path of an image, .npy or .ppm file, or (H, W, 3) array
+#@param outDir: directory of the tiles and layout.json
+#@param palette: 'tile' for a palette per tile, 'global' for one shared palette
+#@param preview (boolean): also write a preview png per tile
+#@param compress (boolean): compressed tiles, needs version 2
+#@param kernel: dither kernel, see Kernel
+#@return dict: the layout manifest
+def convertTiled(source, outDir, res='hres', dither=False, colors=32, palette='tile',
+                 version=2, order=True, preview=False, compress=False, kernel='floyd-steinberg'):
+    res = Converter._resolution(res)
+    kernel = Kernel.get(kernel)
+    if palette not in ('tile', 'global'):
+        raise ValueError('unknown palette mode: %r' % (palette,))
+    if version not in Encoder.versions:
+        raise ValueError('unknown format version: %r' % (version,))
+    if compress and version != 2:
+        raise ValueError('compression needs format version 2')
+
+    source = source if isinstance(source, Source) else Source(source)
+    sharedPalette = samplePalette(source, res, colors) if palette == 'global' else None
+    os.makedirs(outDir, exist_ok=True)
+
+    grid = tileGrid(source.width, source.height, res)
+    bands = {}
+    for tile in grid:
+        bands.setdefault(tile[0], []).append(tile)
+
+    manifest = {
+        'res': 'hres' if res == hres else 'lres',
+        'version': version,
+        'compressed': bool(compress),
+        'dither': bool(dither),
+        'kernel': kernel.name if dither else None,
+        'palette': sharedPalette,
+        'source': {'width': source.width, 'height': source.height},
+        'rows': len(bands),
+        'cols': max((tile[1] for tile in grid), default=-1) + 1,
+        'tiles': [],
+    }
+
+    #error carried into the first rows of the next band
+    carry = None
+    reach = max([t[1] for t in kernel.taps] or [0])
+    for band in sorted(bands):
+        tiles = bands[band]
+        y, h = tiles[0][3], tiles[0][5]
+        pixels = source.rows(y, y + h)
+        if dither:
+            cw, ch = FastDither.cells[res]
+            buf = np.array(source.rows(y, y + h + reach), dtype=np.float64)
+            if carry is not None:
+                buf[:len(carry)] = carry
+            if sharedPalette is not None:
+                width = tiles[-1][2] + tiles[-1][4]
+                FastDither.diffuse(buf, sharedPalette, cell=(cw, ch), chunks=(h//ch, width//cw), kernel=kernel)
+
+        for row, col, x, y, w, h in tiles:
+            stats = {}
+            if dither:
+                tilePalette = sharedPalette
+                if tilePalette is None:
+                    tilePalette = FastDither.get_custom_palette(Image.fromarray(pixels[:, x:x+w]), colors)
+                    FastDither.diffuse(buf, tilePalette, cell=(cw, ch), origin=(x, 0), chunks=(h//ch, w//cw), kernel=kernel)
+                tilePixels = buf[:h, x:x+w].astype(np.uint8)
+                cells = Engine.postInit(tilePixels, tilePalette, res)
+                data = Encoder.encode(cells, res, w, h, tilePalette, version, order, stats, compress)
+            elif sharedPalette is not None:
+                cells, tilePixels = Engine.paletteData(pixels[:, x:x+w], sharedPalette, res)
+                data = Encoder.encode(cells, res, w, h, sharedPalette, version, order, stats, compress)
+            else:
+                data, tilePixels = Converter.convert(pixels[:, x:x+w], res, False, colors, True, version, order, stats,
+                                                     compress=compress)
+
+            name = 'tile_%d_%d' % (row, col)
+            with open(os.path.join(outDir, name + '.bytes'), 'wb') as f:
+                f.write(data)
+            if preview:
+                Image.fromarray(tilePixels).save(os.path.join(outDir, name + '.png'))
+
+            entry = {'row': row, 'col': col, 'x': x, 'y': y, 'width': w, 'height': h,
+                     'file': name + '.bytes', 'bytes': len(data)}
+            if 'switches' in stats:
+                entry['switches'] = stats['switches']
+            if 'compression' in stats:
+                entry['compression'] = stats['compression']
+            manifest['tiles'].append(entry)
+
+        if dither and buf.shape[0] > h:
+            carry = buf[h:].copy()
+
+    with open(os.path.join(outDir, 'layout.json'), 'w') as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+def _parser():
+    parser = ArgumentParser(prog='Tiles', description='Convert an image larger than one screen into per screen tiles')
+    parser.add_argument('source', help='image, .npy or binary .ppm file')
+    parser.add_argument('--out', required=True, help='directory of the tiles and layout.json')
+    parser.add_argument('--res', choices=('hres', 'lres'), default='hres')
+    parser.add_argument('--dither', action='store_true', help='dither the image')
+    parser.add_argument('--kernel', choices=sorted(Kernel.kernels), default='floyd-steinberg', help='dither kernel of --dither')
+    parser.add_argument('--colors', type=int, default=32, help='colors of the adaptive quantization')
+    parser.add_argument('--palette', choices=('tile', 'global'), default='tile', help='palette per tile or shared by all tiles')
+    parser.add_argument('--format-version', type=int, choices=Encoder.versions, default=2)
+    parser.add_argument('--no-order', action='store_true', help='keep groups in color order')
+    parser.add_argument('--preview', action='store_true', help='write a preview png per tile')
+    parser.add_argument('--compress', action='store_true', help='compress the tiles, image.lua decodes them while drawing')
+    return parser
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+    try:
+        manifest = convertTiled(args.source, args.out, args.res, args.dither, args.colors, args.palette,
+                                args.format_version, not args.no_order, args.preview, args.compress, args.kernel)
+    except ValueError as e:
+        print('Error - %s' % e, file=sys.stderr)
+        return 1
+    print('%d x %d tiles, %d bytes written to %s' % (manifest['cols'], manifest['rows'],
+          sum(tile['bytes'] for tile in manifest['tiles']), args.out))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,150 @@
+#Multi-core error diffusion. The chunk rows of an image are split into one
+#band per worker and every worker runs the wavefront of FastDither.diffuse
+#on its own band: inside a band chunk row r+1 trails row r by lag chunks, and
+#the top row of a band trails the bottom row of the band above by lag chunks
+#as well. Every worker publishes how many chunks of its bottom row are done
+#and before a wave waits for the band above to be far enough ahead, so the
+#bands run as a skewed pipeline without a barrier between waves.
+#
+#A band never touches pixels the band above is still working on and every
+#pixel receives its error in the order of the sequential scan, so the result
+#is identical to FastDither.diffuse for any number of workers. Ordered
+#kernels have no dependencies, their bands simply run side by side.
+#
+#Workers are threads working on the buffer itself, or processes working on
+#a copy of it in shared memory. NumPy releases the GIL only inside its loops,
+#so threads gain less on the small waves of an image than processes do;
+#processes cost a fork per worker and image.
+#
+#Usage:
+#   Wavefront.diffuse(buf, palette, cell=FastDither.cells[res], workers=4)
+
+import multiprocessing, os, threading
+import numpy as np
+from imageConverter import ColorIndex, FastDither, Kernel
+
+modes = ('thread', 'process')
+
+#(first, end) chunk row of every band, as even as possible
+def bands(rows, workers):
+    n = max(1, min(workers, rows))
+    edges = [rows*i//n for i in range(n + 1)]
+    return list(zip(edges[:-1], edges[1:]))
+
+#Chunks of the bottom row every band has finished, shared by the workers of
+#one diffuse call. Works with the locks and arrays of threading and of a
+#multiprocessing context alike
+class Progress():
+    def __init__(self, condition, done):
+        self.condition = condition
+        self.done = done
+
+    #Blocks until band has finished at least count chunks
+    def wait(self, band, count):
+        with self.condition:
+            self.condition.wait_for(lambda: self.done[band] >= count)
+
+    def publish(self, band, count):
+        with self.condition:
+            self.done[band] = count
+            self.condition.notify_all()
+
+#Dithers the chunk rows r0 to r1 of a region, see FastDither.diffuse.
+#A failing band still publishes all of its chunks so the bands below it
+#do not wait forever
+#@param settings (tuple): palette, exact, pairs, cell, origin, cols, metric and kernel
+def _band(buf, errors, settings, band, r0, r1, progress):
+    palette, exact, pairs, cell, origin, cols, metric, kernel = settings
+    cw, ch = cell
+    x0, y0 = origin
+    rows = r1 - r0
+    try:
+        if kernel.ordered:
+            FastDither.diffuse(buf, palette, exact, pairs, cell, (x0, y0 + r0*ch), (rows, cols), metric, errors, kernel)
+            return
+
+        index = ColorIndex.ColorIndex(palette, metric)
+        lag = FastDither._geometry(cw, ch, kernel)[2]
+        for wave in range(cols + lag*(rows - 1)):
+            if band and wave < cols:
+                progress.wait(band - 1, min(cols, wave + lag))
+            r = np.arange(max(0, -(-(wave - cols + 1) // lag)), min(rows - 1, wave // lag) + 1)
+            c = wave - lag*r
+            FastDither.dither_chunks(buf, x0 + c*cw, y0 + (r0 + r)*ch, index, exact, pairs, cell, errors, kernel)
+            if wave >= lag*(rows - 1):
+                progress.publish(band, wave - lag*(rows - 1) + 1)
+    finally:
+        progress.publish(band, cols)
+
+#Process entry point, maps the shared buffers and runs its band
+def _bandProcess(shared, sharedErrors, shape, settings, band, r0, r1, progress):
+    buf = np.frombuffer(shared, dtype=np.float64).reshape(shape)
+    errors = np.frombuffer(sharedErrors, dtype=np.float64).reshape(shape) if sharedErrors is not None else None
+    _band(buf, errors, settings, band, r0, r1, progress)
+
+def _threads(buf, errors, settings, parts):
+    progress = Progress(threading.Condition(), [0]*len(parts))
+    failed = []
+
+    def run(band, r0, r1):
+        try:
+            _band(buf, errors, settings, band, r0, r1, progress)
+        except BaseException as error:
+            failed.append(error)
+
+    workers = [threading.Thread(target=run, args=(band, r0, r1)) for band, (r0, r1) in enumerate(parts)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if failed:
+        raise failed[0]
+
+def _processes(buf, errors, settings, parts):
+    context = multiprocessing.get_context()
+    progress = Progress(context.Condition(), context.Array('q', len(parts), lock=False))
+    shared = context.RawArray('d', buf.size)
+    view = np.frombuffer(shared, dtype=np.float64).reshape(buf.shape)
+    view[...] = buf
+    sharedErrors = None
+    if errors is not None:
+        sharedErrors = context.RawArray('d', errors.size)
+        np.frombuffer(sharedErrors, dtype=np.float64).reshape(errors.shape)[...] = errors
+
+    workers = [context.Process(target=_bandProcess, args=(shared, sharedErrors, buf.shape, settings, band, r0, r1, progress))
+               for band, (r0, r1) in enumerate(parts)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    failed = [band for band, worker in enumerate(workers) if worker.exitcode != 0]
+    if failed:
+        raise RuntimeError('dither worker of band %d failed' % failed[0])
+
+    buf[...] = view
+    if errors is not None:
+        errors[...] = np.frombuffer(sharedErrors, dtype=np.float64).reshape(errors.shape)
+
+#Dithers a float (H, W, 3) buffer in place on several workers, the same
+#arguments and result as FastDither.diffuse
+#@param workers (number): bands dithered at once, os.cpu_count() if None
+#@param mode: 'thread' or 'process'
+#@return buf
+def diffuse(buf, palette, exact=False, pairs=16, cell=(FastDither.x_step, FastDither.y_step), origin=(0, 0), chunks=None, metric=None,
+            errors=None, kernel=None, workers=None, mode='thread'):
+    if mode not in modes:
+        raise ValueError('unknown wavefront mode: %r' % (mode,))
+    cw, ch = cell
+    kernel = Kernel.get(kernel)
+    rows, cols = chunks or ((buf.shape[0] - origin[1]) // ch, (buf.shape[1] - origin[0]) // cw)
+    parts = bands(rows, workers or os.cpu_count() or 1)
+    #errors reaching further than the next chunk row would cross bands
+    if len(parts) < 2 or not cols or max([t[1] for t in kernel.taps] or [0]) > ch:
+        return FastDither.diffuse(buf, palette, exact, pairs, cell, origin, chunks, metric, errors, kernel)
+
+    settings = (palette, exact, pairs, cell, origin, cols, metric, kernel)
+    if mode == 'thread':
+        _threads(buf, errors, settings, parts)
+    else:
+        _processes(buf, errors, settings, parts)
+    return buf
@@ -2,6 +2,7 @@
 --@author schnwil
 
 local component = require("component")
+local computer = require("computer")
 local gpu = component.gpu
 local unicode = require("unicode")
 local fs = require("filesystem")
@@ -12,13 +13,30 @@ local image = {}
 local hres = 32
 local lres = 16
 local sig = {89, 65, 73, 76}
-local version = 1
+local version = 2
+
+--header flags of format version 2
+local animated = 1
+local patch = 2
+local compressed = 4
+local indexed = 8
+
+--bytes read from the file at once and the LZ window of compressed payloads
+local blockSize = 512
+local window = 4096
 
 --quantization information
 local rv = {0, 51, 102, 153, 204, 255}
 local gv = {0, 36, 73, 109, 146, 182, 216, 255}
 local bv = {0, 64, 128, 192, 255}
 
+--0xRRGGBB of the 240 color bytes of the 6-8-5 color cube
+local cubeColors = {}
+for colorByte=0,239,1 do
+  cubeColors[colorByte] = rv[math.floor(colorByte / 40) + 1]*65536
+    + gv[math.floor((colorByte % 40) / 5) + 1]*256 + bv[colorByte % 5 + 1]
+end
+
 --Get the current backround and foreground colors.
 --@return number, number: bgColor, fgColor
 function image.getColors()
@@ -77,40 +95,181 @@ function image.imshowCrop(filepath, xOff, yOff, xCut, yCut, timer)
   if yOff == nil then yOff = 0 end
   if timer == nil then timer = false end
 
-  local fp = filepath
+  local f, vers, fb, flags = image._open(filepath)
+  if f == nil then return end
+
+  local result
+  local kind, packed = flags % compressed, flags >= compressed
+  if vers == 1 then
+    if fb == hres then result = image._showHRes(f, xOff, yOff, xCut, yCut, timer)
+    else result = image._showLRes(f, xOff, yOff, xCut, yCut, timer) end
+  elseif flags == indexed then
+    result = image._showTiles(f, fb, xOff, yOff, xCut, yCut, timer)
+  elseif flags < 2*compressed and (kind == 0 or kind == patch) then
+    result = image._showRuns(f, fb, xOff, yOff, xCut, yCut, timer, packed)
+  elseif flags < 2*compressed and kind == animated then
+    result = image._playFrames(f, fb, xOff, yOff, xCut, yCut, 1, timer, packed)
+  else
+    io.stderr:write(string.format("Error - unsupported flags: %i\n", flags))
+  end
+  
+  f:close()
+  return result
+end
+
+--Play an animation made by Sequence.py
+--@param filepath (string): absolute file path to the animation
+--@param xOff, yOff (number, number): start offset from top left
+--@param loops (number): times to play the animation, 0 plays it until interrupted
+function image.play(filepath, xOff, yOff, loops)
+  assert(type(filepath) == "string", "filepath must be a string of the absolute file path")
+  if xOff == nil then xOff = 0 end
+  if yOff == nil then yOff = 0 end
+  if loops == nil then loops = 1 end
+
+  local f, vers, fb, flags = image._open(filepath)
+  if f == nil then return end
+
+  if vers ~= 2 or flags % compressed ~= animated or flags >= 2*compressed then
+    io.stderr:write("Error - not an animation\n")
+  else
+    image._playFrames(f, fb, xOff, yOff, 160-xOff, 50-yOff, loops, false, flags >= compressed)
+  end
+  f:close()
+end
+
+--Draw a patch made by Incremental.py over the image it was made from.
+--Only the cells that changed are drawn, the palette of the image stays set
+--@param filepath (string): absolute file path to the patch
+--@param xOff, yOff (number, number): offset the image was drawn at
+function image.applyPatch(filepath, xOff, yOff)
+  assert(type(filepath) == "string", "filepath must be a string of the absolute file path")
+  if xOff == nil then xOff = 0 end
+  if yOff == nil then yOff = 0 end
+
+  local f, vers, fb, flags = image._open(filepath)
+  if f == nil then return end
 
-  if fs.exists(fp) == false then
+  if vers ~= 2 or flags % compressed ~= patch or flags >= 2*compressed then
+    io.stderr:write("Error - not a patch\n")
+  else
+    image._showRuns(f, fb, xOff, yOff, 160-xOff, 50-yOff, false, flags >= compressed)
+  end
+  f:close()
+end
+
+--Open an image file and check its header
+--@param filepath (string): absolute file path to image
+--@return reader, number, number, number: buffered reader (see
+--image._reader) after the header, version, resolution byte and flags (0 for
+--version 1). nil on error
+function image._open(filepath)
+  if fs.exists(filepath) == false then
     io.stderr:write("Error - file does not exist, filepath must be the absolute path\n")
     return
   end
 
-  local f = io.open(fp, "rb")
-  
-  --check header and size
-  local header = {0, 0, 0, 0}
-  
-  for i=1,4,1 do
-    header[i] = f:read(1):byte()
+  local f = image._reader(io.open(filepath, "rb"))
 
-    if header[i] ~= sig[i] then
-      io.stderr:write("Error - wrong header\n")
-      return
-    end
+  --check header and size
+  local s1, s2, s3, s4, vers, fb = f:bytes(6)
+  if s1 ~= sig[1] or s2 ~= sig[2] or s3 ~= sig[3] or s4 ~= sig[4] then
+    io.stderr:write("Error - wrong header\n")
+    f:close()
+    return
   end
-  
-  local vers = f:read(1):byte()
-  if vers ~= version then
+
+  if vers < 1 or vers > version then
     io.stderr:write(string.format("Error - wrong version: File=%i, YAI=%i\n", vers, version))
+    f:close()
     return
   end
-  
-  local fb = f:read(1):byte()
-  if fb == hres then return image._showHRes(f, xOff, yOff, xCut, yCut, timer)
-  elseif fb == lres then return image. _showLRes(f, xOff, yOff, xCut, yCut, timer)
-  else io.stderr:write("Error - unknown resolution byte\n") end
-  
-  f:close()
-  
+
+  if fb ~= hres and fb ~= lres then
+    io.stderr:write("Error - unknown resolution byte\n")
+    f:close()
+    return
+  end
+
+  local flags = 0
+  if vers >= 2 then
+    flags = f:bytes(1)
+  end
+  return f, vers, fb, flags
+end
+
+--Buffered reader over an open file. The file is read blockSize bytes at a
+--time and the bytes are handed out from the buffer with string.byte, a
+--handful of f:read calls per image instead of one per byte. at is the file
+--position of the first buffered byte
+local Reader = {}
+Reader.__index = Reader
+
+--@param f (file): open file
+--@return reader with bytes(n), read(n), seek(whence, offset) and close()
+function image._reader(f)
+  return setmetatable({f = f, buf = "", pos = 1, at = f:seek("cur")}, Reader)
+end
+
+--Make sure n bytes are buffered
+--@return boolean: false if the file ends before
+function Reader:_fill(n)
+  local left = #self.buf - self.pos + 1
+  while left < n do
+    local block = self.f:read(math.max(blockSize, n - left))
+    if block == nil then return false end
+    self.buf = string.sub(self.buf, self.pos) .. block
+    self.at = self.at + self.pos - 1
+    self.pos = 1
+    left = #self.buf
+  end
+  return true
+end
+
+--Next n bytes as numbers, nil at the end of the file
+function Reader:bytes(n)
+  if not self:_fill(n) then return nil end
+  local pos = self.pos
+  self.pos = pos + n
+  return string.byte(self.buf, pos, pos + n - 1)
+end
+
+--Next n bytes as a string like f:read, shorter or nil at the end of the file
+function Reader:read(n)
+  self:_fill(n)
+  if self.pos > #self.buf then return nil end
+  local s = string.sub(self.buf, self.pos, self.pos + n - 1)
+  self.pos = self.pos + #s
+  return s
+end
+
+--Position in the file like f:seek. Seeking inside the buffer keeps it,
+--seeking elsewhere drops it
+function Reader:seek(whence, offset)
+  if whence == "set" then
+    if offset >= self.at and offset <= self.at + #self.buf then
+      self.pos = offset - self.at + 1
+    else
+      self.buf, self.pos, self.at = "", 1, offset
+      self.f:seek("set", offset)
+    end
+  end
+  return self.at + self.pos - 1
+end
+
+function Reader:close()
+  return self.f:close()
+end
+
+--Table of every color byte to its 0xRRGGBB color. Bytes over 239 are the
+--custom palette colors currently set, build it after reading the palette
+--@return table: color by color byte 0~255
+function image._colorTable()
+  local colors = setmetatable({}, {__index = cubeColors})
+  for i=0,15,1 do
+    colors[240 + i] = gpu.getPaletteColor(i)
+  end
+  return colors
 end
 
 --Convert byte containing RGB information in three integers
@@ -132,8 +291,385 @@ function image._byte2RGB(colorByte)
   return rv[r], gv[g], bv[b]
 end
 
+--Read the palette section and set the custom palette colors
+--@param f (reader): reader at the palette length byte
+function image._readPalette(f)
+  local paletteLen = f:bytes(1)
+
+  for i=0,paletteLen-1,1 do
+    local r, g, b = f:bytes(3)
+    gpu.setPaletteColor(i, r*65536 + g*256 + b)
+  end
+end
+
+--Streaming decoder of a compressed payload (compressed flag, see
+--Compress.py). Takes the compressed bytes from the buffered reader of the
+--file and keeps only the last window decoded bytes, so memory stays bounded
+--whatever the file size. The stream reads and seeks like the reader it wraps
+local Inflate = {}
+Inflate.__index = Inflate
+
+--@param f (reader): reader positioned at the compressed payload
+--@return stream with bytes(n), read(n) and seek(whence, offset) over the
+--decoded bytes
+function image._inflate(f)
+  local stream = setmetatable({f = f, base = f:seek("cur"), got = {}}, Inflate)
+  stream:_reset()
+  return stream
+end
+
+--Start decoding over from the beginning of the payload
+function Inflate:_reset()
+  self.f:seek("set", self.base)
+  self.win = {}
+  self.out = 0
+  self.flags = 0
+  self.items = 0
+  self.copyFrom = 0
+  self.copyLeft = 0
+end
+
+--Next byte of the compressed payload, nil at the end of the file
+function Inflate:_in()
+  return self.f:bytes(1)
+end
+
+--Next decoded byte, nil at the end of the payload
+function Inflate:_next()
+  if self.copyLeft == 0 then
+    --every flag byte tells for its 8 items literal (1) or match (0)
+    if self.items == 0 then
+      self.flags = self:_in()
+      if self.flags == nil then return nil end
+      self.items = 8
+    end
+    local literal = self.flags % 2 == 1
+    self.flags = math.floor(self.flags / 2)
+    self.items = self.items - 1
+
+    if literal then
+      local b = self:_in()
+      if b == nil then return nil end
+      self.win[self.out % window] = b
+      self.out = self.out + 1
+      return b
+    end
+
+    --match, 12 bits distance and 4 bits length
+    local hi, lo = self:_in(), self:_in()
+    if lo == nil then return nil end
+    self.copyFrom = self.out - (hi*16 + math.floor(lo/16)) - 1
+    self.copyLeft = lo % 16 + 3
+  end
+
+  local b = self.win[self.copyFrom % window]
+  self.copyFrom = self.copyFrom + 1
+  self.copyLeft = self.copyLeft - 1
+  self.win[self.out % window] = b
+  self.out = self.out + 1
+  return b
+end
+
+--Next n decoded bytes as numbers, nil at the end of the payload
+function Inflate:bytes(n)
+  if n == 1 then return self:_next() end
+  local got = self.got
+  for i=1,n,1 do
+    got[i] = self:_next()
+    if got[i] == nil then return nil end
+  end
+  return table.unpack(got, 1, n)
+end
+
+--Next n decoded bytes as a string, nil at the end of the payload
+function Inflate:read(n)
+  local bytes = {}
+  for i=1,n,1 do
+    local b = self:_next()
+    if b == nil then break end
+    bytes[i] = b
+  end
+  if #bytes == 0 then return nil end
+  return string.char(table.unpack(bytes))
+end
+
+--Position in the decoded bytes. Seeking back decodes again from the start
+function Inflate:seek(whence, offset)
+  if whence == "set" then
+    if offset < self.out then self:_reset() end
+    while self.out < offset and self:_next() ~= nil do end
+  end
+  return self.out
+end
+
+--Write run encoded image (format version 2) to display. Every run of cells
+--sharing colors is drawn with a single gpu.set
+--@param f (reader): reader positioned after the flags byte
+--@param res (number): hres or lres
+--@param xOff, yOff (number, number): start offset from top left
+--@param xCut, yCut (number, number): max number of units in each dimension from top left
+--@param timer (boolean): true returns time in seconds for imshow
+--@param packed (boolean): compressed flag, the payload is decoded while drawing
+function image._showRuns(f, res, xOff, yOff, xCut, yCut, timer, packed)
+  local start = os.time()
+
+  if image._readSize(f) == nil then return end
+  image._readPalette(f)
+  if packed then f = image._inflate(f) end
+
+  --get current colors
+  local bgColorCur, fgColorCur = image.getColors()
+  local colorTable = image._colorTable()
+
+  image._drawGroups(f, res, xOff, yOff, xCut + xOff, yCut + yOff, colorTable, {}, nil, packed)
+
+  gpu.setBackground(bgColorCur)
+  gpu.setForeground(fgColorCur)
+
+  if timer then
+    return (os.time()-start)/72
+  end
+end
+
+--Play the frames of an animation (format version 2, animated flag). The
+--first frame is a full image, every following frame holds only the runs of
+--cells that changed since the frame before
+--@param f (reader): reader positioned after the flags byte
+--@param res (number): hres or lres
+--@param loops (number): times to play the animation, 0 plays it until interrupted
+--@param timer (boolean): true returns time in seconds for imshow
+--@param packed (boolean): compressed flag, every loop decodes the frames again
+function image._playFrames(f, res, xOff, yOff, xCut, yCut, loops, timer, packed)
+  local start = os.time()
+
+  if image._readSize(f) == nil then return end
+  image._readPalette(f)
+  if packed then f = image._inflate(f) end
+
+  local hi, lo = f:bytes(2)
+  local frameCount = hi*256 + lo
+  local first = f:seek("cur")
+
+  local bgColorCur, fgColorCur = image.getColors()
+  local colorTable = image._colorTable()
+  local colors = {}
+  local played = 0
+
+  while loops == 0 or played < loops do
+    f:seek("set", first)
+    for i=1,frameCount,1 do
+      local due = computer.uptime()
+      local delayHi, delayLo, groupsHi, groupsLo = f:bytes(4)
+      due = due + (delayHi*256 + delayLo)/100
+
+      image._drawGroups(f, res, xOff, yOff, xCut + xOff, yCut + yOff, colorTable, colors,
+        groupsHi*256 + groupsLo, packed)
+
+      local wait = due - computer.uptime()
+      if wait > 0 then os.sleep(wait) end
+    end
+    played = played + 1
+  end
+
+  gpu.setBackground(bgColorCur)
+  gpu.setForeground(fgColorCur)
+
+  if timer then
+    return (os.time()-start)/72
+  end
+end
+
+--Draw an indexed image (format version 2, indexed flag). A full draw reads
+--the groups like image._showRuns, a crop reads the lists of the tiles that
+--show inside the cut and on the screen and draws their segments in file
+--order, the index gives the offset of the first list of every row
+--@param f (reader): reader positioned after the flags byte
+--@param res (number): hres or lres
+--@param xOff, yOff (number, number): start offset from top left
+--@param xCut, yCut (number, number): max number of units in each dimension from top left
+--@param timer (boolean): true returns time in seconds for imshow
+function image._showTiles(f, res, xOff, yOff, xCut, yCut, timer)
+  local start = os.time()
+
+  local xSize, ySize = image._readSize(f)
+  if xSize == nil then return end
+  image._readPalette(f)
+
+  local tileWidth, tileHeight, countHi, countLo, l1, l2, l3, l4 = f:bytes(8)
+  local groupCount = countHi*256 + countLo
+  local groups = f:seek("cur")
+  local cols = math.ceil(xSize / tileWidth)
+  local rows = math.ceil(ySize / tileHeight)
+  local index = groups + ((l1*256 + l2)*256 + l3)*256 + l4
+  local lists = index + 4*cols*rows
+
+  --cells of the image that land on the screen inside the cut
+  local xMax, yMax = gpu.maxResolution()
+  local x0, x1 = math.max(1, 1 - xOff), math.min(xSize, xCut, xMax - xOff)
+  local y0, y1 = math.max(1, 1 - yOff), math.min(ySize, yCut, yMax - yOff)
+
+  local bgColorCur, fgColorCur = image.getColors()
+  local colorTable = image._colorTable()
+  local colors = {}
+
+  if x0 <= x1 and y0 <= y1 then
+    local c0 = math.floor((x0 - 1) / tileWidth)
+    local c1 = math.floor((x1 - 1) / tileWidth)
+    local r0 = math.floor((y0 - 1) / tileHeight)
+    local r1 = math.floor((y1 - 1) / tileHeight)
+
+    if c0 == 0 and r0 == 0 and c1 == cols - 1 and r1 == rows - 1 then
+      image._drawGroups(f, res, xOff, yOff, xCut + xOff, yCut + yOff, colorTable, colors, groupCount, false)
+    else
+      --offsets first, the index is small and reading it in one go keeps the
+      --lists of consecutive rows in one stretch of reads
+      local offsets = {}
+      for r=r0,r1,1 do
+        f:seek("set", index + 4*(r*cols + c0))
+        local a, b, c, d = f:bytes(4)
+        offsets[r] = ((a*256 + b)*256 + c)*256 + d
+      end
+
+      local segments = {}
+      for r=r0,r1,1 do
+        f:seek("set", lists + offsets[r])
+        for i=c0,c1,1 do
+          local hi, lo = f:bytes(2)
+          for s=1,hi*256 + lo,1 do
+            local o1, o2, o3, bg, fg = f:bytes(5)
+            segments[#segments + 1] = {(o1*256 + o2)*256 + o3, bg, fg, i, r}
+          end
+        end
+      end
+      table.sort(segments, function(a, b) return a[1] < b[1] end)
+
+      for _, segment in ipairs(segments) do
+        local offset, bg, fg, i, r = table.unpack(segment)
+        local bgColor = colorTable[bg]
+        if bgColor ~= colors.bg then
+          colors.bg = bgColor
+          gpu.setBackground(bgColor)
+        end
+        f:seek("set", groups + offset)
+        image._drawRuns(f, res, xOff, yOff, xCut + xOff, yCut + yOff, colorTable[fg], colors, false,
+          {i*tileWidth + 1, r*tileHeight + 1, (i + 1)*tileWidth, (r + 1)*tileHeight})
+      end
+    end
+  end
+
+  gpu.setBackground(bgColorCur)
+  gpu.setForeground(fgColorCur)
+
+  if timer then
+    return (os.time()-start)/72
+  end
+end
+
+--Read and check the image size
+--@return number, number: xSize, ySize or nil if it does not fit the screen
+function image._readSize(f)
+  local xMax, yMax = gpu.maxResolution()
+  local xSize, ySize = f:bytes(2)
+
+  if xSize > xMax or ySize > yMax then
+    io.stderr:write(string.format("Error - wrong size (x,y): %i %i\n", xSize, ySize))
+    return
+  end
+  return xSize, ySize
+end
+
+--Draw groups of runs (format version 2)
+--@param f (reader): reader positioned at a group
+--@param res (number): hres or lres
+--@param xOff, yOff (number, number): start offset from top left
+--@param xCut, yCut (number, number): last visible column and row
+--@param colorTable (table): colors of the color bytes, see image._colorTable
+--@param colors (table): bg and fg colors set last, kept between calls
+--@param groups (number): groups to draw, nil draws until the end of file
+--@param delta (boolean): coordinates are delta coded (compressed flag)
+function image._drawGroups(f, res, xOff, yOff, xCut, yCut, colorTable, colors, groups, delta)
+  local drawn = 0
+
+  --main loop, one group of runs per color pair
+  while groups == nil or drawn < groups do
+    local bg, fg = f:bytes(2)
+    if bg == nil then break end
+    drawn = drawn + 1
+
+    local bgColor = colorTable[bg]
+    if bgColor ~= colors.bg then
+      colors.bg = bgColor
+      gpu.setBackground(bgColor)
+    end
+
+    image._drawRuns(f, res, xOff, yOff, xCut, yCut, colorTable[fg], colors, delta)
+  end
+end
+
+--Draw the runs of a group (format version 2), the background is set
+--@param f (reader): reader positioned at a run
+--@param fgColor (number): foreground color of the group
+--@param tile (table): first and last column and row {x0, y0, x1, y1} of a
+--tile of an indexed image, the runs end at the first run outside of it
+--@see image._drawGroups for the other parameters
+function image._drawRuns(f, res, xOff, yOff, xCut, yCut, fgColor, colors, delta, tile)
+  local lowChar = unicode.char(0x2584)
+  local yPrev, xEnd = 0, 0
+
+  --run loop, x y and length then the symbols, until the 255 delimiter
+  while true do
+    local x = f:bytes(1)
+    if x == 255 then break end
+    local y, n = f:bytes(2)
+    if tile and (x < tile[1] or y < tile[2] or x > tile[3] or y > tile[4]) then break end
+
+    --rows since the run before, cells since its end on the same row
+    if delta then
+      if y == 0 then x = x + xEnd end
+      y = y + yPrev
+      yPrev, xEnd = y, x + n
+    end
+    x = x + xOff
+    y = y + yOff
+    local fill, str
+    local blank = false
+
+    if res == hres then
+      --the kind byte comes with the first symbol, set runs hold n symbols
+      local kind, symbol = f:bytes(2)
+      if kind == 1 then
+        fill = unicode.char(0x2800 + symbol)
+        blank = symbol == 0
+      else
+        local codes = {symbol, f:bytes(n - 1)}
+        for i=1,n,1 do
+          codes[i] = 0x2800 + codes[i]
+        end
+        str = unicode.char(table.unpack(codes))
+      end
+    else
+      fill = lowChar
+    end
+
+    local visible = math.min(n, xCut - x + 1)
+    if y <= yCut and visible > 0 then
+      --blank runs show only the background
+      if not blank and fgColor ~= colors.fg then
+        colors.fg = fgColor
+        gpu.setForeground(fgColor)
+      end
+
+      if fill then
+        gpu.fill(x, y, visible, 1, fill)
+      else
+        gpu.set(x, y, unicode.sub(str, 1, visible))
+      end
+    end
+  end
+end
+
 --Write low resolution image to display
---@param f (file): open file at position 7th byte
+--@param f (reader): reader at position 7th byte
 --@param xOff, yOff (number, number): start offset from top left
 --@param xCut, yCut (number, number): max number of units in each dimension from top left
 --@param timer (boolean): true returns time in seconds for imshow
@@ -144,26 +680,19 @@ function image._showLRes(f, xOff, yOff, xCut, yCut, timer)
 
   xCut = xCut + xOff
   yCut = yCut + yOff
-  xSize = f:read(1):byte()
-  ySize = f:read(1):byte()
+  xSize, ySize = f:bytes(2)
 
   if xSize > xMax or ySize > yMax then
     io.stderr:write(string.format("Error - wrong size (x,y): %i %i\n", xSize, ySize))
     return
   end
   
-  local paletteLen = f:read(1):byte()
-  
-  for i=0,paletteLen-1,1 do
-    local color = "0x"
-    for j=1,3,1 do
-      color = color .. string.format("%02x", f:read(1):byte())
-    end
-    gpu.setPaletteColor(i, tonumber(color))
-  end
+  image._readPalette(f)
   
   --get current colors
   local bgColorCur, fgColorCur = image.getColors()
+  local colorTable = image._colorTable()
+  local lowChar = unicode.char(0x2584)
   
   --main variables
   local bgColor, bgColorPrev
@@ -173,44 +702,36 @@ function image._showLRes(f, xOff, yOff, xCut, yCut, timer)
   
   --main loop
   while chunknum < xSize*ySize do
-    --get bgColor
-    bgColor = "0x"
-    fb = f:read(1):byte()
-    local r,g,b = image._byte2RGB(fb)
-    bgColor = "0x" .. string.format("%02x%02x%02x", r, g ,b)
+    local bg, fg = f:bytes(2)
 
     --don't change bgColor if it hasn't changed
+    bgColor = colorTable[bg]
     if bgColor ~= bgColorPrev then
       bgColorPrev = bgColor
-      gpu.setBackground(tonumber(bgColor))
+      gpu.setBackground(bgColor)
     end
 
-    --get fgColor
-    fgColor = "0x"
-    fb = f:read(1):byte()
-    local r,g,b = image._byte2RGB(fb)
-    fgColor = "0x" .. string.format("%02x%02x%02x", r, g ,b)
-
     --don't change fgColor if it hasn't changed
+    fgColor = colorTable[fg]
     if fgColor ~= fgColorPrev then
       fgColorPrev = fgColor
-      gpu.setForeground(tonumber(fgColor))
+      gpu.setForeground(fgColor)
     end
 
-    fb = f:read(1):byte()
+    fb = f:bytes(1)
 
     --table entry loop, get coordinates and paint pixel
     while(fb ~= 255) do
       local x = fb + xOff
-      local y = f:read(1):byte() + yOff
+      local y = f:bytes(1) + yOff
 
       if x > xCut or y > yCut then goto continue end
       
-      gpu.set(x, y, unicode.char(0x2584))
+      gpu.set(x, y, lowChar)
       
       ::continue::
       
-      fb = f:read(1):byte()
+      fb = f:bytes(1)
       chunknum = chunknum + 1
     end
 
@@ -225,7 +746,7 @@ function image._showLRes(f, xOff, yOff, xCut, yCut, timer)
 end
 
 --Write high resolution image to display
---@param f (file): open file at position 7th byte
+--@param f (reader): reader at position 7th byte
 --@param xOff, yOff (number, number): start offset from top left
 --@param xCut, yCut (number, number): max number of units in each dimension from top left
 --@param timer (boolean): true returns time in seconds for imshow
@@ -236,17 +757,8 @@ function image._showHRes(f, xOff, yOff, xCut, yCut, timer)
 
   xCut = xCut + xOff
   yCut = yCut + yOff
-  xSize = f:read(1):byte()
-  ySize = f:read(1):byte()
-  local paletteLen = f:read(1):byte()
-  
-  for i=0,paletteLen-1,1 do
-    local color = "0x"
-    for j=1,3,1 do
-      color = color .. string.format("%02x", f:read(1):byte())
-    end
-    gpu.setPaletteColor(i, tonumber(color))
-  end
+  xSize, ySize = f:bytes(2)
+  image._readPalette(f)
 
   if xSize > xMax or ySize > yMax then
     io.stderr:write(string.format("Error - wrong size (x,y): %i %i\n", xSize, ySize))
@@ -255,62 +767,53 @@ function image._showHRes(f, xOff, yOff, xCut, yCut, timer)
   
   --get current colors
   local bgColorCur, fgColorCur = image.getColors()
+  local colorTable = image._colorTable()
   
   --main variables
   local bgColor, bgColorPrev
   local fgColor, fgColorPrev
-  local symbol
+  local symbol, char
   local chunknum = 1
   local fb
 
   --main loop
   while chunknum < xSize*ySize do
 
-    fb = f:read(1):byte()
-    symbol = fb
-
-    --get bgColor
-    fb = f:read(1):byte()
-    local r,g,b = image._byte2RGB(fb)
-    bgColor = "0x" .. string.format("%02x%02x%02x", r, g ,b)
+    symbol, fb = f:bytes(2)
+    char = unicode.char(0x2800 + symbol)
 
     --don't change bgColor if it hasn't changed
+    bgColor = colorTable[fb]
     if bgColor ~= bgColorPrev then
       bgColorPrev = bgColor
-      gpu.setBackground(tonumber(bgColor))
+      gpu.setBackground(bgColor)
     end
 
     --not fill check
     if symbol ~= 0 then
-      fgColor = "0x"
-
-      --get fgColor
-      fb = f:read(1):byte()
-      local r,g,b = image._byte2RGB(fb)
-      fgColor = "0x" .. string.format("%02x%02x%02x", r, g ,b)
-
       --don't change fgColor if it hasn't changed
+      fgColor = colorTable[f:bytes(1)]
       if fgColor ~= fgColorPrev then
         fgColorPrev = fgColor
-        gpu.setForeground(tonumber(fgColor))
+        gpu.setForeground(fgColor)
       end
 
     end
 
-    fb = f:read(1):byte()
+    fb = f:bytes(1)
 
     --table entry loop, get coordinates and paint pixel
     while(fb ~= 255) do
       local x = fb + xOff
-      local y = f:read(1):byte() + yOff
+      local y = f:bytes(1) + yOff
       
       if x > xCut or y > yCut then goto continue end
 
-      gpu.set(x, y, unicode.char(0x2800 + symbol))
+      gpu.set(x, y, char)
       
       ::continue::
       
-      fb = f:read(1):byte()
+      fb = f:bytes(1)
       chunknum = chunknum + 1
     end
 